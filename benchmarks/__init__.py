@@ -0,0 +1 @@
+"""Offline benchmarks (không cần Redis / Mongo / Qdrant server)"""
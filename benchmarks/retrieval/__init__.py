@@ -0,0 +1,18 @@
+"""
+Offline retrieval benchmark
+Index corpus CSV (cid, text) vào Qdrant local/in-memory, chạy các biến thể search của LegalRAGService
+trên tập query → cid có nhãn, báo cáo recall@k, MRR, nDCG, latency p50/p95/p99 và QPS dạng JSON.
+
+Chỉ import app.services / app.config (create_vector/app_modules.py): app/__init__ không chạy,
+nên stdout chỉ chứa report JSON.
+"""
+import os
+import sys
+
+_SRC = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+if _SRC not in sys.path:
+    sys.path.insert(0, _SRC)  # `app` / `create_vector` nằm trong src/ (giống PYTHONPATH của container backend)
+
+from create_vector.app_modules import register_app_package  # noqa: E402
+
+register_app_package()
@@ -0,0 +1,5 @@
+import sys
+
+from benchmarks.retrieval.run import main
+
+sys.exit(main())
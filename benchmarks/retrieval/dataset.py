@@ -0,0 +1,119 @@
+"""
+Corpus + labeled queries cho benchmark
+- corpus: CSV mà các indexer đọc (cột `cid`, `text`, metadata luật nếu có)
+- queries: CSV/JSONL có `question` (hoặc `query`) và `cid` (int, list hoặc chuỗi "[1, 2]")
+"""
+import csv
+import json
+import random
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from app.services.context_packer import estimate_tokens
+
+CID_PATTERN = re.compile(r"\d+")
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?]) +")
+METADATA_COLUMNS = ("law_type", "issued_year", "validity_status")
+
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))  # văn bản luật dài hơn giới hạn mặc định 128KB
+
+
+@dataclass
+class LabeledQuery:
+    question: str
+    relevant: Set[int] = field(default_factory=set)
+
+
+def parse_cids(value) -> Set[int]:
+    if value is None:
+        return set()
+    if isinstance(value, int):
+        return {value}
+    if isinstance(value, (list, tuple, set)):
+        return {int(cid) for cid in value}
+    return {int(cid) for cid in CID_PATTERN.findall(str(value))}
+
+
+def load_corpus(path: str, limit: Optional[int] = None) -> List[dict]:
+    """Đọc corpus CSV (cid, text, metadata); bỏ dòng thiếu text"""
+    documents = []
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            text = (row.get("text") or "").strip()
+            if not text or not row.get("cid"):
+                continue
+            metadata = {
+                column: int(row[column]) if column == "issued_year" else row[column]
+                for column in METADATA_COLUMNS
+                if row.get(column)
+            }
+            documents.append({"cid": int(row["cid"]), "text": text, **metadata})
+            if limit and len(documents) >= limit:
+                break
+    return documents
+
+
+def load_queries(path: str, limit: Optional[int] = None) -> List[LabeledQuery]:
+    """Đọc query có nhãn từ .jsonl hoặc .csv"""
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    queries = []
+    for row in rows:
+        question = (row.get("question") or row.get("query") or "").strip()
+        relevant = parse_cids(row.get("cid", row.get("cids")))
+        if question and relevant:
+            queries.append(LabeledQuery(question, relevant))
+        if limit and len(queries) >= limit:
+            break
+    return queries
+
+
+def sample_queries(documents: List[dict], n: int, seed: int = 13, max_words: int = 24) -> List[LabeledQuery]:
+    """
+    Query tổng hợp khi chưa có tập nhãn: max_words từ đầu của n văn bản ngẫu nhiên → cid của nó.
+    Chỉ dùng để so sánh tương đối giữa các biến thể / commit.
+    """
+    rng = random.Random(seed)
+    picked = rng.sample(documents, min(n, len(documents)))
+    return [LabeledQuery(" ".join(document["text"].split()[:max_words]), {document["cid"]}) for document in picked]
+
+
+def create_fixed_chunks(text: str, max_word_count: int = 400) -> List[str]:
+    """Cùng cách chia chunk với create_vector/index_corpus_to_qdrant.py"""
+    chunks, current_chunk, word_count = [], "", 0
+    for sentence in SENTENCE_SPLIT.split(text):
+        wc = len(sentence.split())
+        if word_count + wc > max_word_count:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+            current_chunk, word_count = sentence, wc
+        else:
+            current_chunk += " " + sentence if current_chunk else sentence
+            word_count += wc
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+def chunk_corpus(documents: List[dict], max_word_count: int = 400) -> List[Dict]:
+    """Payload của từng chunk (giống payload của indexer: cid, chunk_index, text, token_count, metadata)"""
+    chunks = []
+    for document in documents:
+        metadata = {column: document[column] for column in METADATA_COLUMNS if column in document}
+        for i, chunk in enumerate(create_fixed_chunks(document["text"], max_word_count)):
+            chunks.append({
+                "cid": document["cid"],
+                "chunk_index": i,
+                "text": chunk,
+                "source": "benchmark",
+                "token_count": estimate_tokens(chunk),
+                **metadata
+            })
+    return chunks
@@ -0,0 +1,194 @@
+"""
+Embedder cho benchmark (cùng interface với EmbeddingHandler: encode / aencode / encode_query_sparse)
+- HashingEmbedder: dense vector tất định từ hashing unigram + bigram, không gọi API
+- DiskCachedEmbedder: bọc embedder thật, lưu vector vào SQLite để các lần chạy sau không gọi lại provider
+- BGEM3Embedder: BGE-M3 local (FlagEmbedding), cùng model với indexer corpus
+- StoreEmbedder: lấy vector chunk từ embedding store của indexer (app/services/embedding_store.py), miss → inner
+encode(..., dimensions=N): cắt Matryoshka + chuẩn hoá lại như EmbeddingHandler (cache / store luôn giữ vector đầy đủ)
+"""
+import hashlib
+import sqlite3
+import threading
+import zlib
+from typing import Dict, List, Union
+
+import numpy as np
+
+from app.services.embedding_cache import EmbeddingCache
+from app.services.embeddings import truncate_embeddings
+from app.services.sparse_encoder import SparseEncoder
+
+
+class HashingEmbedder:
+    """Signed feature hashing → vector chuẩn hoá L2 (tất định giữa các lần chạy / process)"""
+
+    def __init__(self, dim: int = 256, sparse_encoder: SparseEncoder = None):
+        self.dim = dim
+        self.model_name = f"hashing-{dim}"
+        self.sparse_encoder = sparse_encoder or SparseEncoder()
+
+    def _embed(self, text: str) -> List[float]:
+        tokens = SparseEncoder.tokenize(text)
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def encode(self, texts: Union[str, List[str]], return_dense: bool = True, return_sparse: bool = False, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        result = {}
+        if return_dense:
+            vectors = [self._embed(text) for text in texts]
+            result["dense_vecs"] = truncate_embeddings(vectors, kwargs.get("dimensions"))
+        if return_sparse:
+            result["sparse_vecs"] = self.sparse_encoder.encode(texts)
+        return result
+
+    async def aencode(self, texts: Union[str, List[str]], return_dense: bool = True, return_sparse: bool = False, **kwargs):
+        return self.encode(texts, return_dense=return_dense, return_sparse=return_sparse, **kwargs)
+
+    def encode_query_sparse(self, query: str) -> Dict[str, list]:
+        return self.sparse_encoder.encode_query(query)
+
+
+class DiskCachedEmbedder:
+    """Cache dense vector của embedder thật trong SQLite (key = model + text chuẩn hoá)"""
+
+    def __init__(self, inner, path: str):
+        """
+        inner: EmbeddingHandler (nên tắt cache Redis: cache=None)
+        path: file SQLite, dùng lại giữa các lần chạy
+        """
+        self.inner = inner
+        self.model_name = inner.model_name
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(
+            f"{self.model_name}\x00{EmbeddingCache.normalize_text(text)}".encode("utf-8")
+        ).hexdigest()
+
+    def _encode_dense(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            rows = {}
+            for start in range(0, len(keys), 500):  # giới hạn số biến của SQLite
+                batch = keys[start:start + 500]
+                rows.update(self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall())
+        vectors = [EmbeddingCache.unpack(rows[key]) if key in rows else None for key in keys]
+
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(keys[i], []).append(i)
+        self.stats["hits"] += len(texts) - sum(len(positions) for positions in missing.values())
+        self.stats["misses"] += len(missing)
+        if missing:
+            miss_texts = [texts[positions[0]] for positions in missing.values()]
+            fresh = self.inner.encode(miss_texts, return_dense=True)["dense_vecs"]
+            with self._lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, EmbeddingCache.pack(vector)) for key, vector in zip(missing, fresh)]
+                )
+                self._db.commit()
+            for positions, vector in zip(missing.values(), fresh):
+                vector = vector.tolist() if hasattr(vector, "tolist") else list(vector)
+                for i in positions:
+                    vectors[i] = vector
+        return vectors
+
+    def encode(self, texts: Union[str, List[str]], return_dense: bool = True, return_sparse: bool = False, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        result = {}
+        if return_dense:
+            result["dense_vecs"] = truncate_embeddings(self._encode_dense(texts), kwargs.get("dimensions"))
+        if return_sparse:
+            result["sparse_vecs"] = self.inner.sparse_encoder.encode(texts)
+        return result
+
+    async def aencode(self, texts: Union[str, List[str]], return_dense: bool = True, return_sparse: bool = False, **kwargs):
+        return self.encode(texts, return_dense=return_dense, return_sparse=return_sparse, **kwargs)
+
+    def encode_query_sparse(self, query: str) -> Dict[str, list]:
+        return self.inner.encode_query_sparse(query)
+
+    def close(self):
+        self._db.close()
+
+
+class BGEM3Embedder:
+    """BGE-M3 dense (FlagEmbedding, optional dependency) + BM25 sparse local"""
+
+    def __init__(self, model_name: str = "BAAI/bge-m3", use_fp16: bool = True, sparse_encoder: SparseEncoder = None):
+        from FlagEmbedding import BGEM3FlagModel
+        self.model_name = model_name
+        self.model = BGEM3FlagModel(model_name, use_fp16=use_fp16)
+        self.sparse_encoder = sparse_encoder or SparseEncoder()
+
+    def encode(self, texts: Union[str, List[str]], return_dense: bool = True, return_sparse: bool = False, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        result = {}
+        if return_dense:
+            result["dense_vecs"] = truncate_embeddings(self.model.encode(texts)["dense_vecs"], kwargs.get("dimensions"))
+        if return_sparse:
+            result["sparse_vecs"] = self.sparse_encoder.encode(texts)
+        return result
+
+    async def aencode(self, texts: Union[str, List[str]], return_dense: bool = True, return_sparse: bool = False, **kwargs):
+        return self.encode(texts, return_dense=return_dense, return_sparse=return_sparse, **kwargs)
+
+    def encode_query_sparse(self, query: str) -> Dict[str, list]:
+        return self.sparse_encoder.encode_query(query)
+
+
+class StoreEmbedder:
+    """Vector chunk đọc từ embedding store (key = sha256 của text chunk); query và chunk thiếu → inner"""
+
+    def __init__(self, inner, store):
+        if store.model != inner.model_name:
+            raise ValueError(f"Embedding store holds `{store.model}` vectors but the embedder is `{inner.model_name}`")
+        self.inner = inner
+        self.store = store
+        self.model_name = inner.model_name
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _encode_dense(self, texts: List[str]) -> List[List[float]]:
+        keys = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]  # = manifest.content_hash
+        found = self.store.get(keys)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        self.stats["hits"] += len(texts) - len(missing)
+        self.stats["misses"] += len(missing)
+        vectors = [found[key].tolist() if key in found else None for key in keys]
+        if missing:
+            fresh = self.inner.encode([texts[i] for i in missing], return_dense=True)["dense_vecs"]
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector.tolist() if hasattr(vector, "tolist") else list(vector)
+        return vectors
+
+    def encode(self, texts: Union[str, List[str]], return_dense: bool = True, return_sparse: bool = False, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        result = {}
+        if return_dense:
+            result["dense_vecs"] = truncate_embeddings(self._encode_dense(texts), kwargs.get("dimensions"))
+        if return_sparse:
+            result["sparse_vecs"] = self.inner.encode(texts, return_dense=False, return_sparse=True)["sparse_vecs"]
+        return result
+
+    async def aencode(self, texts: Union[str, List[str]], return_dense: bool = True, return_sparse: bool = False, **kwargs):
+        return self.encode(texts, return_dense=return_dense, return_sparse=return_sparse, **kwargs)
+
+    def encode_query_sparse(self, query: str) -> Dict[str, list]:
+        return self.inner.encode_query_sparse(query)
@@ -0,0 +1,68 @@
+"""
+Metric truy hồi theo cid (nhiều chunk cùng cid chỉ tính một lần) + thống kê latency
+"""
+import math
+from typing import Dict, Iterable, List, Sequence, Set
+
+
+def ranked_cids(hits: List[dict]) -> List[int]:
+    """cid theo thứ hạng, bỏ trùng (giữ lần xuất hiện đầu)"""
+    seen, ranked = set(), []
+    for hit in hits:
+        cid = hit.get("cid")
+        if cid is None or cid in seen:
+            continue
+        seen.add(cid)
+        ranked.append(int(cid))
+    return ranked
+
+
+def recall_at_k(ranked: Sequence[int], relevant: Set[int], k: int) -> float:
+    return len(relevant.intersection(ranked[:k])) / len(relevant) if relevant else 0.0
+
+
+def reciprocal_rank(ranked: Sequence[int], relevant: Set[int], k: int) -> float:
+    for rank, cid in enumerate(ranked[:k], start=1):
+        if cid in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked: Sequence[int], relevant: Set[int], k: int) -> float:
+    """nDCG nhị phân (relevant = 1)"""
+    dcg = sum(1.0 / math.log2(rank + 1) for rank, cid in enumerate(ranked[:k], start=1) if cid in relevant)
+    ideal = sum(1.0 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile (q trong [0, 100])"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def latency_summary(latencies_ms: Sequence[float]) -> Dict[str, float]:
+    return {
+        "p50": round(percentile(latencies_ms, 50), 3),
+        "p95": round(percentile(latencies_ms, 95), 3),
+        "p99": round(percentile(latencies_ms, 99), 3),
+        "mean": round(sum(latencies_ms) / len(latencies_ms), 3) if latencies_ms else 0.0,
+        "max": round(max(latencies_ms), 3) if latencies_ms else 0.0
+    }
+
+
+def quality_summary(rankings: Iterable[Sequence[int]], relevant_sets: Iterable[Set[int]], ks: Sequence[int]) -> Dict[str, float]:
+    """recall@k cho mỗi k, MRR@max(k), nDCG@max(k) trung bình trên các query"""
+    rankings, relevant_sets = list(rankings), list(relevant_sets)
+    n = len(rankings) or 1
+    top = max(ks)
+    summary = {
+        f"recall@{k}": sum(recall_at_k(r, rel, k) for r, rel in zip(rankings, relevant_sets)) / n
+        for k in ks
+    }
+    summary[f"mrr@{top}"] = sum(reciprocal_rank(r, rel, top) for r, rel in zip(rankings, relevant_sets)) / n
+    summary[f"ndcg@{top}"] = sum(ndcg_at_k(r, rel, top) for r, rel in zip(rankings, relevant_sets)) / n
+    return {name: round(value, 4) for name, value in summary.items()}
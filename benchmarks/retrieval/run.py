@@ -0,0 +1,311 @@
+"""
+Retrieval benchmark runner
+
+Usage (từ thư mục gốc repo):
+    python -m benchmarks.retrieval --corpus data/corpus.csv --queries data/train.csv --output bench.json
+    python -m benchmarks.retrieval --corpus data/corpus.csv --sample-queries 500 --variants dense hybrid hybrid+refine
+    python -m benchmarks.retrieval --corpus data/corpus.csv --queries data/train.csv --embedder openai --qdrant-path /tmp/bench-qdrant
+    python -m benchmarks.retrieval --corpus data/corpus.csv --queries data/train.csv --embedder bge-m3 --embedding-store embeddings/bge-m3
+    python -m benchmarks.retrieval --corpus data/corpus.csv --queries data/train.csv --embedder openai --dimensions 256 512 768 1536
+
+Biến thể: <mode>[+refine][+expand], mode = dense | sparse | hybrid
+- refine: near-duplicate → rerank → MMR (theo RERANK_* / MMR_* trong settings, override bằng biến môi trường)
+- expand: gộp chunk lân cận (EXPANSION_WINDOW)
+Cache kết quả, hot-set và answer cache bị tắt để đo đúng đường truy vấn Qdrant.
+--dimensions: chunk được embed một lần ở số chiều đầy đủ, mỗi số chiều một collection (cắt Matryoshka),
+query tự được cắt theo số chiều của collection → báo cáo recall / latency cạnh bộ nhớ vector.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct, SparseVector
+
+from app.config.settings import cfg_settings
+from app.services.embeddings import truncate_embeddings
+from app.services.qdrant_collections import (
+    DENSE_VECTOR_NAME,
+    SPARSE_VECTOR_NAME,
+    collection_dimensions,
+    ensure_collection,
+)
+from benchmarks.retrieval.dataset import LabeledQuery, chunk_corpus, load_corpus, load_queries, sample_queries
+from benchmarks.retrieval.embedders import BGEM3Embedder, DiskCachedEmbedder, HashingEmbedder, StoreEmbedder
+from benchmarks.retrieval.metrics import latency_summary, quality_summary, ranked_cids
+
+logger = logging.getLogger("benchmarks.retrieval")
+
+DEFAULT_VARIANTS = ["dense", "sparse", "hybrid", "hybrid+refine"]
+DEFAULT_EMBEDDING_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "embeddings.sqlite")
+
+
+# ---------- Setup ----------
+def build_embedder(args):
+    if args.embedder == "hashing":
+        embedder = HashingEmbedder(dim=args.dim)
+    elif args.embedder == "bge-m3":
+        embedder = BGEM3Embedder(args.model or "BAAI/bge-m3")
+    else:
+        from app.services.embeddings import EmbeddingHandler
+        os.makedirs(os.path.dirname(os.path.abspath(args.embedding_cache)), exist_ok=True)
+        inner = EmbeddingHandler(provider=args.embedder, model_name=args.model or cfg_settings.EMBEDDING_MODEL, cache=None)
+        embedder = DiskCachedEmbedder(inner, args.embedding_cache)
+    if args.embedding_store:
+        # vector chunk đã encode bởi indexer (--store) → chỉ query phải encode
+        from app.services.embedding_store import EmbeddingStore
+        embedder = StoreEmbedder(embedder, EmbeddingStore(args.embedding_store, read_only=True))
+    return embedder
+
+
+def build_client(args) -> QdrantClient:
+    """Qdrant local mode: in-memory (mặc định) hoặc thư mục --qdrant-path (dùng lại index giữa các lần chạy)"""
+    return QdrantClient(path=args.qdrant_path) if args.qdrant_path else QdrantClient(location=":memory:")
+
+
+def encode_chunks(embedder, chunks: List[dict], batch_size: int = 256) -> Tuple[List[list], List[dict], float]:
+    """Dense (đầy đủ số chiều) + BM25 sparse cho mọi chunk, một lần cho tất cả collection"""
+    start = time.perf_counter()
+    dense_vecs, sparse_vecs = [], []
+    for offset in range(0, len(chunks), batch_size):
+        encoded = embedder.encode(
+            [chunk["text"] for chunk in chunks[offset:offset + batch_size]], return_dense=True, return_sparse=True
+        )
+        dense_vecs.extend(dense.tolist() if hasattr(dense, "tolist") else list(dense) for dense in encoded["dense_vecs"])
+        sparse_vecs.extend(encoded["sparse_vecs"])
+    return dense_vecs, sparse_vecs, time.perf_counter() - start
+
+
+def build_index(client, collection_name: str, chunks: List[dict], encoded, batch_size: int = 256,
+                dimensions: Optional[int] = None) -> dict:
+    """Index chunk (dense + BM25 sparse) giống payload của indexer thật; dimensions: cắt Matryoshka"""
+    dense_vecs, sparse_vecs, encode_seconds = encoded
+    start = time.perf_counter()
+    vector_size = dimensions or len(dense_vecs[0])
+    ensure_collection(client, collection_name, vector_size=vector_size, with_sparse=True, quantization="none", on_disk=False)
+    for offset in range(0, len(chunks), batch_size):
+        batch = chunks[offset:offset + batch_size]
+        dense_batch = truncate_embeddings(dense_vecs[offset:offset + batch_size], dimensions)
+        client.upsert(
+            collection_name=collection_name,
+            points=[
+                PointStruct(
+                    id=offset + i,
+                    vector={DENSE_VECTOR_NAME: dense, SPARSE_VECTOR_NAME: SparseVector(**sparse)},
+                    payload=chunk
+                )
+                for i, (chunk, dense, sparse) in enumerate(zip(batch, dense_batch, sparse_vecs[offset:offset + batch_size]))
+            ]
+        )
+    return {
+        "chunks": len(chunks),
+        "vector_size": vector_size,
+        "encode_seconds": round(encode_seconds, 3),
+        "build_seconds": round(time.perf_counter() - start, 3)
+    }
+
+
+def vector_memory(points: int, dimensions: int) -> dict:
+    """RAM cho dense vector (MB): float32 gốc, scalar int8 và binary quantization"""
+    return {
+        "float32_mb": round(points * dimensions * 4 / 2 ** 20, 2),
+        "int8_mb": round(points * dimensions / 2 ** 20, 2),
+        "binary_mb": round(points * dimensions / 8 / 2 ** 20, 2)
+    }
+
+
+def build_service(client, embedder):
+    """LegalRAGService trên client/embedder của benchmark, không dùng Redis"""
+    cfg_settings.RETRIEVAL_CACHE_ENABLED = False
+    cfg_settings.HOT_SET_ENABLED = False
+    cfg_settings.ANSWER_CACHE_ENABLED = False
+    from app.services.rag_service import LegalRAGService
+    service = LegalRAGService(vector_client=client, embedder=embedder)
+    if service.reranker is not None:
+        service.reranker.redis_client = None  # pair cache sẽ làm latency phụ thuộc lần chạy trước
+    return service
+
+
+# ---------- Run ----------
+def parse_variant(name: str) -> dict:
+    mode, *stages = name.split("+")
+    unknown = set(stages) - {"refine", "expand"}
+    if mode not in ("dense", "sparse", "hybrid") or unknown:
+        raise ValueError(f"Unknown variant `{name}`")
+    return {"mode": mode, "refine": "refine" in stages, "expand": "expand" in stages}
+
+
+def run_query(service, collection_name: str, query: LabeledQuery, variant: dict, top_k: int):
+    start = time.perf_counter()
+    limit = service.candidate_limit(top_k) if variant["refine"] else top_k
+    hits = service.search(collection_name, query.question, limit=limit, use_cache=False, mode=variant["mode"])
+    if variant["refine"]:
+        hits = service.refine(collection_name, query.question, hits, top_k)
+    if variant["expand"]:
+        hits = service.expand(collection_name, hits)
+    return ranked_cids(hits[:top_k]), (time.perf_counter() - start) * 1000
+
+
+def run_variant(service, collection_name: str, queries: List[LabeledQuery], name: str, ks: List[int],
+                concurrency: int = 1, warmup: int = 0) -> dict:
+    variant = parse_variant(name)
+    top_k = max(ks)
+    for query in queries[:warmup]:
+        run_query(service, collection_name, query, variant, top_k)
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda q: run_query(service, collection_name, q, variant, top_k), queries))
+    else:
+        results = [run_query(service, collection_name, query, variant, top_k) for query in queries]
+    wall = time.perf_counter() - start
+
+    rankings = [ranking for ranking, _ in results]
+    latencies = [latency for _, latency in results]
+    return {
+        "mode": service.resolve_mode(collection_name, variant["mode"]),
+        "queries": len(queries),
+        **quality_summary(rankings, [query.relevant for query in queries], ks),
+        "latency_ms": latency_summary(latencies),
+        "qps": round(len(queries) / wall, 2) if wall else 0.0
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def run(args) -> dict:
+    embedder = build_embedder(args)
+    documents = load_corpus(args.corpus, limit=args.max_docs)
+    if args.queries:
+        queries = load_queries(args.queries, limit=args.max_queries)
+    else:
+        queries = sample_queries(documents, args.sample_queries, seed=args.seed)
+    if not documents or not queries:
+        raise ValueError("Empty corpus or query set")
+
+    # Query có nhãn trỏ tới cid nằm ngoài corpus đã nạp (--max-docs) → bỏ
+    indexed = {document["cid"] for document in documents}
+    queries = [query for query in queries if query.relevant & indexed]
+
+    client = build_client(args)
+    chunks, encoded = None, None
+    indexes = {}
+    for dimensions in args.dimensions or [None]:
+        collection_name = f"{args.collection}_d{dimensions}" if dimensions else args.collection
+        if args.qdrant_path and client.collection_exists(collection_name) and not args.rebuild:
+            index = {"chunks": client.count(collection_name).count, "reused": True}
+        else:
+            if client.collection_exists(collection_name):
+                client.delete_collection(collection_name)
+            if encoded is None:
+                chunks = chunk_corpus(documents, args.chunk_words)
+                encoded = encode_chunks(embedder, chunks, args.batch_size)
+                full_size = len(encoded[0][0])
+                if dimensions and max(args.dimensions) > full_size:
+                    raise ValueError(f"--dimensions {max(args.dimensions)} exceeds the {full_size}-d embedder")
+            index = build_index(client, collection_name, chunks, encoded, args.batch_size, dimensions)
+        index["documents"] = len(documents)
+        indexes[collection_name] = index
+
+    service = build_service(client, embedder)
+    report = {
+        "config": {
+            "revision": git_revision(),
+            "corpus": args.corpus,
+            "queries": args.queries or f"sampled:{args.sample_queries}",
+            "embedder": getattr(embedder, "model_name", args.embedder),
+            "ks": args.k,
+            "concurrency": args.concurrency,
+            "rerank_backend": cfg_settings.RERANK_BACKEND if service.reranker is not None else None,
+            "mmr": cfg_settings.MMR_ENABLED,
+            "expansion_window": cfg_settings.EXPANSION_WINDOW if cfg_settings.EXPANSION_ENABLED else 0
+        },
+    }
+    for collection_name, index in indexes.items():
+        variants = {}
+        for name in args.variants:
+            logger.info(f"Running variant {name} on {len(queries)} queries ({collection_name})")
+            variants[name] = run_variant(
+                service, collection_name, queries, name, args.k,
+                concurrency=args.concurrency, warmup=args.warmup
+            )
+        if not args.dimensions:
+            report.update({"index": index, "variants": variants})
+            continue
+        # query được service cắt theo số chiều thật của collection (collection_dimensions)
+        dimensions = collection_dimensions(client, collection_name)
+        report.setdefault("dimensions", {})[str(dimensions)] = {
+            "index": index,
+            "memory": vector_memory(index["chunks"], dimensions),
+            "variants": variants
+        }
+    if isinstance(embedder, StoreEmbedder):
+        report["config"]["embedding_store"] = embedder.stats
+        embedder = embedder.inner
+    if isinstance(embedder, DiskCachedEmbedder):
+        report["config"]["embedding_cache"] = embedder.stats
+        embedder.close()
+    return report
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark (Qdrant local mode)")
+    parser.add_argument("--corpus", required=True, help="Corpus CSV (cid, text)")
+    parser.add_argument("--queries", help="Labeled queries (.csv/.jsonl: question, cid)")
+    parser.add_argument("--sample-queries", type=int, default=200, help="Synthetic queries when --queries is missing")
+    parser.add_argument("--max-docs", type=int, help="Only index the first N documents")
+    parser.add_argument("--max-queries", type=int)
+    parser.add_argument("--variants", nargs="+", default=DEFAULT_VARIANTS)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5, 10])
+    parser.add_argument("--embedder", default="hashing", help="hashing | bge-m3 | openai (cached on disk)")
+    parser.add_argument("--model", help="Embedding model for real embedders (default: EMBEDDING_MODEL)")
+    parser.add_argument("--dim", type=int, default=256, help="Hashing embedder dimension")
+    parser.add_argument("--embedding-cache", default=DEFAULT_EMBEDDING_CACHE)
+    parser.add_argument("--embedding-store", help="Indexer embedding store dir (chunk vectors are not re-encoded)")
+    parser.add_argument("--dimensions", type=int, nargs="+",
+                        help="Matryoshka sweep: one collection per dimension, recall vs vector memory")
+    parser.add_argument("--qdrant-path", help="Qdrant local storage dir (default: in-memory)")
+    parser.add_argument("--collection", default="bench_legal_corpus")
+    parser.add_argument("--rebuild", action="store_true", help="Re-index even if --qdrant-path has the collection")
+    parser.add_argument("--chunk-words", type=int, default=400)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--output", help="Write JSON report here (default: stdout)")
+    return parser
+
+
+def main(argv=None) -> int:
+    # force: thay handler stdout nếu app logging đã được cài (stdout chỉ dành cho report)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(levelname)s %(message)s", force=True)
+    args = build_parser().parse_args(argv)
+    args.k = sorted(set(args.k))
+    try:
+        for name in args.variants:
+            parse_variant(name)
+        report = run(args)
+    except (ValueError, OSError) as e:
+        logger.error(str(e))
+        return 1
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        logger.info(f"Report written to {args.output}")
+    else:
+        print(output)
+    return 0
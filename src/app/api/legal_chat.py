@@ -65,7 +65,8 @@ async def send_legal_query(data: MessageInput):
     try:
         logger.info(f"Received legal query from user: {data.user_id}")
         
-        result = legal_chat_service.handle_legal_message(data)
+        # Mongo + answer-cache lookup là sync → chạy trong thread
+        result = await asyncio.to_thread(legal_chat_service.handle_legal_message, data)
         
         if result["status"] == "reused":
             logger.info(f"Returning reused legal advice for conversation: {result['conversation_id']}")
@@ -1,11 +1,17 @@
+import asyncio
+import logging
+import time
 from fastapi import APIRouter
-from app.models.api_schema import QueryRequest, TaskResponse, HealthResponse
-from app.tasks.retrieval_tasks import retrieval_document
+from fastapi.responses import JSONResponse
+from app.config.settings import cfg_settings
+from app.models.api_schema import APIResponse, QueryRequest, SearchRequest, TaskResponse, HealthResponse
+from app.tasks.retrieval_tasks import retrieval_document, rag_service
 from app.tasks.link_extract_tasks import get_links_and_extract_task
 from app.tasks.legal_embedding_tasks import embed_query_task, search_legal_documents
 from datetime import datetime
 
 router = APIRouter(prefix="/rag", tags=["rag"])
+logger = logging.getLogger(__name__)
 
 
 @router.get("/health")
@@ -25,7 +31,7 @@ def retrieve_docs(request: QueryRequest):
     """Retrieve legal documents"""
     try:
         task = retrieval_document.apply_async(
-            args=[request.query],
+            args=[request.query, request.queries, request.filters],
             queue='retrieval_queue',
         )
         return TaskResponse(
@@ -115,4 +121,74 @@ def search_documents(request: QueryRequest):
             message="Failed to start search task",
             error=str(e),
             timestamp=datetime.utcnow().isoformat()
-        )
\ No newline at end of file
+        )
+
+
+@router.post("/search/inline")
+async def search_documents_inline(request: SearchRequest):
+    """
+    Inline retrieval: embed + Qdrant search in the API process, ranked chunks in the response.
+    No Celery / Redis hand-off; fails fast with 504 when the deadline is exceeded, 503 when Qdrant/embedding fails.
+    (POST /rag/search vẫn là Celery task như cũ.)
+    """
+    start_time = time.perf_counter()
+    top_k = request.top_k or cfg_settings.RETRIEVAL_TOP_K
+    deadline_ms = request.deadline_ms or cfg_settings.RETRIEVAL_DEADLINE_MS
+    deadline = time.monotonic() + deadline_ms / 1000
+    sub_queries = list(dict.fromkeys([request.query] + (request.queries or [])))
+    try:
+        chunks = await asyncio.wait_for(
+            rag_service.asearch_many(
+                cfg_settings.LEGAL_COLLECTION,
+                sub_queries,
+                limit=rag_service.candidate_limit(top_k),
+                mode=request.mode,
+                filters=request.filters,
+                raise_errors=True  # lỗi Qdrant → 503, không trả 200 với chunks rỗng
+            ),
+            timeout=deadline_ms / 1000
+        )
+        # Dedupe → rerank → MMR, bỏ qua các bước không kịp trước deadline
+        chunks = await rag_service.arefine(cfg_settings.LEGAL_COLLECTION, sub_queries, chunks, top_k, deadline=deadline)
+        if time.monotonic() < deadline:
+            chunks = await rag_service.aexpand(cfg_settings.LEGAL_COLLECTION, chunks)
+    except asyncio.TimeoutError:
+        logger.warning(f"Inline search exceeded deadline of {deadline_ms} ms: {request.query[:100]}")
+        return JSONResponse(
+            status_code=504,
+            content=APIResponse(
+                success=False,
+                message="Retrieval deadline exceeded",
+                error=f"deadline {deadline_ms} ms",
+                timestamp=datetime.utcnow().isoformat()
+            ).model_dump()
+        )
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content=APIResponse(
+                success=False,
+                message="Invalid search request",
+                error=str(e),
+                timestamp=datetime.utcnow().isoformat()
+            ).model_dump()
+        )
+    except Exception as e:
+        logger.error(f"Inline search failed: {e}")
+        return JSONResponse(
+            status_code=503,
+            content=APIResponse(
+                success=False,
+                message="Document search failed",
+                error=str(e),
+                timestamp=datetime.utcnow().isoformat()
+            ).model_dump()
+        )
+
+    took_ms = (time.perf_counter() - start_time) * 1000
+    return APIResponse(
+        success=True,
+        message=f"Found {len(chunks)} chunks",
+        data={"chunks": chunks, "count": len(chunks), "took_ms": round(took_ms, 2)},
+        timestamp=datetime.utcnow().isoformat()
+    )
@@ -146,6 +146,9 @@ async def trigger_tools_and_combine_results(
     use_web_search = False
     use_retrieval = False
 
+    retrieval_inputs = []
+    legal_documents = None
+
     for action in actions:
         tool = action.get("tool")
         input_text = action.get("input")
@@ -157,9 +160,9 @@ async def trigger_tools_and_combine_results(
                 combined_results[tool] = True
                 
             elif tool == "laws_retrieval":
-                use_retrieval = True
-                await api_client.laws_retrieval(input_text)
-                combined_results[tool] = True
+                # Gom các laws_retrieval lại để chạy một lần (search_many)
+                if input_text:
+                    retrieval_inputs.append(input_text)
                 
             else:
                 combined_results[tool] = {"error": "Unknown tool"}
@@ -168,6 +171,27 @@ async def trigger_tools_and_combine_results(
             logger.error(f"Error calling {tool}: {str(e)}")
             combined_results[tool] = {"error": str(e)}
 
+    if retrieval_inputs:
+        analysis = llm_output.get("analysis", {})
+        rewritten_query = analysis.get("rewritten_query", "")
+        if analysis.get("query_type", "single") != "single" and rewritten_query:
+            retrieval_inputs.append(rewritten_query)
+        sub_queries = list(dict.fromkeys(retrieval_inputs))
+        try:
+            use_retrieval = True
+            search_result = await api_client.laws_search(sub_queries[0], sub_queries[1:] or None)
+            legal_documents = search_result["data"]["chunks"]
+            combined_results["laws_retrieval"] = True
+        except Exception as e:
+            # Quá deadline / lỗi → fallback về Celery retrieval (kết quả qua Redis)
+            logger.warning(f"Inline laws search failed, falling back to Celery: {str(e)}")
+            try:
+                await api_client.laws_retrieval(sub_queries[0], sub_queries[1:] or None)
+                combined_results["laws_retrieval"] = True
+            except Exception as e:
+                logger.error(f"Error calling laws_retrieval: {str(e)}")
+                combined_results["laws_retrieval"] = {"error": str(e)}
+
     # Generate response
     rewrite_query = llm_output.get("analysis", {}).get("rewritten_query", "")
     generate_payload = {
@@ -175,7 +199,8 @@ async def trigger_tools_and_combine_results(
         "user_id": user_id,
         "rewrite_query": rewrite_query,
         "use_web_search": use_web_search,
-        "use_retrieval": use_retrieval
+        "use_retrieval": use_retrieval,
+        "legal_documents": legal_documents
     }
 
     try:
@@ -5,7 +5,7 @@ Handles service discovery, retries, and circuit breaker pattern
 import httpx
 import asyncio
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 from .settings import cfg_settings
 import os
 
@@ -56,9 +56,13 @@ class InternalAPIClient:
         """Call web search service"""
         return await self.post("/api/rag/web_search", {"query": query})
     
-    async def laws_retrieval(self, query: str) -> Dict[str, Any]:
-        """Call laws retrieval service"""
-        return await self.post("/api/rag/retrieve", {"query": query})
+    async def laws_retrieval(self, query: str, queries: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Call laws retrieval service (extra sub-queries are searched in the same round trip)"""
+        return await self.post("/api/rag/retrieve", {"query": query, "queries": queries})
+    
+    async def laws_search(self, query: str, queries: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Inline laws retrieval: ranked chunks in the response (no Celery / Redis hand-off)"""
+        return await self.post("/api/rag/search/inline", {"query": query, "queries": queries})
     
     async def generate_response(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         """Call response generation service"""
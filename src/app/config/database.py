@@ -5,7 +5,8 @@ Supports both development and production K8s environments
 from pymongo import MongoClient
 from motor.motor_asyncio import AsyncIOMotorClient
 import redis
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
+import httpx
 import logging
 from typing import Optional
 from .settings import get_mongo_url, get_qdrant_url, get_redis_url, settings
@@ -22,6 +23,7 @@ class DatabaseManager:
         self._mongo_client_async: Optional[AsyncIOMotorClient] = None
         self._redis_clients: dict = {}
         self._qdrant_client: Optional[QdrantClient] = None
+        self._qdrant_client_async: Optional[AsyncQdrantClient] = None
     
     @property
     def mongo_client(self) -> MongoClient:
@@ -51,20 +53,21 @@ class DatabaseManager:
             )
         return self._mongo_client_async
     
-    def get_redis_client(self, db: int = 0) -> redis.Redis:
-        """Get Redis client for specific database"""
-        if db not in self._redis_clients:
+    def get_redis_client(self, db: int = 0, decode_responses: bool = True) -> redis.Redis:
+        """Get Redis client for specific database (decode_responses=False for binary payloads)"""
+        key = (db, decode_responses)
+        if key not in self._redis_clients:
             redis_url = get_redis_url(db)
             logger.info(f"Connecting to Redis DB {db}: {redis_url}")
-            self._redis_clients[db] = redis.from_url(
+            self._redis_clients[key] = redis.from_url(
                 redis_url,
-                decode_responses=True,
+                decode_responses=decode_responses,
                 max_connections=20,
                 socket_connect_timeout=5,
                 socket_timeout=5,
                 retry_on_timeout=True
             )
-        return self._redis_clients[db]
+        return self._redis_clients[key]
     
     @property
     def qdrant_client(self) -> QdrantClient:
@@ -79,6 +82,29 @@ class DatabaseManager:
             )
         return self._qdrant_client
     
+    @property
+    def qdrant_client_async(self) -> AsyncQdrantClient:
+        """Get asynchronous Qdrant client (pooled keep-alive connections, for FastAPI handlers)"""
+        if self._qdrant_client_async is None:
+            qdrant_url = get_qdrant_url()
+            logger.info(f"Connecting to async Qdrant: {qdrant_url}")
+            self._qdrant_client_async = AsyncQdrantClient(
+                url=qdrant_url,
+                api_key=settings.QDRANT_API_KEY,
+                timeout=30,
+                limits=httpx.Limits(
+                    max_connections=settings.QDRANT_ASYNC_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.QDRANT_ASYNC_MAX_CONNECTIONS
+                )
+            )
+        return self._qdrant_client_async
+    
+    async def close_async_connections(self):
+        """Close async clients (call from the FastAPI shutdown hook)"""
+        if self._qdrant_client_async:
+            await self._qdrant_client_async.close()
+            self._qdrant_client_async = None
+    
     def close_connections(self):
         """Close all database connections"""
         if self._mongo_client:
@@ -123,6 +149,7 @@ analysis_results_col_async = db_async["analysis_results"]
 redis_cache = db_manager.get_redis_client(0)      # General cache
 redis_sessions = db_manager.get_redis_client(1)   # Session storage
 redis_embed_cache = db_manager.get_redis_client(2) # Embedding cache
+redis_embed_cache_raw = db_manager.get_redis_client(2, decode_responses=False) # Embedding cache (packed float32 bytes)
 redis_celery_broker = db_manager.get_redis_client(3) # Celery broker
 redis_celery_result = db_manager.get_redis_client(4) # Celery results
 
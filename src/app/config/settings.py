@@ -46,6 +46,12 @@ class Settings(BaseSettings):
     QDRANT_HOST: str = os.getenv("QDRANT_HOST", "qdrant")
     QDRANT_PORT: str = os.getenv("QDRANT_PORT", "6333")
     QDRANT_API_KEY: Optional[str] = os.getenv("QDRANT_API_KEY")
+    # Opt-in for new collections (env) or existing ones (`python -m app.qdrant_admin migrate`)
+    QDRANT_QUANTIZATION: str = "none"  # scalar (int8) | binary | none
+    QDRANT_VECTORS_ON_DISK: bool = False  # True: original float32 vectors on disk, quantized copy in RAM
+    QDRANT_ASYNC_MAX_CONNECTIONS: int = 100  # AsyncQdrantClient connection pool size
+    LEGAL_COLLECTION: str = "legal_documents_collection"  # stable name; alias of the serving version after a blue/green rebuild
+    COLLECTION_KEEP_VERSIONS: int = 2  # versions kept after a swap (serving + rollback)
     
     # API and External Services
     INTERNAL_API_BASE: str = "http://localhost:8000"
@@ -55,8 +61,77 @@ class Settings(BaseSettings):
     DEFAULT_LLM_MODEL: str = "gpt-4o-mini"
     PROVIDER: str = "openai"
     EMBEDDING_MODEL: str = "text-embedding-3-small"
-    SIMILARITY_THRESHOLD: float = 0.95
-    
+    # Matryoshka: dense vectors truncated to the first N dims + L2-renormalized (text-embedding-3-*).
+    # Only applies to collections created afterwards; existing ones keep their size (`qdrant_admin rebuild --dimensions`).
+    LEGAL_EMBEDDING_DIMENSIONS: int = 1536
+    ANSWER_EMBEDDING_DIMENSIONS: int = 1536
+    # Provider requests: inputs packed by estimated tokens (OpenAI: 300k tokens / 2048 inputs per request)
+    EMBEDDING_MAX_BATCH_TOKENS: int = 200_000  # estimate is approximate → keep a margin
+    EMBEDDING_MAX_BATCH_INPUTS: int = 2048
+    EMBEDDING_MAX_INPUT_TOKENS: int = 6000  # per text (provider limit 8191); longer texts become several points
+    # Micro-batching: concurrent small (query) cache misses in one process coalesced into one provider call
+    EMBEDDING_MICRO_BATCH_ENABLED: bool = True
+    EMBEDDING_MICRO_BATCH_WINDOW_MS: float = 5.0
+    EMBEDDING_MICRO_BATCH_MAX_INPUTS: int = 64
+    EMBEDDING_CONCURRENCY: int = 4  # concurrent embeddings.create requests per handler
+    EMBEDDING_MAX_RETRIES: int = 6  # 429 / connection / 5xx, exponential backoff
+    EMBEDDING_RETRY_BASE_SECONDS: float = 1.0
+    SIMILARITY_THRESHOLD: float = 0.95  # search_legal_documents: min document score
+
+    # Answer Reuse Cache (chat_questions, invalidated by legal_index_version)
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_THRESHOLD: float = 0.95  # min cosine between questions to reuse an answer
+    ANSWER_CACHE_TTL: int = 7 * 24 * 3600  # 7 days
+
+    # Embedding Cache Configuration (Redis DB 2 + in-process LRU)
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_TTL: int = 7 * 24 * 3600  # 7 days
+    EMBEDDING_CACHE_LOCAL_SIZE: int = 4096
+
+    # Retrieval Configuration
+    RETRIEVAL_SEARCH_MODE: str = "hybrid"  # dense | sparse | hybrid (dense + BM25, RRF)
+    RETRIEVAL_TOP_K: int = 5  # final passages (after neighbor expansion)
+    RETRIEVAL_PREFETCH_MULTIPLIER: int = 4  # candidates per leg = top_k * multiplier
+    RETRIEVAL_QUANT_RESCORE: bool = True  # rescore quantized candidates with original vectors
+    RETRIEVAL_QUANT_OVERSAMPLING: float = 2.0
+    RETRIEVAL_DEADLINE_MS: int = 2000  # /api/rag/search/inline budget
+
+    # Rerank Stage
+    RERANK_ENABLED: bool = True
+    RERANK_BACKEND: str = "lexical"  # lexical | cross-encoder | onnx | none
+    RERANK_MODEL: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # cross-encoder model / ONNX tokenizer
+    RERANK_ONNX_PATH: str = ""
+    RERANK_BATCH_SIZE: int = 32
+    RERANK_CANDIDATES: int = 20  # vector search candidates passed to the reranker
+    RERANK_PRIOR_WEIGHT: float = 0.3  # weight of the original vector-search rank
+    RERANK_BUDGET_MS: int = 300  # default deadline for the Celery retrieval path
+    RERANK_CACHE_TTL: int = 24 * 3600
+
+    # Diversification (near-duplicate suppression + MMR)
+    DEDUP_THRESHOLD: float = 0.8  # shingle containment above which a chunk is a near-duplicate
+    DEDUP_SHINGLE_SIZE: int = 5
+    MMR_ENABLED: bool = True
+    MMR_LAMBDA: float = 0.7  # 1.0 = relevance only
+
+    # Neighbor-chunk Expansion
+    EXPANSION_ENABLED: bool = True
+    EXPANSION_WINDOW: int = 1  # ± chunks of the same cid/document_id around each hit
+
+    # Hot-set Tier (top-N most retrieved chunks in RAM, per worker)
+    HOT_SET_ENABLED: bool = True
+    HOT_SET_SIZE: int = 5000
+    HOT_SET_MIN_SCORE: float = 0.75  # best cosine below this → fall through to Qdrant
+    HOT_SET_REFRESH_SECONDS: int = 600
+    HOT_SET_EMBEDDING_STORE: Optional[str] = None  # indexer embedding store dir (mounted read-only): vectors by payload content_hash
+
+    # Retrieval Result Cache (keyed by legal_index_version)
+    RETRIEVAL_CACHE_ENABLED: bool = True
+    RETRIEVAL_CACHE_TTL: int = 3600  # 1 hour
+
+    # Prompt Context Packing
+    CONTEXT_TOKEN_BUDGET: int = 3000  # legal + web + history tokens in the RAG prompt
+    LLM_MAX_TOKENS: int = 5000
+
     # Task Configuration
     TASK_TIMEOUT: int = 300  # 5 minutes
     MAX_RETRIES: int = 3
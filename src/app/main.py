@@ -6,6 +6,7 @@ Production-ready FastAPI with structured logging, monitoring, and K8s support
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+import asyncio
 import sys
 import os
 
@@ -234,21 +235,21 @@ async def health_check():
         try:
             # Test Redis
             redis_client = db_manager.get_redis_client(0)
-            redis_client.ping()
+            await asyncio.to_thread(redis_client.ping)
         except:
             redis_status = "error"
             
         try:
             # Test MongoDB 
-            mongo_client = db_manager.mongo_client
-            mongo_client.admin.command('ismaster')
+            mongo_client = db_manager.mongo_client_async
+            await mongo_client.admin.command('ismaster')
         except:
             mongo_status = "error"
             
         try:
             # Test Qdrant
-            qdrant_client = db_manager.qdrant_client
-            qdrant_client.get_collections()
+            qdrant_client = db_manager.qdrant_client_async
+            await qdrant_client.get_collections()
         except:
             qdrant_status = "error"
             
@@ -268,6 +269,11 @@ async def health_check():
             "timestamp": datetime.utcnow().isoformat()
         }
 
+@app.on_event("shutdown")
+async def close_async_clients():
+    from app.config.database import db_manager
+    await db_manager.close_async_connections()
+
 # Include API routers with logging
 app.include_router(legal_chat_router, prefix=cfg_settings.API_V1_STR)
 app.include_router(rag.router, prefix=cfg_settings.API_V1_STR)
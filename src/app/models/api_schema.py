@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 # ======================================
 # STANDARDIZED API RESPONSE SCHEMAS
@@ -32,6 +32,16 @@ class HealthResponse(APIResponse):
 
 class QueryRequest(BaseModel):
     query: str
+    queries: Optional[List[str]] = None  # extra sub-queries fanned out in one retrieval
+    filters: Optional[Dict[str, Any]] = None  # law_type / issued_year / validity_status / cid / document_id
+    
+class SearchRequest(BaseModel):
+    query: str
+    queries: Optional[List[str]] = None
+    top_k: Optional[int] = None  # default RETRIEVAL_TOP_K
+    deadline_ms: Optional[int] = None  # default RETRIEVAL_DEADLINE_MS
+    mode: Optional[str] = None  # dense | sparse | hybrid
+    filters: Optional[Dict[str, Any]] = None  # e.g. {"law_type": "luật", "issued_year": 2024}
     
 class AnalyzeResponse(BaseModel):
     conversation_id: str
@@ -59,6 +69,7 @@ class GenerateInput(BaseModel):
     rewrite_query: str
     use_web_search: bool = True
     use_retrieval: bool = True
+    legal_documents: Optional[List[Dict[str, Any]]] = None  # chunks from /api/rag/search/inline (skip Redis polling)
 
 class MessageInput(BaseModel):
     user_id: str
@@ -0,0 +1,316 @@
+"""
+Qdrant maintenance commands for the legal collections
+
+Usage (inside the backend container):
+    python -m app.qdrant_admin migrate --quantization scalar --on-disk
+    python -m app.qdrant_admin migrate --collections legal_documents_collection --quantization binary
+    python -m app.qdrant_admin indexes --collections legal_documents_collection law_corpus_bge_v3
+
+Blue/green (version vật lý sau alias LEGAL_COLLECTION):
+    python -m app.qdrant_admin versions
+    python -m app.qdrant_admin rebuild --replace-legacy                 # lần đầu: chép collection legacy sang __v1
+    python -m app.qdrant_admin rebuild --model text-embedding-3-large   # embed lại payload text bằng model mới
+    python -m app.qdrant_admin swap --version 3
+    python -m app.qdrant_admin rollback
+
+Đổi embedding model (query được embed bằng EMBEDDING_MODEL → swap sang version của model khác bị từ chối):
+    1. python -m app.qdrant_admin rebuild --model text-embedding-3-large --no-swap
+    2. rollout backend + worker với EMBEDDING_MODEL=text-embedding-3-large, rồi trong môi trường mới
+       python -m app.qdrant_admin swap --version N
+    Giữa bước 2 và swap, query của model mới vẫn đi vào version cũ (kết quả kém, số chiều khác → []):
+    swap ngay khi rollout xong. Rollback về version của model cũ cần rollout lại EMBEDDING_MODEL cũ trước.
+    --allow-model-mismatch bỏ qua kiểm tra (chỉ khi biết chắc hai model cùng không gian vector).
+"""
+import argparse
+import json
+import logging
+import sys
+from typing import Optional
+
+from app.config.database import db_manager, redis_client_web
+from app.config.settings import cfg_settings
+from app.services import collection_versions as versions
+from app.services.qdrant_collections import (
+    ensure_collection,
+    ensure_payload_indexes,
+    migrate_collection,
+    payload_indexes_for,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COLLECTIONS = [cfg_settings.LEGAL_COLLECTION, "chat_questions"]
+
+
+def cmd_migrate(args) -> int:
+    """Bật quantization + on-disk vectors cho các collection đang chạy"""
+    client = db_manager.qdrant_client
+    failed = 0
+    for collection_name in args.collections:
+        try:
+            migrate_collection(
+                client,
+                collection_name,
+                quantization=args.quantization,
+                on_disk=args.on_disk
+            )
+            print(f"✅ {collection_name}: quantization={args.quantization}, on_disk={args.on_disk}")
+        except Exception as e:
+            failed += 1
+            logger.error(f"Migration failed for {collection_name}: {e}")
+            print(f"❌ {collection_name}: {e}")
+    return 1 if failed else 0
+
+
+def cmd_indexes(args) -> int:
+    """Khai báo payload index còn thiếu (cid, chunk_index, document_id, metadata luật, ...)"""
+    client = db_manager.qdrant_client
+    failed = 0
+    for collection_name in args.collections:
+        try:
+            created = ensure_payload_indexes(client, collection_name, payload_indexes_for(collection_name))
+            print(f"✅ {collection_name}: {created} payload indexes created")
+        except Exception as e:
+            failed += 1
+            logger.error(f"Payload index bootstrap failed for {collection_name}: {e}")
+            print(f"❌ {collection_name}: {e}")
+    return 1 if failed else 0
+
+
+def invalidate_caches():
+    """Alias đổi version → kết quả search / câu trả lời đã cache không còn đúng"""
+    from app.services.answer_cache import build_default_answer_cache
+    from app.services.retrieval_cache import build_default_retrieval_cache
+    retrieval_cache = build_default_retrieval_cache()
+    if retrieval_cache is None:
+        return
+    try:
+        index_version = retrieval_cache.bump_version()
+        answer_cache = build_default_answer_cache()
+        if answer_cache is not None:
+            answer_cache.purge_stale(index_version)
+    except Exception as e:
+        logger.warning(f"Cannot invalidate retrieval caches after swap: {e}")
+
+
+def _version_meta(collection_name: str) -> Optional[dict]:
+    try:
+        return versions.version_meta(redis_client_web, collection_name)
+    except Exception as e:
+        logger.warning(f"Cannot read model metadata of {collection_name}: {e}")
+        return None
+
+
+def _refuse_model_mismatch(collection_name: str, allow: bool, meta: Optional[dict] = None) -> bool:
+    """True nếu phải dừng: version được build bằng model khác EMBEDDING_MODEL đang phục vụ"""
+    meta = _version_meta(collection_name) if meta is None else meta
+    reason = versions.model_mismatch(meta, cfg_settings.EMBEDDING_MODEL)
+    if reason is None:
+        return False
+    if allow:
+        print(f"⚠️ {collection_name}: {reason} (--allow-model-mismatch)")
+        return False
+    print(f"❌ {collection_name}: {reason}; deploy EMBEDDING_MODEL first (see module docstring) "
+          f"or pass --allow-model-mismatch")
+    return True
+
+
+def cmd_versions(args) -> int:
+    client = db_manager.qdrant_client
+    current = versions.alias_target(client, args.alias)
+    if versions.is_legacy_collection(client, args.alias):
+        print(f"⚠️ {args.alias}: legacy physical collection (run `rebuild --replace-legacy` to switch to versions)")
+    for number, name in versions.list_versions(client, args.alias):
+        marker = "▶" if name == current else " "
+        meta = _version_meta(name) or {}
+        print(f"{marker} v{number} {name}: {client.count(name, exact=False).count} points, "
+              f"model={meta.get('model', '?')}")
+    return 0
+
+
+def cmd_rebuild(args) -> int:
+    """
+    Tạo version mới từ version đang phục vụ (copy vector, hoặc embed lại payload text với --model),
+    --dimensions: cắt Matryoshka vector về N chiều (copy + chuẩn hoá lại, không gọi provider),
+    đồng bộ point được thêm / sửa / xoá ở version cũ trong lúc rebuild (sync_points), smoke check,
+    đồng bộ lần cuối, swap alias, dọn version cũ.
+    Ghi vào version cũ giữa lần đồng bộ cuối và swap vẫn bị mất; cần tuyệt đối thì dừng ingestion khi rebuild.
+    Model + số chiều của version mới được ghi lại; --model khác EMBEDDING_MODEL cần --no-swap
+    (hoặc --allow-model-mismatch).
+    """
+    client = db_manager.qdrant_client
+    source = versions.live_collection(client, args.alias)
+    if source is None:
+        print(f"❌ {args.alias}: nothing to rebuild from")
+        return 1
+    # copy vector: version mới mang model của version nguồn (chưa ghi → model đang phục vụ)
+    model = args.model or (_version_meta(source) or {}).get("model") or cfg_settings.EMBEDDING_MODEL
+    if not args.no_swap and _refuse_model_mismatch(args.alias, args.allow_model_mismatch, {"model": model}):
+        return 1
+    embedder = None
+    if args.model:
+        from app.services.embeddings import EmbeddingHandler
+        embedder = EmbeddingHandler(provider=cfg_settings.PROVIDER, model_name=args.model, cache=None)
+        vector_size = len(embedder.encode(["probe"], use_cache=False)["dense_vecs"][0])
+    else:
+        vector_size = versions.collection_vector_size(client, source)
+    if args.dimensions and args.dimensions > vector_size:
+        print(f"❌ --dimensions {args.dimensions} exceeds the {vector_size}-d source vectors")
+        return 1
+    vector_size = args.dimensions or vector_size
+
+    target = versions.next_version(client, args.alias)
+    ensure_collection(client, target, vector_size=vector_size, quantization=args.quantization, on_disk=args.on_disk)
+    try:
+        versions.record_version_meta(redis_client_web, target, model, vector_size)
+    except Exception as e:
+        logger.warning(f"Cannot record model metadata of {target}: {e}")
+    print(f"🏗️ {source} → {target} ({vector_size}-d, {'re-embed ' + args.model if embedder else 'copy vectors'})")
+    copied = versions.copy_points(
+        client, source, target, embedder=embedder, batch_size=args.batch_size, dimensions=args.dimensions
+    )
+    synced = versions.sync_points(
+        client, source, target, embedder=embedder, batch_size=args.batch_size, dimensions=args.dimensions
+    )
+    print(f"   copied {copied} points; catch-up: {synced['copied']} new/updated, {synced['deleted']} deleted "
+          f"in {synced['rounds']} rounds")
+
+    report = versions.smoke_check(
+        client, target, baseline=source, sample=args.smoke_sample, min_recall=args.min_recall
+    )
+    print(f"🔬 Smoke check: {json.dumps(report, ensure_ascii=False)}")
+    if not report["passed"]:
+        print(f"❌ Smoke check failed; `{args.alias}` still serves {source}, {target} kept for inspection")
+        return 1
+    if args.no_swap:
+        print(f"✅ {target} ready; swap with `swap --version {versions.parse_version(args.alias, target)}` "
+              f"(writes to {source} after this point are not copied)")
+        return 0
+    # đồng bộ lần cuối ngay trước swap (sau smoke check) để thu nhỏ cửa sổ mất ghi
+    final = versions.sync_points(
+        client, source, target, embedder=embedder, batch_size=args.batch_size, dimensions=args.dimensions,
+        max_rounds=1
+    )
+    if final["rounds"]:
+        print(f"   final catch-up: {final['copied']} new/updated, {final['deleted']} deleted")
+    return _swap(client, args.alias, target, args.replace_legacy, args.keep, args.allow_model_mismatch)
+
+
+def _swap(client, alias: str, target: str, replace_legacy: bool = False, keep: Optional[int] = None,
+          allow_model_mismatch: bool = False) -> int:
+    """keep: số version giữ lại sau swap (None = không dọn)"""
+    if _refuse_model_mismatch(target, allow_model_mismatch):
+        return 1
+    try:
+        previous = versions.swap_alias(client, alias, target, replace_legacy=replace_legacy)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    invalidate_caches()
+    print(f"🔀 {alias}: {previous} → {target}")
+    removed = versions.prune_versions(client, alias, keep=keep) if keep is not None else []
+    if removed:
+        try:
+            versions.forget_version_meta(redis_client_web, removed)
+        except Exception as e:
+            logger.warning(f"Cannot drop model metadata of {removed}: {e}")
+        print(f"🗑️ Deleted old versions: {', '.join(removed)}")
+    return 0
+
+
+def cmd_swap(args) -> int:
+    client = db_manager.qdrant_client
+    target = versions.version_name(args.alias, args.version)
+    if not client.collection_exists(target):
+        print(f"❌ {target} does not exist")
+        return 1
+    return _swap(client, args.alias, target, args.replace_legacy, allow_model_mismatch=args.allow_model_mismatch)
+
+
+def cmd_rollback(args) -> int:
+    client = db_manager.qdrant_client
+    try:
+        if _refuse_model_mismatch(versions.previous_version(client, args.alias), args.allow_model_mismatch):
+            return 1
+        target = versions.rollback(client, args.alias)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    invalidate_caches()
+    print(f"⏪ {args.alias} → {target}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Qdrant maintenance for legal collections")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser("migrate", help="Convert existing collections in place (quantization, on-disk)")
+    migrate.add_argument("--collections", nargs="+", default=DEFAULT_COLLECTIONS)
+    migrate.add_argument(
+        "--quantization",
+        choices=["scalar", "binary", "none"],
+        default=cfg_settings.QDRANT_QUANTIZATION
+    )
+    migrate.add_argument(
+        "--on-disk",
+        dest="on_disk",
+        action=argparse.BooleanOptionalAction,
+        default=cfg_settings.QDRANT_VECTORS_ON_DISK
+    )
+    migrate.set_defaults(func=cmd_migrate)
+
+    indexes = subparsers.add_parser("indexes", help="Create missing payload indexes")
+    indexes.add_argument("--collections", nargs="+", default=DEFAULT_COLLECTIONS)
+    indexes.set_defaults(func=cmd_indexes)
+
+    listing = subparsers.add_parser("versions", help="List blue/green versions behind the alias")
+    listing.add_argument("--alias", default=cfg_settings.LEGAL_COLLECTION)
+    listing.set_defaults(func=cmd_versions)
+
+    rebuild = subparsers.add_parser(
+        "rebuild", help="Build a new version, sync writes made meanwhile, smoke check it, swap the alias "
+                        "(writes between the last sync and the swap are lost; pause ingestion for zero loss)"
+    )
+    rebuild.add_argument("--alias", default=cfg_settings.LEGAL_COLLECTION)
+    rebuild.add_argument("--model", help="Re-embed payload text with this model (default: copy vectors)")
+    rebuild.add_argument("--dimensions", type=int,
+                         help="Matryoshka-truncate dense vectors to N dims (default: keep the source size)")
+    rebuild.add_argument("--quantization", choices=["scalar", "binary", "none"], default=cfg_settings.QDRANT_QUANTIZATION)
+    rebuild.add_argument("--on-disk", dest="on_disk", action=argparse.BooleanOptionalAction,
+                         default=cfg_settings.QDRANT_VECTORS_ON_DISK)
+    rebuild.add_argument("--batch-size", type=int, default=256)
+    rebuild.add_argument("--smoke-sample", type=int, default=50, help="Points sampled for the self-recall check")
+    rebuild.add_argument("--min-recall", type=float, default=0.9, help="Minimum self-recall@10 to swap")
+    rebuild.add_argument("--keep", type=int, default=cfg_settings.COLLECTION_KEEP_VERSIONS,
+                         help="Versions kept after the swap (serving + rollback)")
+    rebuild.add_argument("--no-swap", action="store_true", help="Build and check only")
+    rebuild.add_argument("--replace-legacy", action="store_true",
+                         help="Delete a physical collection named like the alias when swapping (one-time)")
+    rebuild.add_argument("--allow-model-mismatch", action="store_true",
+                         help="Swap even if the version was built with a model other than EMBEDDING_MODEL")
+    rebuild.set_defaults(func=cmd_rebuild)
+
+    swap = subparsers.add_parser("swap", help="Point the alias at an existing version")
+    swap.add_argument("--alias", default=cfg_settings.LEGAL_COLLECTION)
+    swap.add_argument("--version", type=int, required=True)
+    swap.add_argument("--replace-legacy", action="store_true")
+    swap.add_argument("--allow-model-mismatch", action="store_true")
+    swap.set_defaults(func=cmd_swap)
+
+    back = subparsers.add_parser("rollback", help="Point the alias back at the previous version")
+    back.add_argument("--alias", default=cfg_settings.LEGAL_COLLECTION)
+    back.add_argument("--allow-model-mismatch", action="store_true")
+    back.set_defaults(func=cmd_rollback)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=cfg_settings.LOG_LEVEL, format=cfg_settings.LOG_FORMAT)
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Semantic answer-reuse cache trên collection `chat_questions`
+Câu trả lời hoàn chỉnh được index theo vector câu hỏi, kèm TTL (expires_at) và law version
+(legal_index_version); lookup đi thẳng qua embedding cache, không qua Celery.
+"""
+import logging
+import time
+from typing import Any, Dict, Optional
+from uuid import NAMESPACE_URL, uuid5
+
+from qdrant_client.models import FieldCondition, Filter, MatchValue, PointStruct, Range
+
+from app.config.settings import cfg_settings
+from app.services.embedding_cache import EmbeddingCache
+from app.services.qdrant_collections import collection_dimensions, ensure_collection
+from app.services.retrieval_cache import read_index_version
+
+logger = logging.getLogger(__name__)
+
+ANSWER_COLLECTION = "chat_questions"
+
+
+def build_default_answer_cache() -> Optional["AnswerCache"]:
+    if not cfg_settings.ANSWER_CACHE_ENABLED:
+        return None
+    from app.config.database import db_manager, redis_client_web
+    from app.tasks.legal_embedding_tasks import embedding_model
+    return AnswerCache(
+        db_manager.qdrant_client,
+        embedding_model,
+        redis_client=redis_client_web,
+        threshold=cfg_settings.ANSWER_CACHE_THRESHOLD,
+        ttl=cfg_settings.ANSWER_CACHE_TTL
+    )
+
+
+class AnswerCache:
+    """Tra cứu / index câu trả lời theo độ tương đồng câu hỏi"""
+
+    def __init__(
+        self,
+        client,
+        embedder,
+        redis_client=None,
+        threshold: float = 0.95,
+        ttl: int = 7 * 24 * 3600,
+        collection_name: str = ANSWER_COLLECTION
+    ):
+        """
+        client: QdrantClient (sync)
+        embedder: EmbeddingHandler (encode() đi qua embedding cache)
+        redis_client: đọc legal_index_version (None = luôn version 0)
+        """
+        self.client = client
+        self.embedder = embedder
+        self.redis_client = redis_client
+        self.threshold = threshold
+        self.ttl = ttl
+        self.collection_name = collection_name
+        self._collection_ready = False
+
+    def law_version(self) -> int:
+        return read_index_version(self.redis_client) if self.redis_client is not None else 0
+
+    def _embed(self, text: str):
+        dimensions = collection_dimensions(self.client, self.collection_name)
+        vector = self.embedder.encode([text], return_dense=True, dimensions=dimensions)["dense_vecs"][0]
+        return vector.tolist() if hasattr(vector, "tolist") else list(vector)
+
+    @staticmethod
+    def point_id(question: str) -> str:
+        """Cùng câu hỏi (đã chuẩn hoá) → cùng point, câu trả lời mới ghi đè câu cũ"""
+        return str(uuid5(NAMESPACE_URL, f"answer:{EmbeddingCache.normalize_text(question).lower()}"))
+
+    def _live_filter(self, law_version: int) -> Filter:
+        return Filter(must=[
+            FieldCondition(key="law_version", match=MatchValue(value=law_version)),
+            FieldCondition(key="expires_at", range=Range(gt=time.time()))
+        ])
+
+    def lookup(self, question: str, threshold: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Câu trả lời đã lưu cho câu hỏi tương tự (score >= threshold), còn hạn và cùng law version"""
+        if not question or not question.strip():
+            return None
+        try:
+            response = self.client.query_points(
+                collection_name=self.collection_name,
+                query=self._embed(question),
+                query_filter=self._live_filter(self.law_version()),
+                score_threshold=self.threshold if threshold is None else threshold,
+                limit=1,
+                with_payload=True
+            )
+        except Exception as e:
+            logger.warning(f"Answer cache lookup failed: {e}")
+            return None
+        if not response.points:
+            return None
+        point = response.points[0]
+        payload = point.payload or {}
+        if not payload.get("answer"):
+            return None
+        return {**payload, "score": point.score}
+
+    def index(self, question: str, answer: str, message_id: Optional[str] = None, **metadata) -> bool:
+        """Lưu câu trả lời hoàn chỉnh; answer nằm ngay trong payload để lookup không cần Mongo"""
+        if not question or not question.strip() or not answer:
+            return False
+        try:
+            if not self._collection_ready:
+                ensure_collection(self.client, self.collection_name, with_sparse=False)
+                self._collection_ready = True
+            now = time.time()
+            self.client.upsert(
+                collection_name=self.collection_name,
+                points=[PointStruct(
+                    id=self.point_id(question),
+                    vector=self._embed(question),
+                    payload={
+                        "question": question,
+                        "answer": answer,
+                        "message_id": message_id,
+                        "law_version": self.law_version(),
+                        "created_at": now,
+                        "expires_at": now + self.ttl,
+                        **metadata
+                    }
+                )]
+            )
+            return True
+        except Exception as e:
+            logger.warning(f"Answer cache index failed: {e}")
+            return False
+
+    def purge_stale(self, law_version: Optional[int] = None):
+        """Xoá câu trả lời hết hạn hoặc thuộc law version cũ (gọi sau khi update index)"""
+        law_version = self.law_version() if law_version is None else law_version
+        try:
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=Filter(should=[
+                    FieldCondition(key="expires_at", range=Range(lte=time.time())),
+                    FieldCondition(key="law_version", range=Range(lt=law_version))
+                ])
+            )
+        except Exception as e:
+            logger.warning(f"Answer cache purge failed: {e}")
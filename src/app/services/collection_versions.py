@@ -0,0 +1,347 @@
+"""
+Blue/green collection: nhiều version vật lý sau một alias cố định
+
+    legal_documents_collection (alias) ──▶ legal_documents_collection__v3   (đang phục vụ)
+                                           legal_documents_collection__v2   (giữ lại để rollback)
+
+Rebuild ghi vào version mới trong khi alias vẫn trỏ version cũ; kiểm tra smoke recall rồi mới swap.
+Ghi vào version cũ trong lúc rebuild (thêm / sửa / xoá) được đồng bộ lại bằng sync_points ngay trước swap;
+ghi rơi vào khoảng giữa lần sync cuối và swap (thường dưới một giây) bị mất → muốn tuyệt đối không mất,
+dừng ingestion (worker embed_queue, indexer --resume) trong lúc rebuild.
+Swap là một request update_collection_aliases (xoá + tạo alias cùng transaction) → reader không thấy khoảng trống.
+Code runtime chỉ dùng tên alias (cfg_settings.LEGAL_COLLECTION), Qdrant tự resolve khi search / upsert.
+Model / số chiều của mỗi version được ghi vào Redis (VERSION_META_KEY): query luôn được embed bằng
+cfg_settings.EMBEDDING_MODEL, nên swap sang version của model khác bị từ chối (model_mismatch).
+"""
+import json
+import logging
+import random
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from qdrant_client.models import (
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
+    PointIdsList,
+    PointStruct,
+    SparseVector,
+)
+
+from app.services.qdrant_collections import DENSE_VECTOR_NAME, SPARSE_VECTOR_NAME, dense_vector, has_sparse_vectors
+
+logger = logging.getLogger(__name__)
+
+VERSION_SEPARATOR = "__v"
+
+
+def version_name(alias: str, version: int) -> str:
+    return f"{alias}{VERSION_SEPARATOR}{version}"
+
+
+def parse_version(alias: str, collection_name: str) -> Optional[int]:
+    prefix = alias + VERSION_SEPARATOR
+    suffix = collection_name[len(prefix):]
+    return int(suffix) if collection_name.startswith(prefix) and suffix.isdigit() else None
+
+
+def list_versions(client, alias: str) -> List[Tuple[int, str]]:
+    """(version, collection) của alias, tăng dần"""
+    versions = []
+    for collection in client.get_collections().collections:
+        version = parse_version(alias, collection.name)
+        if version is not None:
+            versions.append((version, collection.name))
+    return sorted(versions)
+
+
+def alias_target(client, alias: str) -> Optional[str]:
+    """Collection mà alias đang trỏ tới (None nếu alias chưa tồn tại)"""
+    for description in client.get_aliases().aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+
+def is_legacy_collection(client, alias: str) -> bool:
+    """Tên alias đang là một collection vật lý (trước khi chuyển sang blue/green)"""
+    return alias_target(client, alias) is None and client.collection_exists(alias)
+
+
+def live_collection(client, alias: str) -> Optional[str]:
+    """Collection vật lý đang phục vụ: đích của alias, hoặc collection legacy cùng tên"""
+    target = alias_target(client, alias)
+    if target is None and client.collection_exists(alias):
+        return alias
+    return target
+
+
+def next_version(client, alias: str) -> str:
+    versions = list_versions(client, alias)
+    return version_name(alias, versions[-1][0] + 1 if versions else 1)
+
+
+def collection_vector_size(client, collection_name: str) -> int:
+    vectors = client.get_collection(collection_name).config.params.vectors
+    if isinstance(vectors, dict):
+        vectors = vectors[DENSE_VECTOR_NAME]
+    return vectors.size
+
+
+def swap_alias(client, alias: str, target: str, replace_legacy: bool = False) -> Optional[str]:
+    """
+    Trỏ alias sang target (atomic); trả về collection alias trỏ trước đó.
+    Alias trùng tên collection legacy: phải xoá collection đó trước (replace_legacy=True, gián đoạn ngắn một lần).
+    """
+    previous = alias_target(client, alias)
+    if previous is None and client.collection_exists(alias):
+        if not replace_legacy:
+            raise ValueError(
+                f"`{alias}` is a physical collection, not an alias; "
+                f"rebuild copies it into a version first, then swap with --replace-legacy"
+            )
+        logger.warning(f"[Qdrant] Deleting legacy collection `{alias}` to turn it into an alias")
+        client.delete_collection(alias)
+        previous = None
+    operations = []
+    if previous is not None:
+        operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias)))
+    operations.append(CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=alias)))
+    client.update_collection_aliases(change_aliases_operations=operations)
+    logger.info(f"[Qdrant] Alias `{alias}`: {previous} → {target}")
+    return previous
+
+
+def previous_version(client, alias: str) -> str:
+    """Version liền trước version đang phục vụ (đích của rollback)"""
+    current = alias_target(client, alias)
+    current_version = parse_version(alias, current) if current else None
+    older = [name for version, name in list_versions(client, alias)
+             if current_version is None or version < current_version]
+    if not older:
+        raise ValueError(f"No previous version of `{alias}` to roll back to")
+    return older[-1]
+
+
+def rollback(client, alias: str) -> str:
+    """Trỏ alias về version liền trước version đang phục vụ"""
+    target = previous_version(client, alias)
+    swap_alias(client, alias, target)
+    return target
+
+
+def prune_versions(client, alias: str, keep: int = 2) -> List[str]:
+    """Xoá version cũ, giữ `keep` version mới nhất và luôn giữ version đang phục vụ"""
+    current = alias_target(client, alias)
+    versions = [name for _, name in list_versions(client, alias)]
+    removed = [name for name in versions[:-keep] if name != current] if keep > 0 else []
+    for name in removed:
+        client.delete_collection(name)
+        logger.info(f"[Qdrant] Deleted old version `{name}`")
+    return removed
+
+
+# ---------- Model metadata ----------
+VERSION_META_KEY = "legal_collection_versions"  # hash: collection → {"model", "dimensions"}
+
+
+def record_version_meta(redis_client, collection_name: str, model: str, dimensions: int):
+    redis_client.hset(VERSION_META_KEY, collection_name, json.dumps({"model": model, "dimensions": dimensions}))
+
+
+def version_meta(redis_client, collection_name: str) -> Optional[Dict[str, Any]]:
+    """{"model", "dimensions"} của version, None nếu chưa ghi (collection legacy / tạo bởi indexer)"""
+    raw = redis_client.hget(VERSION_META_KEY, collection_name)
+    return json.loads(raw) if raw else None
+
+
+def forget_version_meta(redis_client, collection_names: List[str]):
+    if collection_names:
+        redis_client.hdel(VERSION_META_KEY, *collection_names)
+
+
+def model_mismatch(meta: Optional[Dict[str, Any]], serving_model: str) -> Optional[str]:
+    """Lý do không được swap (vector của model khác model embed query), None nếu khớp / không rõ"""
+    if meta is None or meta.get("model") in (None, serving_model):
+        return None
+    built = f"`{meta['model']}` ({meta['dimensions']}-d)" if meta.get("dimensions") else f"`{meta['model']}`"
+    return f"built with {built} but queries are embedded with `{serving_model}` (EMBEDDING_MODEL)"
+
+
+# ---------- Populate ----------
+def _source_batches(client, source: str, point_ids: Optional[List[Any]], batch_size: int, with_vectors: bool):
+    """Scroll toàn bộ source, hoặc retrieve theo danh sách id"""
+    if point_ids is not None:
+        for start in range(0, len(point_ids), batch_size):
+            yield client.retrieve(collection_name=source, ids=point_ids[start:start + batch_size],
+                                  with_payload=True, with_vectors=with_vectors)
+        return
+    offset = None
+    while True:
+        points, offset = client.scroll(collection_name=source, limit=batch_size, offset=offset,
+                                       with_payload=True, with_vectors=with_vectors)
+        yield points
+        if offset is None:
+            return
+
+
+def _target_vectors(client, source: str, points, embedder, with_sparse: bool,
+                    dimensions: Optional[int] = None) -> list:
+    """
+    Vector cho version mới: encode lại payload text (embedder) hoặc copy vector gốc.
+    dimensions: cắt Matryoshka + chuẩn hoá lại (chỉ giảm được số chiều, không cần embed lại).
+    """
+    texts = [(point.payload or {}).get("text", "") for point in points]
+    if embedder is not None:
+        encoded = embedder.encode(texts, return_dense=True, return_sparse=with_sparse, use_cache=False,
+                                  dimensions=dimensions)
+        dense = [vec.tolist() if hasattr(vec, "tolist") else list(vec) for vec in encoded["dense_vecs"]]
+        sparse = encoded.get("sparse_vecs")
+    else:
+        from app.services.embeddings import truncate_embeddings
+        dense = truncate_embeddings([dense_vector(point) for point in points], dimensions)
+        sparse = None
+        if with_sparse and has_sparse_vectors(client, source):
+            return [{**point.vector, DENSE_VECTOR_NAME: vec} for point, vec in zip(points, dense)]  # giữ nguyên bm25
+        if with_sparse:
+            from app.services.sparse_encoder import SparseEncoder
+            sparse = SparseEncoder().encode(texts)  # nguồn chưa có BM25 → tính local
+    if not with_sparse:
+        return dense
+    return [{DENSE_VECTOR_NAME: vec, SPARSE_VECTOR_NAME: SparseVector(**sparse_vec)}
+            for vec, sparse_vec in zip(dense, sparse)]
+
+
+def copy_points(client, source: str, target: str, embedder=None, batch_size: int = 256,
+                point_ids: Optional[List[Any]] = None, dimensions: Optional[int] = None) -> int:
+    """
+    Chép point source → target (giữ id + payload).
+    embedder (EmbeddingHandler): encode lại payload text bằng model mới thay vì copy vector.
+    point_ids: chỉ chép các id này (catch-up, xem sync_points).
+    dimensions: số chiều dense của target (Matryoshka; None = giữ nguyên).
+    """
+    with_sparse = has_sparse_vectors(client, target)
+    copied = 0
+    for points in _source_batches(client, source, point_ids, batch_size, with_vectors=embedder is None):
+        if not points:
+            continue
+        vectors = _target_vectors(client, source, points, embedder, with_sparse, dimensions)
+        client.upsert(
+            collection_name=target,
+            points=[PointStruct(id=point.id, vector=vector, payload=point.payload)
+                    for point, vector in zip(points, vectors)],
+            wait=True
+        )
+        copied += len(points)
+    return copied
+
+
+SYNC_FIELDS = ["content_hash", "processed_at"]  # đổi khi point được ghi lại (indexer / embed task)
+
+
+def _id_key(point_id) -> Tuple[int, int]:
+    """Thứ tự id của scroll Qdrant: id số trước, UUID sau (theo giá trị 128 bit)"""
+    return (0, point_id) if isinstance(point_id, int) else (1, uuid.UUID(str(point_id)).int)
+
+
+def _fingerprints(client, collection_name: str, batch_size: int):
+    """(id, giá trị SYNC_FIELDS) theo thứ tự id, từng page scroll (không giữ cả collection trong RAM)"""
+    offset, last = None, None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name, limit=batch_size, offset=offset,
+            with_payload=SYNC_FIELDS, with_vectors=False
+        )
+        for point in points:
+            key = _id_key(point.id)
+            if last is not None and key <= last:
+                raise ValueError(f"Scroll of `{collection_name}` is not ordered by id; cannot diff versions")
+            last = key
+            payload = point.payload or {}
+            yield point.id, tuple(payload.get(field) for field in SYNC_FIELDS)
+        if offset is None:
+            return
+
+
+def diff_points(client, source: str, target: str, batch_size: int = 1000) -> Tuple[List[Any], List[Any]]:
+    """
+    So source (version đang phục vụ) với target (version đang rebuild) bằng merge hai scroll theo id:
+    - changed: id mới, hoặc content_hash / processed_at khác (point được ghi lại)
+    - deleted: id chỉ còn trong target (đã bị xoá khỏi source)
+    RAM chỉ tỉ lệ với số point khác nhau. Point không có cả hai field chỉ được so theo id.
+    """
+    changed, deleted = [], []
+    source_points = _fingerprints(client, source, batch_size)
+    target_points = _fingerprints(client, target, batch_size)
+    current, other = next(source_points, None), next(target_points, None)
+    while current is not None or other is not None:
+        if other is None or (current is not None and _id_key(current[0]) < _id_key(other[0])):
+            changed.append(current[0])
+            current = next(source_points, None)
+        elif current is None or _id_key(other[0]) < _id_key(current[0]):
+            deleted.append(other[0])
+            other = next(target_points, None)
+        else:
+            if current[1] != other[1]:
+                changed.append(current[0])
+            current, other = next(source_points, None), next(target_points, None)
+    return changed, deleted
+
+
+def sync_points(client, source: str, target: str, embedder=None, batch_size: int = 256,
+                dimensions: Optional[int] = None, max_rounds: int = 3) -> Dict[str, int]:
+    """
+    Catch-up sau copy: chép lại point mới / bị sửa, xoá point đã bị xoá, lặp tới khi không còn khác biệt
+    (hoặc max_rounds). Cửa sổ còn lại: ghi vào source giữa vòng cuối và lúc swap alias sẽ bị mất.
+    """
+    totals = {"copied": 0, "deleted": 0, "rounds": 0}
+    for _ in range(max_rounds):
+        changed, deleted = diff_points(client, source, target)
+        if not changed and not deleted:
+            break
+        totals["rounds"] += 1
+        if changed:
+            totals["copied"] += copy_points(client, source, target, embedder=embedder, batch_size=batch_size,
+                                            point_ids=changed, dimensions=dimensions)
+        if deleted:
+            client.delete(collection_name=target, points_selector=PointIdsList(points=deleted), wait=True)
+            totals["deleted"] += len(deleted)
+    return totals
+
+
+# ---------- Smoke check ----------
+def smoke_check(client, collection_name: str, baseline: Optional[str] = None, sample: int = 50, k: int = 10,
+                min_recall: float = 0.9, min_count_ratio: float = 0.99, seed: int = 13) -> Dict[str, Any]:
+    """
+    Kiểm tra nhanh trước khi swap:
+    - số point ≥ min_count_ratio × số point của baseline (version đang phục vụ)
+    - self-recall@k: vector của một mẫu point tìm lại được chính point đó (index / dim / quantization hỏng → fail)
+    """
+    count = client.count(collection_name, exact=True).count
+    report: Dict[str, Any] = {"collection": collection_name, "count": count}
+    passed = count > 0
+    if baseline is not None:
+        baseline_count = client.count(baseline, exact=True).count
+        report["baseline_count"] = baseline_count
+        passed = passed and count >= min_count_ratio * baseline_count
+
+    points, _ = client.scroll(collection_name=collection_name, limit=max(sample * 4, sample),
+                              with_payload=False, with_vectors=True)
+    rng = random.Random(seed)
+    points = rng.sample(points, min(sample, len(points)))
+    found = 0
+    for point in points:
+        vector = dense_vector(point)
+        response = client.query_points(
+            collection_name=collection_name,
+            query=vector,
+            using=DENSE_VECTOR_NAME or None,
+            limit=k,
+            with_payload=False
+        )
+        found += any(hit.id == point.id for hit in response.points)
+    recall = found / len(points) if points else 0.0
+    report.update({"self_recall": round(recall, 4), "sampled": len(points), "k": k})
+    report["passed"] = bool(passed and recall >= min_recall)
+    return report
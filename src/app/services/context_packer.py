@@ -0,0 +1,176 @@
+"""
+Token-budgeted context packing cho RAG prompt
+Chọn đoạn từ tài liệu luật, web và lịch sử hội thoại theo marginal relevance đến khi hết budget:
+- token ước lượng sẵn lúc index (payload `token_count`), thiếu thì ước lượng tại chỗ
+- bỏ đoạn/câu trùng với nội dung đã chọn, cắt câu ít liên quan khi đoạn vượt phần budget còn lại
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from app.services.diversify import containment, shingle_set
+from app.services.sparse_encoder import SparseEncoder
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+# Trọng số nguồn: luật > web > lịch sử
+SOURCE_WEIGHTS = {"legal": 1.0, "web": 0.7, "history": 0.5}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Ước lượng số token BPE: ~4 byte UTF-8 / token (tiếng Việt có dấu tốn nhiều byte hơn → nhiều token hơn).
+    Indexer dùng cùng công thức để lưu `token_count` vào payload.
+    """
+    return (len((text or "").encode("utf-8")) + 3) // 4
+
+
+@dataclass
+class ContextItem:
+    source: str  # legal | web | history
+    text: str
+    relevance: float
+    tokens: int
+    data: dict = field(default_factory=dict)
+
+
+@dataclass
+class PackedContext:
+    legal: List[dict] = field(default_factory=list)
+    web: List[dict] = field(default_factory=list)
+    history: List[dict] = field(default_factory=list)
+    tokens: int = 0
+    dropped: int = 0
+
+
+class ContextPacker:
+    """Greedy marginal relevance trên budget token"""
+
+    def __init__(self, budget: int = 3000, redundancy_threshold: float = 0.8, shingle_size: int = 5):
+        self.budget = budget
+        self.redundancy_threshold = redundancy_threshold
+        self.shingle_size = shingle_size
+
+    # ---------- Candidates ----------
+    @staticmethod
+    def _ranked(source: str, entries: List[dict], text_key: str = "text") -> List[ContextItem]:
+        """Relevance theo thứ hạng đã có (sau rerank/MMR) × trọng số nguồn"""
+        n = len(entries)
+        items = []
+        for rank, entry in enumerate(entries):
+            text = (entry.get(text_key) or "").strip()
+            if not text:
+                continue
+            items.append(ContextItem(
+                source=source,
+                text=text,
+                relevance=SOURCE_WEIGHTS[source] * (1 - rank / (n + 1)),
+                tokens=entry.get("token_count") or estimate_tokens(text),
+                data=entry
+            ))
+        return items
+
+    def candidates(
+        self,
+        legal_documents: List[dict],
+        web_results: List[dict],
+        conversation_history: List[dict]
+    ) -> List[ContextItem]:
+        # Lịch sử: tin nhắn mới nhất liên quan nhất
+        history = list(reversed(conversation_history or []))
+        return (
+            self._ranked("legal", legal_documents or [])
+            + self._ranked("web", web_results or [])
+            + self._ranked("history", history)
+        )
+
+    # ---------- Sentence trimming ----------
+    def _trim(self, item: ContextItem, query_terms: set, seen_sentences: set, remaining: int) -> Optional[ContextItem]:
+        """Bỏ câu đã xuất hiện; vượt budget thì giữ các câu liên quan nhất (giữ thứ tự gốc)"""
+        sentences = [s.strip() for s in SENTENCE_SPLIT.split(item.text) if s and s.strip()]
+        fresh, seen = [], set(seen_sentences)
+        for sentence in sentences:
+            if sentence.lower() not in seen:
+                fresh.append(sentence)
+                seen.add(sentence.lower())
+        if not fresh:
+            return None
+        text = " ".join(fresh)
+        tokens = estimate_tokens(text) if len(fresh) != len(sentences) else item.tokens
+        if tokens > remaining:
+            scored = sorted(
+                range(len(fresh)),
+                key=lambda i: len(query_terms & set(SparseEncoder.tokenize(fresh[i]))),
+                reverse=True
+            )
+            keep, used = [], 0
+            for i in scored:
+                cost = estimate_tokens(fresh[i]) + 1
+                if used + cost > remaining:
+                    continue
+                if not query_terms & set(SparseEncoder.tokenize(fresh[i])) and keep:
+                    continue  # câu không chứa term nào của câu hỏi → giá trị thấp
+                keep.append(i)
+                used += cost
+            if not keep:
+                return None
+            text = " ".join(fresh[i] for i in sorted(keep))
+            tokens = estimate_tokens(text)
+        return ContextItem(item.source, text, item.relevance, tokens, {**item.data, "text": text})
+
+    # ---------- Packing ----------
+    def pack(
+        self,
+        query: str,
+        legal_documents: List[dict],
+        web_results: List[dict],
+        conversation_history: List[dict],
+        budget: Optional[int] = None
+    ) -> PackedContext:
+        budget = self.budget if budget is None else budget
+        pool = self.candidates(legal_documents, web_results, conversation_history)
+        query_terms = set(SparseEncoder.tokenize(query))
+        shingles = [shingle_set(item.text, self.shingle_size) for item in pool]
+
+        packed = PackedContext()
+        selected_shingles: List[frozenset] = []
+        seen_sentences: set = set()
+        available = list(range(len(pool)))
+
+        while available and packed.tokens < budget:
+            # Marginal relevance: relevance × (1 − độ trùng lớn nhất với phần đã chọn)
+            def gain(i: int) -> float:
+                overlap = max((containment(shingles[i], other) for other in selected_shingles), default=0.0)
+                return pool[i].relevance * (1 - overlap)
+
+            best = max(available, key=gain)
+            available.remove(best)
+            overlap = max((containment(shingles[best], other) for other in selected_shingles), default=0.0)
+            if overlap >= self.redundancy_threshold:
+                packed.dropped += 1
+                continue
+
+            item = self._trim(pool[best], query_terms, seen_sentences, budget - packed.tokens)
+            if item is None:
+                packed.dropped += 1
+                continue
+
+            getattr(packed, item.source).append(item.data)
+            packed.tokens += item.tokens
+            selected_shingles.append(shingles[best])
+            seen_sentences.update(s.strip().lower() for s in SENTENCE_SPLIT.split(item.text) if s and s.strip())
+
+        packed.dropped += len(available)
+        # Lịch sử hiển thị theo thứ tự thời gian
+        packed.history.sort(key=lambda msg: msg.get("created_at") or "")
+        return packed
+
+    @staticmethod
+    def stats(packed: PackedContext) -> Dict[str, int]:
+        return {
+            "tokens": packed.tokens,
+            "legal": len(packed.legal),
+            "web": len(packed.web),
+            "history": len(packed.history),
+            "dropped": packed.dropped
+        }
@@ -0,0 +1,70 @@
+"""
+Post-retrieval diversification
+- near-duplicate suppression bằng word shingles (containment)
+- MMR vector hoá bằng NumPy trên vector của các candidate
+"""
+import zlib
+from typing import FrozenSet, List, Sequence
+
+import numpy as np
+
+from app.services.sparse_encoder import SparseEncoder
+
+
+def shingle_set(text: str, size: int = 5) -> FrozenSet[int]:
+    """Tập hash của các cụm `size` từ liên tiếp (text ngắn → cả text là một shingle)"""
+    tokens = SparseEncoder.tokenize(text)
+    if len(tokens) <= size:
+        return frozenset([zlib.crc32(" ".join(tokens).encode("utf-8"))]) if tokens else frozenset()
+    return frozenset(
+        zlib.crc32(" ".join(tokens[i:i + size]).encode("utf-8"))
+        for i in range(len(tokens) - size + 1)
+    )
+
+
+def containment(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    """|a ∩ b| / min(|a|, |b|): 1.0 khi chunk ngắn nằm trọn trong chunk dài"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def drop_near_duplicates(hits: List[dict], threshold: float = 0.8, shingle_size: int = 5) -> List[dict]:
+    """Giữ hit xếp hạng cao hơn, bỏ các hit sau trùng nội dung >= threshold"""
+    kept, kept_shingles = [], []
+    for hit in hits:
+        shingles = shingle_set(hit.get("text", ""), shingle_size)
+        if any(containment(shingles, other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(hit)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def mmr_select(vectors: np.ndarray, relevance: Sequence[float], k: int, lambda_: float = 0.7) -> List[int]:
+    """
+    Maximal marginal relevance: argmax λ·rel(i) − (1−λ)·max_{j∈S} cos(i, j)
+    vectors: (n, d) float32; relevance: (n,) đã chuẩn hoá về [0, 1]
+    Ma trận similarity tính một lần, mỗi bước chỉ cập nhật max-sim theo vector (O(k·n)).
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1.0, norms)
+    similarity = matrix @ matrix.T
+
+    relevance = np.asarray(relevance, dtype=np.float32)
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected: List[int] = []
+    for _ in range(k):
+        redundancy = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        scores = np.where(available, lambda_ * relevance - (1 - lambda_) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_sim = np.maximum(max_sim, similarity[best])
+    return selected
@@ -0,0 +1,122 @@
+"""
+Micro-batching cho embedding request nhỏ (query) giữa các request đồng thời trong một process
+
+    thread / coroutine A ─┐
+    thread / coroutine B ─┼─▶ queue ─▶ collector: gom trong window_ms hoặc đủ max_inputs
+    thread / coroutine C ─┘                      ─▶ một lần embeddings.create ─▶ trả vector về từng Future
+
+Dùng chung cho đường sync (Celery threads, embed_query_sync) và async (asyncio.wrap_future),
+nên coalesce được cả giữa thread và event loop. Collector khởi động lười theo pid (an toàn với prefork).
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _settle(future: Future, result=None, error: Optional[Exception] = None):
+    """Đặt kết quả cho một Future; lỗi ở một caller không chặn các caller khác trong batch"""
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except Exception as e:  # InvalidStateError: Future đã được đặt / huỷ ở nơi khác
+        logger.warning(f"[EmbeddingBatcher] Cannot deliver result: {e}")
+
+
+class EmbeddingBatcher:
+    def __init__(self, embed: Callable[[List[str]], List[List[float]]], window_ms: float = 5.0,
+                 max_inputs: int = 64, max_in_flight: int = 4):
+        """
+        embed: hàm gọi provider cho một list text (EmbeddingHandler._embed_remote)
+        window_ms: thời gian chờ gom thêm request sau request đầu tiên
+        max_inputs: gửi ngay khi đủ số input này
+        max_in_flight: số batch đang gọi provider cùng lúc (collector không bị chặn bởi round trip)
+        """
+        self.embed = embed
+        self.window = window_ms / 1000
+        self.max_inputs = max_inputs
+        self.max_in_flight = max_in_flight
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = {"requests": 0, "batches": 0, "inputs": 0, "unique_inputs": 0}
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()  # process con sau fork không dùng lại queue / thread của cha
+            self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="embed-batch")
+            threading.Thread(target=self._collect, name="embed-batcher", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, texts: List[str]) -> Future:
+        """Future → vectors theo thứ tự texts"""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((list(texts), future))
+        return future
+
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        return self.submit(texts).result()
+
+    def _collect(self):
+        pending_queue = self._queue
+        while True:
+            batch = [pending_queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.window
+            while size < self.max_inputs:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = pending_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: List[Tuple[List[str], Future]]):
+        """
+        Một lần gọi provider cho cả batch (text trùng giữa các request chỉ gửi một lần).
+        Future bị huỷ (awaiter async bị cancel, vd. asyncio.wait_for hết deadline) bị bỏ qua,
+        các caller còn lại của batch vẫn nhận kết quả.
+        """
+        batch = [(texts, future) for texts, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        unique: Dict[str, int] = {}
+        for texts, _ in batch:
+            for text in texts:
+                unique.setdefault(text, len(unique))
+        with self._lock:
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["inputs"] += sum(len(texts) for texts, _ in batch)
+            self._stats["unique_inputs"] += len(unique)
+        try:
+            vectors = self.embed(list(unique))
+        except Exception as e:
+            for _, future in batch:
+                _settle(future, error=e)
+            return
+        for texts, future in batch:
+            _settle(future, result=[vectors[unique[text]] for text in texts])
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mean_batch_requests"] = round(stats["requests"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
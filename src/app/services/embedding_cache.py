@@ -0,0 +1,143 @@
+"""
+Content-addressed cache for dense embeddings
+Two tiers: in-process LRU (per worker) + shared Redis (DB 2, packed float32 bytes)
+"""
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """Cache vector theo hash(normalized text + model)"""
+
+    def __init__(
+        self,
+        redis_client=None,
+        ttl: int = 7 * 24 * 3600,
+        max_local_items: int = 4096,
+        namespace: str = "emb"
+    ):
+        """
+        redis_client: Redis client với decode_responses=False (None = chỉ dùng LRU)
+        ttl: thời gian sống của key trong Redis (giây)
+        max_local_items: số vector tối đa giữ trong LRU của process
+        """
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.max_local_items = max_local_items
+        self.namespace = namespace
+
+        self._local: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "redis_errors": 0}
+
+    # ---------- Keys & serialization ----------
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Chuẩn hoá text: Unicode NFC + gộp khoảng trắng"""
+        return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+    def make_key(self, text: str, model_name: str) -> str:
+        """Key ổn định giữa các process (không dùng hash() của Python)"""
+        digest = hashlib.sha256(
+            f"{model_name}\x00{self.normalize_text(text)}".encode("utf-8")
+        ).hexdigest()
+        return f"{self.namespace}:{model_name}:{digest}"
+
+    @staticmethod
+    def pack(vector: Sequence[float]) -> bytes:
+        return np.asarray(vector, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def unpack(raw: bytes) -> List[float]:
+        return np.frombuffer(raw, dtype=np.float32).tolist()
+
+    # ---------- Local LRU tier ----------
+    def _local_get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._local.get(key)
+            if vector is not None:
+                self._local.move_to_end(key)
+            return vector
+
+    def _local_set(self, key: str, vector: List[float]):
+        with self._lock:
+            self._local[key] = vector
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local_items:
+                self._local.popitem(last=False)
+
+    def _bump(self, counter: str, n: int = 1):
+        with self._lock:
+            self._stats[counter] += n
+
+    # ---------- Public API ----------
+    def get_many(self, texts: List[str], model_name: str) -> List[Optional[List[float]]]:
+        """Trả về list vector (None nếu miss) theo đúng thứ tự texts"""
+        keys = [self.make_key(text, model_name) for text in texts]
+        results: List[Optional[List[float]]] = [self._local_get(key) for key in keys]
+
+        local_hits = sum(1 for vector in results if vector is not None)
+        if local_hits:
+            self._bump("local_hits", local_hits)
+
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing and self.redis_client is not None:
+            try:
+                raws = self.redis_client.mget([keys[i] for i in missing])
+                redis_hits = 0
+                for i, raw in zip(missing, raws):
+                    if raw:
+                        vector = self.unpack(raw)
+                        results[i] = vector
+                        self._local_set(keys[i], vector)
+                        redis_hits += 1
+                if redis_hits:
+                    self._bump("redis_hits", redis_hits)
+            except Exception as e:
+                self._bump("redis_errors")
+                logger.warning(f"Embedding cache read failed, falling back to provider: {e}")
+
+        misses = sum(1 for vector in results if vector is None)
+        if misses:
+            self._bump("misses", misses)
+        return results
+
+    def set_many(self, texts: List[str], model_name: str, vectors: List[List[float]]):
+        """Lưu vector vào cả hai tầng cache"""
+        if not texts:
+            return
+        keys = [self.make_key(text, model_name) for text in texts]
+        for key, vector in zip(keys, vectors):
+            self._local_set(key, list(vector))
+
+        if self.redis_client is None:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, vector in zip(keys, vectors):
+                pipe.setex(key, self.ttl, self.pack(vector))
+            pipe.execute()
+        except Exception as e:
+            self._bump("redis_errors")
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters của process hiện tại"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["local_size"] = len(self._local)
+        lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["local_hits"] + stats["redis_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
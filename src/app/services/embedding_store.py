@@ -0,0 +1,143 @@
+"""
+Embedding store trên đĩa: vector của chunk lưu một lần, dùng lại cho mọi collection / benchmark / hot-set
+
+    <root>/meta.json          {"model", "dim", "dtype"}
+    <root>/index.sqlite       content_hash → (shard, row)
+    <root>/shard-00000.npy    ma trận [n, dim] float32 | float16, đọc bằng np.load(mmap_mode="r")
+
+Key là content_hash của chunk (= manifest.content_hash) nên không phụ thuộc collection / payload / point id.
+Shard chỉ được ghi vào index sau khi file .npy đã nằm trên đĩa → process khác đọc song song an toàn.
+Một process ghi (indexer), nhiều process đọc (worker, benchmark, API).
+Chỉ dùng stdlib + numpy: nằm trong app (image backend chỉ có src/app), indexer / benchmark import qua
+create_vector/app_modules.py.
+"""
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+DTYPES = ("float32", "float16")
+
+
+class EmbeddingStore:
+    def __init__(self, root: str, model: Optional[str] = None, dim: Optional[int] = None, dtype: str = "float32",
+                 shard_rows: int = 65536, read_only: bool = False):
+        """
+        Mở store có sẵn (model / dim phải khớp meta) hoặc tạo mới (cần model + dim).
+        dtype chỉ có tác dụng khi tạo mới; đọc ra luôn là float32.
+        """
+        self.root = root
+        self.read_only = read_only
+        self.shard_rows = shard_rows
+        meta_path = os.path.join(root, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if model is not None and meta["model"] != model:
+                raise ValueError(f"Embedding store {root} holds `{meta['model']}` vectors, not `{model}`")
+            if dim is not None and meta["dim"] != dim:
+                raise ValueError(f"Embedding store {root} holds {meta['dim']}-d vectors, not {dim}-d")
+        elif read_only:
+            raise FileNotFoundError(f"No embedding store at {root}")
+        else:
+            if model is None or dim is None:
+                raise ValueError("model and dim are required to create an embedding store")
+            if dtype not in DTYPES:
+                raise ValueError(f"Unsupported store dtype `{dtype}` ({', '.join(DTYPES)})")
+            os.makedirs(root, exist_ok=True)
+            meta = {"model": model, "dim": dim, "dtype": dtype}
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        self.model, self.dim, self.dtype = meta["model"], meta["dim"], meta["dtype"]
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (content_hash TEXT PRIMARY KEY, shard INTEGER, row INTEGER)"
+        )
+        self._shards: Dict[int, np.ndarray] = {}      # shard → memmap
+        self._pending: Dict[str, np.ndarray] = {}     # chưa flush ra shard
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0] + len(self._pending)
+
+    def _shard(self, shard: int) -> np.ndarray:
+        if shard not in self._shards:
+            self._shards[shard] = np.load(os.path.join(self.root, f"shard-{shard:05d}.npy"), mmap_mode="r")
+        return self._shards[shard]
+
+    def _locate(self, hashes: List[str]) -> Dict[str, tuple]:
+        found: Dict[str, tuple] = {}
+        for start in range(0, len(hashes), 500):  # giới hạn số biến của SQLite
+            batch = hashes[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT content_hash, shard, row FROM vectors WHERE content_hash IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            found.update((chunk_hash, (shard, row)) for chunk_hash, shard, row in rows)
+        return found
+
+    def get(self, hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """content_hash → vector float32 (chỉ các hash có trong store)"""
+        hashes = list(set(hashes))
+        vectors: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for chunk_hash in hashes:
+                if chunk_hash in self._pending:
+                    vectors[chunk_hash] = self._pending[chunk_hash].astype(np.float32)
+            by_shard: Dict[int, List[tuple]] = {}
+            for chunk_hash, (shard, row) in self._locate([h for h in hashes if h not in vectors]).items():
+                by_shard.setdefault(shard, []).append((row, chunk_hash))
+            for shard, rows in by_shard.items():
+                rows.sort()  # đọc theo thứ tự trong file
+                matrix = np.asarray(self._shard(shard)[[row for row, _ in rows]], dtype=np.float32)
+                vectors.update((chunk_hash, vec) for (_, chunk_hash), vec in zip(rows, matrix))
+        return vectors
+
+    def add(self, hashes: Iterable[str], vectors: Iterable) -> int:
+        """Thêm vector của các hash chưa có (hash đã có bị bỏ qua); trả về số vector mới"""
+        if self.read_only:
+            raise RuntimeError(f"Embedding store {self.root} is read-only")
+        fresh = {}
+        for chunk_hash, vec in zip(hashes, vectors):
+            if chunk_hash not in self._pending and chunk_hash not in fresh:
+                fresh[chunk_hash] = np.asarray(vec, dtype=self.dtype)
+        with self._lock:
+            for chunk_hash in self._locate(list(fresh)):
+                del fresh[chunk_hash]
+            self._pending.update(fresh)
+            full = len(self._pending) >= self.shard_rows
+        if full:
+            self.flush()
+        return len(fresh)
+
+    def flush(self):
+        """Ghi vector đang chờ thành một shard mới (file trước, index sau)"""
+        with self._lock:
+            if not self._pending:
+                return
+            hashes = list(self._pending)
+            matrix = np.stack([self._pending[chunk_hash] for chunk_hash in hashes]).reshape(len(hashes), self.dim)
+            last = self._db.execute("SELECT MAX(shard) FROM vectors").fetchone()[0]
+            shard = 0 if last is None else last + 1
+            path = os.path.join(self.root, f"shard-{shard:05d}.npy")
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, matrix)
+            os.replace(path + ".tmp", path)
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO vectors (content_hash, shard, row) VALUES (?, ?, ?)",
+                    [(chunk_hash, shard, row) for row, chunk_hash in enumerate(hashes)]
+                )
+            self._pending = {}
+
+    def close(self):
+        if not self.read_only:
+            self.flush()
+        self._shards.clear()
+        self._db.close()
@@ -1,20 +1,122 @@
-from openai import OpenAI
-from typing import List, Dict, Union
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, InternalServerError, RateLimitError
+from typing import List, Dict, Union, Optional, Tuple
 from app.config.settings import cfg_settings
+from app.services.context_packer import estimate_tokens
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.embedding_cache import EmbeddingCache
+from app.services.sparse_encoder import SparseEncoder
 # from sentence_transformers import SentenceTransformer  # COMMENTED FOR OPENAI ONLY
 
+logger = logging.getLogger(__name__)
+
+# Lỗi tạm thời của provider: 429 rate limit, mất kết nối / timeout, 5xx
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+def build_default_cache() -> Optional[EmbeddingCache]:
+    """Cache mặc định: LRU trong process + Redis DB 2 (redis_embed_cache)"""
+    if not cfg_settings.EMBEDDING_CACHE_ENABLED:
+        return None
+    from app.config.database import redis_embed_cache_raw
+    return EmbeddingCache(
+        redis_client=redis_embed_cache_raw,
+        ttl=cfg_settings.EMBEDDING_CACHE_TTL,
+        max_local_items=cfg_settings.EMBEDDING_CACHE_LOCAL_SIZE
+    )
+
+
+def build_default_batcher(handler: "EmbeddingHandler") -> Optional[EmbeddingBatcher]:
+    """Micro-batcher cho cache miss nhỏ (query) của handler; None nếu tắt EMBEDDING_MICRO_BATCH_ENABLED"""
+    if not cfg_settings.EMBEDDING_MICRO_BATCH_ENABLED:
+        return None
+    return EmbeddingBatcher(
+        handler._embed_remote,
+        window_ms=cfg_settings.EMBEDDING_MICRO_BATCH_WINDOW_MS,
+        max_inputs=cfg_settings.EMBEDDING_MICRO_BATCH_MAX_INPUTS,
+        max_in_flight=handler.concurrency
+    )
+
+
+def truncate_embeddings(vectors, dimensions: Optional[int]) -> List[List[float]]:
+    """
+    Matryoshka: giữ `dimensions` chiều đầu rồi chuẩn hoá L2 lại
+    (tương đương tham số `dimensions` của text-embedding-3-*; None / >= số chiều gốc → giữ nguyên)
+    """
+    vectors = [vector.tolist() if hasattr(vector, "tolist") else list(vector) for vector in vectors]
+    if not dimensions or not vectors or dimensions >= len(vectors[0]):
+        return vectors
+    matrix = np.asarray(vectors, dtype=np.float32)[:, :dimensions]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms == 0, 1.0, norms)).tolist()
+
+
+def token_batches(texts: List[str], max_tokens: int, max_inputs: int) -> List[List[str]]:
+    """Chia texts (giữ thứ tự) thành các request không vượt max_tokens ước lượng / max_inputs input"""
+    batches, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_inputs):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Retry-After của provider nếu có, không thì exponential backoff + jitter"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        if retry_after is not None:
+            return float(retry_after)
+    except ValueError:
+        pass
+    delay = min(cfg_settings.EMBEDDING_RETRY_BASE_SECONDS * 2 ** attempt, 60.0)
+    return delay * (0.5 + random.random() / 2)
+
+
 class EmbeddingHandler:
     def __init__(self, provider: str, model_name: str, **kwargs):
         """
         provider: 'openai' (others commented out for now)
         model_name: tên model tương ứng
         kwargs: các tham số bổ sung
+            cache: EmbeddingCache tuỳ chỉnh (mặc định dùng build_default_cache())
+            sparse_encoder: encoder BM25 cho sparse vectors (mặc định SparseEncoder())
+            dimensions: số chiều mặc định của dense vector (None = đầy đủ, cắt Matryoshka)
+            concurrency: số request embeddings.create đồng thời (mặc định EMBEDDING_CONCURRENCY)
+            batcher: EmbeddingBatcher gom cache miss nhỏ của các request đồng thời (mặc định build_default_batcher())
         """
         self.provider = provider.lower()
         self.model_name = model_name
+        self.cache: Optional[EmbeddingCache] = kwargs["cache"] if "cache" in kwargs else build_default_cache()
+        self.sparse_encoder: SparseEncoder = kwargs.get("sparse_encoder") or SparseEncoder()
+        self.dimensions: Optional[int] = kwargs.get("dimensions")
+        self.concurrency: int = max(1, kwargs.get("concurrency") or cfg_settings.EMBEDDING_CONCURRENCY)
+        # Giới hạn chung cho mọi thread dùng handler (Celery worker threads)
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        # Bản async: asyncio.Semaphore gắn với event loop → một semaphore dùng chung cho mỗi loop
+        self._async_slots: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+        self._stats_lock = threading.Lock()
+        self._remote_stats = {"requests": 0, "inputs": 0, "tokens": 0, "retries": 0, "busy_s": 0.0}
 
         if self.provider == "openai":
-            self.client = OpenAI(api_key=cfg_settings.OPENAI_API_KEY)
+            # Retry do _embed_batch đảm nhận (backoff theo Retry-After) → tắt retry nội bộ của SDK
+            self.client = OpenAI(api_key=cfg_settings.OPENAI_API_KEY, max_retries=0)
+            self._async_client: Optional[AsyncOpenAI] = None
+            self.batcher: Optional[EmbeddingBatcher] = (
+                kwargs["batcher"] if "batcher" in kwargs else build_default_batcher(self)
+            )
 
         # elif self.provider == "sentence-transformers":
         #     self.model = SentenceTransformer(model_name)
@@ -26,28 +128,31 @@ class EmbeddingHandler:
         self,
         texts: Union[str, List[str]],
         return_dense: bool = True,
-        return_sparse: bool = False
+        return_sparse: bool = False,
+        use_cache: bool = True,
+        dimensions: Optional[int] = None
     ):
         """
         Mô phỏng API của Milvus BGEM3EmbeddingFunction:
         - Trả dict {'dense_vecs': [...], 'sparse_vecs': [...]} tùy tham số
         - texts: string hoặc list string
+        - use_cache: chỉ gửi các text chưa có trong cache lên provider; dành cho query —
+          đường embed document/bulk truyền use_cache=False để không lấp cache query
+        - dimensions: cắt dense vector (Matryoshka) theo số chiều của collection đích;
+          provider + cache luôn giữ vector đầy đủ nên một entry cache phục vụ mọi số chiều
+        - sparse_vecs: BM25 {'indices', 'values'} tính cục bộ (phía document)
         """
         if isinstance(texts, str):
             texts = [texts]
 
         if self.provider == "openai":
-            response = self.client.embeddings.create(
-                model=self.model_name,
-                input=texts
-            )
-            dense_vecs = [item.embedding for item in response.data]
-
             result = {}
             if return_dense:
-                result['dense_vecs'] = dense_vecs
+                result['dense_vecs'] = truncate_embeddings(
+                    self._encode_dense(texts, use_cache=use_cache), dimensions or self.dimensions
+                )
             if return_sparse:
-                result['sparse_vecs'] = None  # OpenAI không trả sparse
+                result['sparse_vecs'] = self.sparse_encoder.encode(texts)  # OpenAI không trả sparse → BM25 local
 
             return result
 
@@ -55,4 +160,208 @@ class EmbeddingHandler:
         #     return self.model.encode(text, convert_to_numpy=True).tolist()
 
         else:
-            raise ValueError(f"Provider '{self.provider}' không được hỗ trợ. Chỉ hỗ trợ 'openai' hiện tại.")
\ No newline at end of file
+            raise ValueError(f"Provider '{self.provider}' không được hỗ trợ. Chỉ hỗ trợ 'openai' hiện tại.")
+
+    def encode_query_sparse(self, query: str) -> Dict[str, list]:
+        """Sparse vector phía query (IDF do Qdrant áp dụng)"""
+        return self.sparse_encoder.encode_query(query)
+
+    async def aencode(
+        self,
+        texts: Union[str, List[str]],
+        return_dense: bool = True,
+        return_sparse: bool = False,
+        use_cache: bool = True,
+        dimensions: Optional[int] = None
+    ):
+        """Bản async của encode() cho FastAPI handlers (không block event loop)"""
+        if isinstance(texts, str):
+            texts = [texts]
+
+        if self.provider == "openai":
+            result = {}
+            if return_dense:
+                result['dense_vecs'] = truncate_embeddings(
+                    await self._aencode_dense(texts, use_cache=use_cache), dimensions or self.dimensions
+                )
+            if return_sparse:
+                result['sparse_vecs'] = self.sparse_encoder.encode(texts)
+            return result
+
+        else:
+            raise ValueError(f"Provider '{self.provider}' không được hỗ trợ. Chỉ hỗ trợ 'openai' hiện tại.")
+
+    def _cache_lookup(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], Dict[str, List[int]]]:
+        """Đọc cache; trả về (vectors, pending) với pending = text miss đã dedupe → vị trí"""
+        vectors = self.cache.get_many(texts, self.model_name)
+
+        # Dedupe các text miss (cùng nội dung chuẩn hoá chỉ embed một lần)
+        pending: Dict[str, List[int]] = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                pending.setdefault(self.cache.normalize_text(texts[i]), []).append(i)
+        return vectors, pending
+
+    def _cache_fill(
+        self,
+        miss_texts: List[str],
+        vectors: List[Optional[List[float]]],
+        pending: Dict[str, List[int]],
+        fresh: List[List[float]]
+    ):
+        self.cache.set_many(miss_texts, self.model_name, fresh)
+        for positions, vector in zip(pending.values(), fresh):
+            for i in positions:
+                vectors[i] = vector
+
+    def _encode_dense(self, texts: List[str], use_cache: bool = True) -> List[List[float]]:
+        """Dense vectors theo thứ tự texts, chỉ gọi API cho cache miss (đã dedupe)"""
+        if not texts:
+            return []
+        if not use_cache or self.cache is None:
+            return self._embed_misses(texts)
+
+        vectors, pending = self._cache_lookup(texts)
+        if pending:
+            miss_texts = [texts[positions[0]] for positions in pending.values()]
+            self._cache_fill(miss_texts, vectors, pending, self._embed_misses(miss_texts))
+        return vectors
+
+    async def _aencode_dense(self, texts: List[str], use_cache: bool = True) -> List[List[float]]:
+        if not texts:
+            return []
+        if not use_cache or self.cache is None:
+            return await self._aembed_misses(texts)
+
+        # Redis client của cache là sync → chạy trong thread
+        vectors, pending = await asyncio.to_thread(self._cache_lookup, texts)
+        if pending:
+            miss_texts = [texts[positions[0]] for positions in pending.values()]
+            fresh = await self._aembed_misses(miss_texts)
+            await asyncio.to_thread(self._cache_fill, miss_texts, vectors, pending, fresh)
+        return vectors
+
+    def _batched(self, texts: List[str]) -> bool:
+        """Request nhỏ đi qua micro-batcher; request lớn (bulk) tự đủ lớn → gọi thẳng provider"""
+        return self.batcher is not None and len(texts) < self.batcher.max_inputs
+
+    def _embed_misses(self, texts: List[str]) -> List[List[float]]:
+        if self._batched(texts):
+            return self.batcher.embed_many(texts)
+        return self._embed_remote(texts)
+
+    async def _aembed_misses(self, texts: List[str]) -> List[List[float]]:
+        if self._batched(texts):
+            # batch chạy trên thread của batcher (sync client) → gom chung với các thread Celery
+            return await asyncio.wrap_future(self.batcher.submit(texts))
+        return await self._aembed_remote(texts)
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        return token_batches(texts, cfg_settings.EMBEDDING_MAX_BATCH_TOKENS, cfg_settings.EMBEDDING_MAX_BATCH_INPUTS)
+
+    def _record(self, texts: List[str], response, busy: float):
+        """Cộng dồn request thành công (token theo usage của provider, thiếu thì ước lượng)"""
+        usage = getattr(response, "usage", None)
+        tokens = getattr(usage, "total_tokens", None) or sum(estimate_tokens(text) for text in texts)
+        with self._stats_lock:
+            self._remote_stats["requests"] += 1
+            self._remote_stats["inputs"] += len(texts)
+            self._remote_stats["tokens"] += tokens
+            self._remote_stats["busy_s"] += busy
+
+    def _retry_wait(self, error: Exception, attempt: int) -> float:
+        delay = retry_delay(error, attempt)
+        with self._stats_lock:
+            self._remote_stats["retries"] += 1
+        logger.warning(f"[Embedding] {type(error).__name__}, retry {attempt + 1} in {delay:.1f}s")
+        return delay
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Một request embeddings.create (giữ một slot concurrency), retry lỗi tạm thời với backoff"""
+        for attempt in range(cfg_settings.EMBEDDING_MAX_RETRIES + 1):
+            try:
+                with self._slots:
+                    start = time.perf_counter()
+                    response = self.client.embeddings.create(model=self.model_name, input=texts)
+                self._record(texts, response, busy=time.perf_counter() - start)
+                return [item.embedding for item in response.data]
+            except RETRYABLE_ERRORS as e:
+                if attempt == cfg_settings.EMBEDDING_MAX_RETRIES:
+                    raise
+                time.sleep(self._retry_wait(e, attempt))  # không giữ slot khi chờ
+
+    def _embed_remote(self, texts: List[str]) -> List[List[float]]:
+        """
+        Gọi embeddings API của provider: đóng gói theo token ước lượng,
+        các request chạy song song tối đa `concurrency`, kết quả giữ đúng thứ tự texts
+        """
+        batches = self._batches(texts)
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+            results = list(pool.map(self._embed_batch, batches))
+        self._log_throughput(texts, len(batches), time.perf_counter() - start)
+        return [vector for result in results for vector in result]
+
+    def _log_throughput(self, texts: List[str], batches: int, seconds: float):
+        tokens = sum(estimate_tokens(text) for text in texts)
+        logger.info(
+            f"[Embedding] {len(texts)} inputs / ~{tokens} tokens in {batches} requests, "
+            f"{seconds:.2f}s ({tokens / seconds if seconds else 0:.0f} tok/s)"
+        )
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(api_key=cfg_settings.OPENAI_API_KEY, max_retries=0)
+        return self._async_client
+
+    async def _aembed_batch(self, texts: List[str], slots: asyncio.Semaphore) -> List[List[float]]:
+        for attempt in range(cfg_settings.EMBEDDING_MAX_RETRIES + 1):
+            try:
+                async with slots:
+                    start = time.perf_counter()
+                    response = await self.async_client.embeddings.create(model=self.model_name, input=texts)
+                self._record(texts, response, busy=time.perf_counter() - start)
+                return [item.embedding for item in response.data]
+            except RETRYABLE_ERRORS as e:
+                if attempt == cfg_settings.EMBEDDING_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(self._retry_wait(e, attempt))
+
+    def _loop_slots(self) -> asyncio.Semaphore:
+        """Semaphore của event loop hiện tại: mọi lượt aencode trên cùng loop chia chung EMBEDDING_CONCURRENCY"""
+        loop = asyncio.get_running_loop()
+        with self._stats_lock:
+            slots = self._async_slots.get(loop)
+            if slots is None:
+                # Semaphore giữ tham chiếu tới loop → dọn các loop đã đóng (asyncio.run theo lượt gọi)
+                for closed in [known for known in self._async_slots if known.is_closed()]:
+                    del self._async_slots[closed]
+                slots = self._async_slots[loop] = asyncio.Semaphore(self.concurrency)
+        return slots
+
+    async def _aembed_remote(self, texts: List[str]) -> List[List[float]]:
+        batches = self._batches(texts)
+        slots = self._loop_slots()
+        start = time.perf_counter()
+        results = await asyncio.gather(*(self._aembed_batch(batch, slots) for batch in batches))
+        if len(batches) > 1:
+            self._log_throughput(texts, len(batches), time.perf_counter() - start)
+        return [vector for result in results for vector in result]
+
+    def remote_stats(self) -> Dict[str, float]:
+        """Request / input / token / retry đã gửi tới provider trong process hiện tại (busy_s: tổng thời gian request)"""
+        with self._stats_lock:
+            stats = dict(self._remote_stats)
+        stats["busy_s"] = round(stats["busy_s"], 3)
+        if self.batcher is not None:
+            stats["micro_batching"] = self.batcher.stats()
+        return stats
+
+    def cache_stats(self) -> Dict[str, float]:
+        """Hit/miss counters của embedding cache trong process hiện tại"""
+        if self.cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
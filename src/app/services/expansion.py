@@ -0,0 +1,130 @@
+"""
+Neighbor-chunk expansion
+Với các hit cuối cùng: lấy ±window chunk lân cận cùng cid (hoặc document_id) bằng một scroll có filter,
+rồi gộp các chunk liền kề thành đoạn văn liên tục.
+Chunk quá dài được lưu thành nhiều part cùng chunk_index (part_index / part_count, xem
+legal_embedding_tasks.split_oversized_chunk): vị trí trong văn bản là (chunk_index, part_index).
+"""
+from typing import Dict, List, Optional, Tuple
+
+from qdrant_client.models import FieldCondition, Filter, MatchAny, MatchValue
+
+from app.services.context_packer import estimate_tokens
+
+GroupKey = Tuple[str, object]
+Position = Tuple[int, int]
+
+
+def group_key(hit: dict) -> Optional[GroupKey]:
+    """Văn bản gốc của chunk: cid (corpus luật) hoặc document_id (tài liệu web)"""
+    if hit.get("cid") is not None:
+        return "cid", hit["cid"]
+    if hit.get("document_id"):
+        return "document_id", hit["document_id"]
+    return None
+
+
+def position(hit: dict) -> Position:
+    """(chunk_index, part_index): chunk không bị tách là part 0"""
+    return int(hit["chunk_index"]), int(hit.get("part_index") or 0)
+
+
+def follows(prev: dict, chunk: dict) -> bool:
+    """chunk nằm ngay sau prev: part kế tiếp cùng chunk, hoặc part 0 của chunk sau part cuối"""
+    index, part = position(prev)
+    if part + 1 < int(prev.get("part_count") or 1):
+        return position(chunk) == (index, part + 1)
+    return position(chunk) == (index + 1, 0)
+
+
+def neighbor_requests(hits: List[dict], window: int = 1) -> Dict[GroupKey, List[int]]:
+    """
+    chunk_index còn thiếu của mỗi văn bản trong khoảng ±window quanh các hit.
+    Hit là một part của chunk bị tách → lấy cả chunk_index của chính nó (các part anh em).
+    """
+    present: Dict[GroupKey, set] = {}
+    partial: Dict[GroupKey, set] = {}
+    for hit in hits:
+        key = group_key(hit)
+        if key is not None and hit.get("chunk_index") is not None:
+            present.setdefault(key, set()).add(int(hit["chunk_index"]))
+            if int(hit.get("part_count") or 1) > 1:
+                partial.setdefault(key, set()).add(int(hit["chunk_index"]))
+
+    needed: Dict[GroupKey, List[int]] = {}
+    for key, indices in present.items():
+        wanted = {i + offset for i in indices for offset in range(-window, window + 1)}
+        missing = sorted(i for i in (wanted - indices) | partial.get(key, set()) if i >= 0)
+        if missing:
+            needed[key] = missing
+    return needed
+
+
+def neighbor_filter(needed: Dict[GroupKey, List[int]]) -> Filter:
+    """Một filter OR trên tất cả văn bản → một lần scroll cho cả batch"""
+    return Filter(should=[
+        Filter(must=[
+            FieldCondition(key=field, match=MatchValue(value=value)),
+            FieldCondition(key="chunk_index", match=MatchAny(any=indices))
+        ])
+        for (field, value), indices in needed.items()
+    ])
+
+
+def join_overlapping(left: str, right: str, max_overlap: int = 400, min_overlap: int = 20) -> str:
+    """Nối hai chunk liền kề, bỏ phần overlap của chunker (suffix của left == prefix của right)"""
+    for size in range(min(max_overlap, len(left), len(right)), min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return f"{left}\n{right}"
+
+
+def merge_passages(hits: List[dict], neighbors: List[dict]) -> List[dict]:
+    """
+    Gộp hit + neighbor theo văn bản, mỗi dải (chunk_index, part_index) liên tục thành một passage.
+    Thứ tự passage theo hạng của hit tốt nhất trong dải; hit không có cid/chunk_index giữ nguyên.
+    """
+    rank = {id(hit): i for i, hit in enumerate(hits)}
+    by_group: Dict[GroupKey, Dict[Position, dict]] = {}
+    passthrough: List[Tuple[int, dict]] = []
+    for hit in hits:
+        key = group_key(hit)
+        if key is None or hit.get("chunk_index") is None:
+            passthrough.append((rank[id(hit)], hit))
+            continue
+        by_group.setdefault(key, {})[position(hit)] = hit
+    for chunk in neighbors:
+        key = group_key(chunk)
+        if key in by_group:
+            by_group[key].setdefault(position(chunk), chunk)
+
+    passages: List[Tuple[int, dict]] = []
+    for chunks in by_group.values():
+        run: List[dict] = []
+        for pos in sorted(chunks):
+            if run and not follows(run[-1], chunks[pos]):
+                passages.extend(_close_run(run, rank))
+                run = []
+            run.append(chunks[pos])
+        passages.extend(_close_run(run, rank))
+
+    return [passage for _, passage in sorted(passages + passthrough, key=lambda item: item[0])]
+
+
+def _close_run(run: List[dict], rank: Dict[int, int]) -> List[Tuple[int, dict]]:
+    """Một dải liên tục → passage (bỏ dải chỉ gồm neighbor không chứa hit nào)"""
+    ranked = [rank[id(chunk)] for chunk in run if id(chunk) in rank]
+    if not ranked:
+        return []
+    best = min(ranked)
+    anchor = next(chunk for chunk in run if rank.get(id(chunk)) == best)
+    if len(run) == 1:
+        return [(best, anchor)]
+    text = run[0].get("text", "")
+    for prev, chunk in zip(run, run[1:]):
+        if prev["chunk_index"] == chunk["chunk_index"]:
+            text += chunk.get("text", "")  # part anh em: các span liền nhau của cùng text gốc
+        else:
+            text = join_overlapping(text, chunk.get("text", ""))
+    first, last = int(run[0]["chunk_index"]), int(run[-1]["chunk_index"])
+    return [(best, {**anchor, "text": text, "chunk_range": [first, last], "token_count": estimate_tokens(text)})]
@@ -0,0 +1,236 @@
+"""
+Per-worker hot-set tier: các chunk được truy xuất nhiều nhất nằm trong RAM
+dưới dạng ma trận float32 liên tục, chấm điểm bằng một phép nhân ma trận-vector.
+Thống kê hit lấy từ retrieval log (Redis sorted set), refresh định kỳ.
+Vector lấy từ embedding store của indexer (nếu cấu hình, theo payload content_hash), thiếu thì từ Qdrant.
+"""
+import logging
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config.settings import cfg_settings
+from app.services.embedding_store import EmbeddingStore
+from app.services.qdrant_collections import collection_dimensions, dense_vector, to_point_id
+
+logger = logging.getLogger(__name__)
+
+HOT_HITS_KEY = "legal_hot_hits"
+_RETRIEVE_BATCH = 256
+
+
+def build_default_hot_set() -> Optional["HotSetIndex"]:
+    """Hot-set mặc định cho LEGAL_COLLECTION, log hit trên redis_client_web"""
+    if not cfg_settings.HOT_SET_ENABLED:
+        return None
+    if cfg_settings.RETRIEVAL_SEARCH_MODE.lower() != "dense":
+        logger.warning(
+            f"Hot-set only serves dense searches; RETRIEVAL_SEARCH_MODE={cfg_settings.RETRIEVAL_SEARCH_MODE} "
+            f"searches go to Qdrant and are not recorded"
+        )
+    from app.config.database import redis_client_web
+    return HotSetIndex(
+        redis_client_web,
+        collection_name=cfg_settings.LEGAL_COLLECTION,
+        size=cfg_settings.HOT_SET_SIZE,
+        min_score=cfg_settings.HOT_SET_MIN_SCORE,
+        refresh_seconds=cfg_settings.HOT_SET_REFRESH_SECONDS,
+        store=build_embedding_store(
+            cfg_settings.HOT_SET_EMBEDDING_STORE,
+            model=cfg_settings.EMBEDDING_MODEL,
+            dimensions=cfg_settings.LEGAL_EMBEDDING_DIMENSIONS
+        )
+    )
+
+
+def build_embedding_store(path: Optional[str], model: str, dimensions: int):
+    """
+    Embedding store read-only của indexer (embedding_store.py); None nếu không cấu hình / không mở được
+    hoặc không dùng được cho collection: model khác, hay ít chiều hơn dimensions (store giữ vector đầy đủ,
+    cắt Matryoshka về số chiều của collection).
+    """
+    if not path:
+        return None
+    try:
+        store = EmbeddingStore(path, model=model, read_only=True)
+    except Exception as e:
+        logger.warning(f"Hot-set embedding store unavailable, using Qdrant vectors: {e}")
+        return None
+    if store.dim < dimensions:
+        logger.warning(
+            f"Hot-set embedding store holds {store.dim}-d vectors, collection needs {dimensions}-d; using Qdrant vectors"
+        )
+        return None
+    return store
+
+
+class HotSetIndex:
+    """Top-N chunk theo số lần được trả về; chỉ trả lời khi best score >= min_score"""
+
+    def __init__(
+        self,
+        redis_client,
+        collection_name: str,
+        size: int = 5000,
+        min_score: float = 0.75,
+        refresh_seconds: int = 600,
+        key: str = HOT_HITS_KEY,
+        store=None
+    ):
+        """store: EmbeddingStore (get(content_hashes) → vectors) để không phải kéo vector từ Qdrant"""
+        self.redis_client = redis_client
+        self.collection_name = collection_name
+        self.size = size
+        self.min_score = min_score
+        self.refresh_seconds = refresh_seconds
+        self.key = key
+        self.store = store
+
+        # (matrix, hits) thay cùng lúc để reader không thấy trạng thái nửa vời
+        self._snapshot: Tuple[np.ndarray, List[Dict[str, Any]]] = (np.zeros((0, 0), dtype=np.float32), [])
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"answered": 0, "fallthrough": 0, "refreshes": 0}
+
+    def __len__(self) -> int:
+        return len(self._snapshot[1])
+
+    # ---------- Retrieval log ----------
+    def record_hits(self, hit_lists: List[Optional[List[dict]]]):
+        """ZINCRBY cho mỗi chunk được trả về (một pipeline cho cả lượt search)"""
+        ids = [hit["id"] for hits in hit_lists if hits for hit in hits if hit.get("id")]
+        if not ids:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for point_id in ids:
+                pipe.zincrby(self.key, 1, point_id)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Cannot record hot-set hits: {e}")
+
+    # ---------- Refresh ----------
+    def maybe_refresh(self, client):
+        """
+        Refresh khi quá refresh_seconds, trong thread nền (request không chờ các batch retrieve);
+        chỉ một refresh chạy cùng lúc, search dùng snapshot cũ tới khi bản mới sẵn sàng.
+        """
+        if time.monotonic() - self._refreshed_at < self.refresh_seconds:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            threading.Thread(
+                target=self._refresh_in_background, args=(client,), name="hot-set-refresh", daemon=True
+            ).start()
+        except Exception as e:
+            logger.warning(f"Cannot start hot-set refresh: {e}")
+            self._refreshed_at = time.monotonic()
+            self._lock.release()
+
+    def _refresh_in_background(self, client):
+        try:
+            self.refresh(client)
+        except Exception as e:
+            logger.warning(f"Hot-set refresh failed: {e}")
+        finally:
+            self._refreshed_at = time.monotonic()
+            self._lock.release()
+
+    def refresh(self, client):
+        """Nạp lại top-N id từ retrieval log, lấy payload từ Qdrant, vector từ store hoặc Qdrant"""
+        from app.services.retrieval_cache import format_hit
+
+        ids = self.redis_client.zrevrange(self.key, 0, self.size - 1)
+        ids = [point_id.decode() if isinstance(point_id, bytes) else point_id for point_id in ids]
+        vectors, hits = [], []
+        for start in range(0, len(ids), _RETRIEVE_BATCH):
+            points = client.retrieve(
+                collection_name=self.collection_name,
+                ids=[to_point_id(point_id) for point_id in ids[start:start + _RETRIEVE_BATCH]],
+                with_payload=True,
+                with_vectors=self.store is None
+            )
+            stored = self._stored_vectors(points, collection_dimensions(client, self.collection_name))
+            missing = [point.id for point in points if point.id not in stored]
+            if self.store is not None and missing:
+                stored.update(
+                    (point.id, dense_vector(point))
+                    for point in client.retrieve(
+                        collection_name=self.collection_name, ids=missing, with_payload=False, with_vectors=True
+                    )
+                )
+            for point in points:
+                vector = stored.get(point.id) if self.store is not None else dense_vector(point)
+                if vector is None or not len(vector):
+                    continue
+                vectors.append(vector)
+                hits.append(format_hit(SimpleNamespace(id=point.id, payload=point.payload, score=0.0)))
+
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        if len(matrix):
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms == 0, 1.0, norms)
+        self._snapshot = (matrix, hits)
+        self._stats["refreshes"] += 1
+        logger.info(f"Hot-set refreshed: {len(hits)} chunks from `{self.collection_name}`")
+
+    def _stored_vectors(self, points, dimensions: int) -> Dict[Any, np.ndarray]:
+        """
+        point id → vector trong embedding store (theo payload content_hash).
+        Store giữ vector đầy đủ → cắt về số chiều của collection (chuẩn hoá lại khi dựng ma trận).
+        """
+        if self.store is None:
+            return {}
+        if self.store.dim < dimensions:  # alias đã swap sang collection nhiều chiều hơn store
+            logger.warning(f"Hot-set embedding store holds {self.store.dim}-d vectors, not {dimensions}-d")
+            return {}
+        by_hash = {point.payload.get("content_hash"): point.id for point in points if point.payload}
+        by_hash.pop(None, None)
+        try:
+            found = self.store.get(by_hash)
+        except Exception as e:
+            logger.warning(f"Cannot read hot-set vectors from embedding store: {e}")
+            return {}
+        return {by_hash[chunk_hash]: vector[:dimensions] for chunk_hash, vector in found.items()}
+
+    # ---------- Search ----------
+    def search(
+        self,
+        vector: List[float],
+        limit: int,
+        score_threshold: Optional[float] = None
+    ) -> Optional[List[dict]]:
+        """Top-k cosine trong hot-set, hoặc None nếu best score dưới min_score (→ Qdrant)"""
+        matrix, hits = self._snapshot
+        if not hits or vector is None:
+            return None
+        query = np.asarray(vector, dtype=np.float32)
+        if query.shape[0] != matrix.shape[1]:
+            return None
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+        scores = matrix @ (query / norm)
+
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if scores[top[0]] < self.min_score:
+            self._stats["fallthrough"] += 1
+            return None
+
+        self._stats["answered"] += 1
+        floor = score_threshold if score_threshold is not None else float("-inf")
+        return [dict(hits[j], score=float(scores[j])) for j in top if scores[j] >= floor]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self._stats["answered"] + self._stats["fallthrough"]
+        return {
+            "size": len(self),
+            **self._stats,
+            "answer_rate": self._stats["answered"] / total if total else 0.0
+        }
@@ -7,6 +7,8 @@ from app.tasks.legal_rag_tasks import generate_legal_response
 from app.brain import analyze_user_query
 from app.config.database import conversations_col, messages_col, db_async
 from app.config.settings import cfg_settings
+from app.services.answer_cache import build_default_answer_cache
+from typing import Optional
 import logging
 from fastapi import HTTPException
 
@@ -18,7 +20,8 @@ class LegalChatService:
     
     def __init__(self):
         self.app_name = cfg_settings.APP_NAME
-        self.similarity_threshold = cfg_settings.SIMILARITY_THRESHOLD
+        self.answer_cache_threshold = cfg_settings.ANSWER_CACHE_THRESHOLD
+        self.answer_cache = build_default_answer_cache()
     
     def handle_legal_message(self, data: MessageInput):
         """Handle incoming legal consultation message"""
@@ -33,9 +36,9 @@ class LegalChatService:
         # Save user message
         self._save_user_message(conversation_id, data.user_id, data.message)
         
-        # Check for reused answer (currently disabled for legal queries)
-        # reused_answer = self._check_legal_reuse(data.message)
-        reused_answer = None
+        # Câu hỏi mở đầu hội thoại là câu độc lập → tra answer-reuse cache
+        # (câu hỏi nối tiếp phụ thuộc ngữ cảnh nên luôn đi qua analyze)
+        reused_answer = None if data.conversation_id else self._check_legal_reuse(data.message)
         if reused_answer:
             self._save_reused_legal_response(conversation_id, data.user_id, data.message, reused_answer)
             return {
@@ -120,12 +123,36 @@ class LegalChatService:
         except Exception as e:
             logger.error(f"Error saving reused legal response: {str(e)}")
     
-    def _check_legal_reuse(self, message: str) -> str:
-        """Check if legal query can be reused (currently disabled)"""
-        # TODO: Implement legal-specific similarity checking
-        # For now, always return False to ensure fresh legal analysis
-        return None
+    def _check_legal_reuse(self, message: str) -> Optional[str]:
+        """Câu trả lời đã có cho câu hỏi tương tự (>= ANSWER_CACHE_THRESHOLD, cùng law version, còn hạn)"""
+        if self.answer_cache is None:
+            return None
+        hit = self.answer_cache.lookup(message, threshold=self.answer_cache_threshold)
+        if not hit:
+            return None
+        logger.info(f"Answer cache hit (score={hit['score']:.3f}) for: {message[:100]}")
+        return hit["answer"]
     
+    def _opening_question(self, conversation_id: str) -> Optional[str]:
+        """
+        Câu hỏi gốc của người dùng nếu đây là lượt mở đầu hội thoại (một câu hỏi, chưa có trả lời).
+        Chỉ câu trả lời cho câu hỏi độc lập này mới được index vào answer-reuse cache, đúng với key
+        mà handle_legal_message dùng để lookup (data.message); câu nối tiếp phụ thuộc ngữ cảnh → None.
+        """
+        if self.answer_cache is None:
+            return None
+        try:
+            messages = list(messages_col.find(
+                {"conversation_id": conversation_id},
+                {"_id": 0, "role": 1, "text": 1}
+            ).limit(3))
+        except Exception as e:
+            logger.warning(f"Cannot read conversation {conversation_id} for answer reuse: {e}")
+            return None
+        if len(messages) != 1 or messages[0].get("role") != "user":
+            return None
+        return messages[0].get("text") or None
+
     async def generate_conversation_title(self, conversation_id: str) -> str:
         """Generate a meaningful title from the first user message"""
         try:
@@ -215,7 +242,9 @@ class LegalChatService:
                 user_id=data.user_id,
                 user_message=data.rewrite_query or "Legal consultation request",
                 using_web_search=data.use_web_search,
-                using_retrieval=data.use_retrieval
+                using_retrieval=data.use_retrieval,
+                legal_documents=data.legal_documents,
+                reuse_question=self._opening_question(data.conversation_id)
             )
             
             logger.info(f"Legal consultation task queued: {task_result.id}")
@@ -0,0 +1,270 @@
+"""
+Qdrant collection bootstrap shared by rag_service and the embedding tasks
+"""
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Disabled,
+    Distance,
+    FieldCondition,
+    Filter,
+    MatchAny,
+    MatchValue,
+    Modifier,
+    PayloadSchemaType,
+    QuantizationSearchParams,
+    Range,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    SparseVectorParams,
+    VectorParams,
+    VectorParamsDiff,
+)
+
+from app.config.settings import cfg_settings
+
+logger = logging.getLogger(__name__)
+
+DENSE_VECTOR_NAME = ""        # unnamed default vector (tương thích các point cũ)
+SPARSE_VECTOR_NAME = "bm25"   # named sparse vector cho lexical/hybrid search
+DEFAULT_VECTOR_SIZE = 1536    # OpenAI text-embedding-3-small
+
+# Payload index cho filter phía server (neighbor scroll, point_exists, metadata filter)
+LEGAL_PAYLOAD_INDEXES: Dict[str, PayloadSchemaType] = {
+    "cid": PayloadSchemaType.INTEGER,
+    "chunk_index": PayloadSchemaType.INTEGER,
+    "document_id": PayloadSchemaType.KEYWORD,
+    "parent_id": PayloadSchemaType.KEYWORD,         # part của chunk quá dài (xoá part cũ khi ghi lại)
+    "law_type": PayloadSchemaType.KEYWORD,          # luật | nghị định | thông tư | ...
+    "issued_year": PayloadSchemaType.INTEGER,
+    "validity_status": PayloadSchemaType.KEYWORD,   # còn hiệu lực | hết hiệu lực | ...
+}
+ANSWER_PAYLOAD_INDEXES: Dict[str, PayloadSchemaType] = {
+    "law_version": PayloadSchemaType.INTEGER,
+    "expires_at": PayloadSchemaType.FLOAT,
+}
+LAW_METADATA_FIELDS = ("law_type", "issued_year", "validity_status")
+METADATA_FILTER_FIELDS = LAW_METADATA_FIELDS + ("cid", "document_id")
+
+_sparse_support: Dict[str, tuple] = {}  # collection → (has bm25, checked_at)
+_indexed_collections: set = set()
+_dimensions: Dict[str, tuple] = {}      # collection → (size, checked_at)
+CONFIG_TTL = 60                         # alias có thể được swap sang version khác số chiều / có-không có bm25
+
+
+def payload_indexes_for(collection_name: str) -> Dict[str, PayloadSchemaType]:
+    return ANSWER_PAYLOAD_INDEXES if collection_name == "chat_questions" else LEGAL_PAYLOAD_INDEXES
+
+
+def dimensions_for(collection_name: str) -> int:
+    """Số chiều dense khi tạo collection mới (Matryoshka: <= số chiều đầy đủ của model)"""
+    if collection_name == "chat_questions":
+        return cfg_settings.ANSWER_EMBEDDING_DIMENSIONS
+    return cfg_settings.LEGAL_EMBEDDING_DIMENSIONS
+
+
+def collection_dimensions(client, collection_name: str) -> int:
+    """
+    Số chiều dense thực tế của collection (query phải được cắt về đúng số chiều này).
+    Cache theo process CONFIG_TTL giây; không đọc được → dimensions_for().
+    """
+    cached = _dimensions.get(collection_name)
+    if cached is not None and time.monotonic() - cached[1] < CONFIG_TTL:
+        return cached[0]
+    try:
+        vectors = client.get_collection(collection_name).config.params.vectors
+        if isinstance(vectors, dict):
+            vectors = vectors[DENSE_VECTOR_NAME]
+        size = vectors.size
+    except Exception as e:
+        logger.warning(f"[Qdrant] Cannot read vector size of `{collection_name}`: {e}")
+        return cached[0] if cached is not None else dimensions_for(collection_name)
+    _dimensions[collection_name] = (size, time.monotonic())
+    return size
+
+
+def to_point_id(value):
+    """Id trong hit dict là str; Qdrant cần int cho id số"""
+    return int(value) if isinstance(value, str) and value.isdigit() else value
+
+
+def dense_vector(point) -> Optional[list]:
+    """Dense vector của Record (collection có sparse → vector là dict theo tên)"""
+    vector = point.vector
+    return vector.get(DENSE_VECTOR_NAME) if isinstance(vector, dict) else vector
+
+
+def build_quantization_config(quantization: Optional[str]):
+    """scalar (int8) | binary | none → quantization_config cho Qdrant"""
+    quantization = (quantization or "none").lower()
+    if quantization == "scalar":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if quantization == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    if quantization == "none":
+        return None
+    raise ValueError(f"Unknown quantization `{quantization}` (expected scalar | binary | none)")
+
+
+def build_search_params(
+    rescore: Optional[bool] = None,
+    oversampling: Optional[float] = None
+) -> SearchParams:
+    """Search params cho nhánh dense: oversample trên vector lượng tử hoá rồi rescore bằng vector gốc"""
+    return SearchParams(
+        quantization=QuantizationSearchParams(
+            ignore=False,
+            rescore=cfg_settings.RETRIEVAL_QUANT_RESCORE if rescore is None else rescore,
+            oversampling=cfg_settings.RETRIEVAL_QUANT_OVERSAMPLING if oversampling is None else oversampling
+        )
+    )
+
+
+def ensure_collection(
+    client,
+    collection_name: str,
+    vector_size: Optional[int] = None,
+    with_sparse: bool = True,
+    quantization: Optional[str] = None,
+    on_disk: Optional[bool] = None
+) -> bool:
+    """
+    Tạo collection nếu chưa có (kèm payload index). Trả về True nếu vừa tạo mới.
+    vector_size mặc định theo dimensions_for(); quantization/on_disk theo QDRANT_QUANTIZATION / QDRANT_VECTORS_ON_DISK.
+    """
+    vector_size = dimensions_for(collection_name) if vector_size is None else vector_size
+    quantization = cfg_settings.QDRANT_QUANTIZATION if quantization is None else quantization
+    on_disk = cfg_settings.QDRANT_VECTORS_ON_DISK if on_disk is None else on_disk
+    try:
+        if client.collection_exists(collection_name):
+            ensure_payload_indexes(client, collection_name)
+            return False
+    except Exception as e:
+        logger.warning(f"[Qdrant] Cannot check collection `{collection_name}`: {e}")
+
+    try:
+        client.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE, on_disk=on_disk),
+            sparse_vectors_config=(
+                {SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)} if with_sparse else None
+            ),
+            quantization_config=build_quantization_config(quantization)
+        )
+        _sparse_support[collection_name] = (with_sparse, time.monotonic())
+        ensure_payload_indexes(client, collection_name)
+        logger.info(
+            f"[Qdrant] Created collection `{collection_name}` "
+            f"(dim={vector_size}, sparse={with_sparse}, quantization={quantization}, on_disk={on_disk})"
+        )
+        return True
+    except Exception as e:
+        if "already exists" in str(e):
+            logger.info(f"[Qdrant] Collection `{collection_name}` already exists (race condition)")
+            ensure_payload_indexes(client, collection_name)
+            return False
+        raise
+
+
+def ensure_payload_indexes(
+    client,
+    collection_name: str,
+    schema: Optional[Dict[str, PayloadSchemaType]] = None
+) -> int:
+    """
+    Khai báo payload index còn thiếu (idempotent, cache theo process).
+    Trả về số index vừa tạo.
+    """
+    if collection_name in _indexed_collections and schema is None:
+        return 0
+    schema = payload_indexes_for(collection_name) if schema is None else schema
+    try:
+        existing = client.get_collection(collection_name).payload_schema or {}
+    except Exception as e:
+        logger.warning(f"[Qdrant] Cannot read payload schema of `{collection_name}`: {e}")
+        return 0
+
+    created = 0
+    for field_name, field_schema in schema.items():
+        if field_name in existing:
+            continue
+        try:
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=field_schema
+            )
+            created += 1
+        except Exception as e:
+            logger.warning(f"[Qdrant] Cannot create payload index `{collection_name}.{field_name}`: {e}")
+    _indexed_collections.add(collection_name)
+    if created:
+        logger.info(f"[Qdrant] Created {created} payload indexes on `{collection_name}`")
+    return created
+
+
+def build_metadata_filter(filters: Optional[Dict[str, Any]]) -> Optional[Filter]:
+    """
+    {"law_type": "luật", "issued_year": 2024, "validity_status": ["còn hiệu lực"]} → Filter
+    - giá trị đơn: match chính xác; list: match any
+    - dict {"gte", "gt", "lte", "lt"}: range (vd. issued_year từ 2020)
+    """
+    if not filters:
+        return None
+    conditions = []
+    for field_name, value in filters.items():
+        if field_name not in METADATA_FILTER_FIELDS:
+            raise ValueError(f"Unsupported filter field `{field_name}` (expected one of {METADATA_FILTER_FIELDS})")
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            conditions.append(FieldCondition(key=field_name, range=Range(**value)))
+        elif isinstance(value, (list, tuple, set)):
+            conditions.append(FieldCondition(key=field_name, match=MatchAny(any=list(value))))
+        else:
+            conditions.append(FieldCondition(key=field_name, match=MatchValue(value=value)))
+    return Filter(must=conditions) if conditions else None
+
+
+def has_sparse_vectors(client, collection_name: str) -> bool:
+    """Collection có named sparse vector `bm25` không (cache theo process CONFIG_TTL giây)"""
+    cached = _sparse_support.get(collection_name)
+    if cached is not None and time.monotonic() - cached[1] < CONFIG_TTL:
+        return cached[0]
+    try:
+        params = client.get_collection(collection_name).config.params
+        with_sparse = bool(params.sparse_vectors and SPARSE_VECTOR_NAME in params.sparse_vectors)
+    except Exception as e:
+        logger.warning(f"[Qdrant] Cannot read config of `{collection_name}`: {e}")
+        return cached[0] if cached is not None else False
+    _sparse_support[collection_name] = (with_sparse, time.monotonic())
+    return with_sparse
+
+
+def migrate_collection(
+    client,
+    collection_name: str,
+    quantization: Optional[str] = "scalar",
+    on_disk: bool = True
+):
+    """
+    Chuyển collection đang chạy sang vector lượng tử hoá + vector gốc on-disk (in place).
+    Qdrant tự rebuild quantized segments ở background, collection vẫn phục vụ search.
+    """
+    quantization_config = build_quantization_config(quantization)
+    client.update_collection(
+        collection_name=collection_name,
+        vectors_config={DENSE_VECTOR_NAME: VectorParamsDiff(on_disk=on_disk)},
+        quantization_config=quantization_config if quantization_config is not None else Disabled.DISABLED
+    )
+    logger.info(
+        f"[Qdrant] Migrated collection `{collection_name}` (quantization={quantization}, on_disk={on_disk})"
+    )
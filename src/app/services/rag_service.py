@@ -1,11 +1,28 @@
+import asyncio
 import logging
-from typing import Optional, List
-from bson.objectid import ObjectId
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, List, Union
 from qdrant_client.http.models import PointStruct
-from qdrant_client.models import VectorParams, Distance
-from app.tasks.legal_embedding_tasks import embed_query_task
+from qdrant_client.models import Filter, Fusion, FusionQuery, Prefetch, QueryRequest, SparseVector
 from app.config.database import db_manager
 from app.config.settings import cfg_settings
+from app.services.retrieval_cache import RetrievalCache, build_default_retrieval_cache, format_hit
+from app.services.answer_cache import build_default_answer_cache
+from app.services.diversify import drop_near_duplicates, mmr_select
+from app.services.expansion import merge_passages, neighbor_filter, neighbor_requests
+from app.services.hot_set import build_default_hot_set
+from app.services.reranker import build_default_reranker
+from app.services.qdrant_collections import (
+    SPARSE_VECTOR_NAME,
+    build_metadata_filter,
+    build_search_params,
+    collection_dimensions,
+    dense_vector,
+    ensure_collection,
+    has_sparse_vectors,
+    to_point_id,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -13,10 +30,24 @@ logger = logging.getLogger(__name__)
 class LegalRAGService:
     def __init__(
         self,
-        messages_col=None
+        messages_col=None,
+        result_cache=None,
+        hot_set=None,
+        reranker=None,
+        vector_client=None,
+        embedder=None
     ):
-        self.vector_client = db_manager.qdrant_client
-        self.collection_names = ["chat_questions", "legal_documents_collection"]
+        """
+        vector_client / embedder: override QdrantClient và EmbeddingHandler mặc định
+        (benchmark offline dùng Qdrant in-memory + embedder giả lập)
+        """
+        self.vector_client = vector_client if vector_client is not None else db_manager.qdrant_client
+        self._embedder = embedder
+        self.result_cache = result_cache if result_cache is not None else build_default_retrieval_cache()
+        self.hot_set = hot_set if hot_set is not None else build_default_hot_set()
+        self.reranker = reranker if reranker is not None else build_default_reranker()
+        self.answer_cache = build_default_answer_cache()
+        self.collection_names = ["chat_questions", cfg_settings.LEGAL_COLLECTION]
         self.messages_col = messages_col
         self.__check_collection_exists(self.collection_names)
 
@@ -24,16 +55,14 @@ class LegalRAGService:
         """Kiểm tra hoặc tạo mới collection Qdrant."""
         try:
             for collection_name in collection_names:
-                try:
-                    # Try to get collection info instead of collection_exists
-                    self.vector_client.get_collection(collection_name)
+                # chat_questions chỉ cần dense; collection tài liệu có thêm sparse BM25
+                created = ensure_collection(
+                    self.vector_client,
+                    collection_name,
+                    with_sparse=collection_name != "chat_questions"
+                )
+                if not created:
                     logger.info(f"[Qdrant] Collection `{collection_name}` đã tồn tại.")
-                except Exception:
-                    logger.warning(f"[Qdrant] Collection `{collection_name}` không tồn tại. Tạo mới.")
-                    self.vector_client.create_collection(
-                        collection_name=collection_name,
-                        vectors_config=VectorParams(size=1536, distance=Distance.COSINE)  # OpenAI embedding size
-                    )
         except Exception as e:
             logger.warning(f"Lỗi khi kiểm tra hoặc tạo collection: {e}")
             logger.warning("Tiếp tục mà không có Qdrant connection...")
@@ -51,79 +80,570 @@ class LegalRAGService:
             raise
 
     def check_reuse(self, query: str, threshold: float = 0.95, top_k: int = 3) -> Optional[str]:
-        """Kiểm tra xem câu hỏi đã được hỏi trước chưa."""
-        try:
-            embedding_task = embed_query_task.delay(query)
-            vector = embedding_task.get(timeout=30)
-            hits = self.vector_client.search(
-                collection_name="chat_questions",
-                query_vector=vector,
-                limit=top_k,
-                with_payload=True,
-                score_threshold=threshold
-            )
+        """Kiểm tra xem câu hỏi đã được hỏi trước chưa (answer-reuse cache, không qua Celery)."""
+        if self.answer_cache is None:
+            return None
+        hit = self.answer_cache.lookup(query, threshold=threshold)
+        return hit["answer"] if hit else None
 
-            if not hits or not self.messages_col:
-                return None
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            # Import embedding model directly to avoid nested task calls
+            from app.tasks.legal_embedding_tasks import embedding_model
+            self._embedder = embedding_model
+        return self._embedder
 
-            for hit in hits:
-                message_id = hit.payload.get("message_id")
-                if message_id:
-                    assistant_msg = self.messages_col.find_one({"_id": ObjectId(message_id)})
-                    if assistant_msg and assistant_msg["role"] == "assistant":
-                        return assistant_msg["text"]
-            return None
-        except Exception:
-            logger.exception("Lỗi khi check_reuse")
-            return None
+    def _embed_queries(self, query_texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        """
+        Dense vectors cho nhiều query trong một lần gọi embeddings.create (qua embedding cache).
+        dimensions: số chiều của collection đích (vector được cắt Matryoshka + chuẩn hoá lại).
+        """
+        vectors = self.embedder.encode(query_texts, return_dense=True, dimensions=dimensions)["dense_vecs"]
+        return [vector.tolist() if hasattr(vector, "tolist") else list(vector) for vector in vectors]
+
+    def _sparse_query(self, query_text: str) -> SparseVector:
+        return SparseVector(**self.embedder.encode_query_sparse(query_text))
 
-    def search(self, collection_name: str, query_text: str, limit: int = 20) -> List[dict]:
-        """Tìm kiếm trong Qdrant."""
+    def resolve_mode(self, collection_name: str, mode: Optional[str] = None) -> str:
+        """dense | sparse | hybrid; fallback về dense nếu collection chưa có sparse vector."""
+        mode = (mode or cfg_settings.RETRIEVAL_SEARCH_MODE).lower()
+        if mode not in ("dense", "sparse", "hybrid"):
+            logger.warning(f"Unknown search mode `{mode}`, using dense")
+            return "dense"
+        if mode != "dense" and not has_sparse_vectors(self.vector_client, collection_name):
+            logger.info(f"Collection `{collection_name}` has no sparse vectors, using dense search")
+            return "dense"
+        return mode
+
+    def _build_request(
+        self,
+        mode: str,
+        vector: Optional[List[float]],
+        query_text: str,
+        limit: int,
+        score_threshold: Optional[float] = None,
+        rescore: Optional[bool] = None,
+        oversampling: Optional[float] = None,
+        query_filter: Optional[Filter] = None
+    ) -> QueryRequest:
+        """
+        Một request cho query_batch_points.
+        hybrid: hai nhánh prefetch (dense + sparse) chạy đồng thời phía Qdrant, gộp bằng RRF.
+        rescore/oversampling: áp dụng cho nhánh dense trên collection lượng tử hoá.
+        query_filter: metadata filter (payload index) áp dụng phía server cho mọi nhánh.
+        """
+        dense_params = build_search_params(rescore=rescore, oversampling=oversampling)
+        if mode == "sparse":
+            return QueryRequest(
+                query=self._sparse_query(query_text),
+                using=SPARSE_VECTOR_NAME,
+                filter=query_filter,
+                limit=limit,
+                with_payload=True
+            )
+        if mode == "dense":
+            return QueryRequest(
+                query=vector,
+                filter=query_filter,
+                limit=limit,
+                score_threshold=score_threshold,
+                params=dense_params,
+                with_payload=True
+            )
+
+        prefetch_limit = limit * cfg_settings.RETRIEVAL_PREFETCH_MULTIPLIER
+        return QueryRequest(
+            prefetch=[
+                Prefetch(
+                    query=vector,
+                    filter=query_filter,
+                    limit=prefetch_limit,
+                    score_threshold=score_threshold,
+                    params=dense_params
+                ),
+                Prefetch(
+                    query=self._sparse_query(query_text),
+                    using=SPARSE_VECTOR_NAME,
+                    filter=query_filter,
+                    limit=prefetch_limit
+                ),
+            ],
+            query=FusionQuery(fusion=Fusion.RRF),
+            limit=limit,
+            with_payload=True
+        )
+
+    def search(
+        self,
+        collection_name: str,
+        query_text: str,
+        limit: int = 20,
+        score_threshold: Optional[float] = None,
+        use_cache: bool = True,
+        mode: Optional[str] = None,
+        rescore: Optional[bool] = None,
+        oversampling: Optional[float] = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[dict]:
+        """
+        Tìm kiếm trong Qdrant (đọc cache kết quả trước khi embed/search).
+        mode: dense | sparse | hybrid (dense + BM25, gộp bằng RRF)
+        rescore/oversampling: override per-request cho collection lượng tử hoá
+        filters: metadata filter phía server, vd. {"law_type": "luật", "issued_year": {"gte": 2024}}
+        """
         if not query_text.strip():
             logger.warning("Truy vấn tìm kiếm rỗng hoặc không hợp lệ")
             return []
+        return self.search_many(
+            collection_name,
+            [query_text],
+            limit=limit,
+            score_threshold=score_threshold,
+            use_cache=use_cache,
+            mode=mode,
+            fuse=False,
+            rescore=rescore,
+            oversampling=oversampling,
+            filters=filters
+        )[0]
 
-        try:
-            # Import and call embedding function directly to avoid nested task calls
-            from app.tasks.legal_embedding_tasks import embed_query_sync
-            embedding_result = embed_query_sync(query_text)
-            
-            # Debug log
-            logger.info(f"Embedding result type: {type(embedding_result)}")
-            logger.info(f"Embedding result: {embedding_result}")
-            
-            # Extract vector from embedding result - FIX LOGIC
-            if isinstance(embedding_result, dict) and "dense_vecs" in embedding_result:
-                # BGE model returns {dense_vecs: [[...]], ...}
-                vector = embedding_result["dense_vecs"][0]
-                logger.info(f"Extracted vector from dense_vecs: {type(vector)}, length: {len(vector)}")
-            elif isinstance(embedding_result, dict) and "embedding" in embedding_result:
-                # OpenAI format {embedding: [...], ...}
-                vector = embedding_result["embedding"]
-                logger.info(f"Extracted vector from embedding: {type(vector)}, length: {len(vector)}")
-            elif isinstance(embedding_result, list):
-                # Direct list format
-                vector = embedding_result
-                logger.info(f"Using direct list vector: {type(vector)}, length: {len(vector)}")
+    def _plan(
+        self,
+        collection_name: str,
+        queries: List[str],
+        limit: int,
+        score_threshold: Optional[float],
+        use_cache: bool,
+        mode: Optional[str],
+        rescore: Optional[bool],
+        oversampling: Optional[float],
+        filters: Optional[Dict[str, Any]] = None
+    ) -> "_SearchPlan":
+        """Chuẩn hoá tham số và đọc cache kết quả (các query còn lại nằm trong plan.pending)."""
+        plan = _SearchPlan(
+            collection_name=collection_name,
+            queries=list(queries),
+            limit=limit,
+            score_threshold=score_threshold,
+            mode=self.resolve_mode(collection_name, mode),
+            rescore=rescore,
+            oversampling=oversampling,
+            filters=filters or None,
+            query_filter=build_metadata_filter(filters),
+            cache=self.result_cache if use_cache else None
+        )
+        # Giữ nguyên vị trí input: query rỗng → [] ngay (không embed/search), còn lại None = pending
+        plan.per_query = [None if query and query.strip() else [] for query in plan.queries]
+        if plan.mode != "sparse":
+            plan.dimensions = collection_dimensions(self.vector_client, collection_name)
+        if plan.cache is not None and plan.pending:
+            plan.version = plan.cache.current_version()
+            pending = plan.pending
+            for i in pending:
+                plan.per_query[i] = plan.cache.get(
+                    plan.queries[i], limit, score_threshold, collection_name,
+                    version=plan.version, params=plan.cache_params
+                )
+            hits_from_cache = len(pending) - len(plan.pending)
+            if hits_from_cache:
+                logger.info(f"Retrieval cache hit for {hits_from_cache}/{len(pending)} queries")
+                self._record_hits(plan, plan.per_query)
+        if self._uses_hot_set(plan):
+            self.hot_set.maybe_refresh(self.vector_client)
+        return plan
+
+    def _uses_hot_set(self, plan: "_SearchPlan") -> bool:
+        """Hot-set chỉ có vector dense: hybrid (dense + BM25 + RRF) và sparse luôn đi Qdrant"""
+        return (
+            self.hot_set is not None
+            and plan.mode == "dense"
+            and plan.query_filter is None  # hot-set không có metadata
+            and plan.collection_name == self.hot_set.collection_name
+        )
+
+    def _record_hits(self, plan: "_SearchPlan", hit_lists: List[Optional[List[dict]]]):
+        """Retrieval log cho thống kê hot-set; chỉ log search mà hot-set có thể trả lời (không tốn ZINCRBY vô ích)"""
+        if self._uses_hot_set(plan):
+            self.hot_set.record_hits(hit_lists)
+
+    def _hot_lookup(self, plan: "_SearchPlan", vectors: List[Optional[List[float]]]) -> List[Optional[List[float]]]:
+        """
+        Trả lời từ hot-set các query có best score đủ cao.
+        Trả về vectors của các query vẫn còn pending (cùng thứ tự plan.pending).
+        """
+        if not self._uses_hot_set(plan):
+            return vectors
+        remaining = []
+        for i, vector in zip(plan.pending, vectors):
+            hits = self.hot_set.search(vector, plan.limit, plan.score_threshold)
+            if hits is None:
+                remaining.append(vector)
             else:
-                logger.error(f"Unknown embedding format: {type(embedding_result)}")
-                return []
-                
-            results = self.vector_client.search(
+                plan.per_query[i] = hits
+        return remaining
+
+    def _requests(self, plan: "_SearchPlan", vectors: List[Optional[List[float]]]) -> List[QueryRequest]:
+        return [
+            self._build_request(
+                plan.mode, vector, plan.queries[i], plan.limit,
+                plan.score_threshold, plan.rescore, plan.oversampling, plan.query_filter
+            )
+            for i, vector in zip(plan.pending, vectors)
+        ]
+
+    def _collect(self, plan: "_SearchPlan", pending: List[int], responses):
+        """Ghi kết quả Qdrant vào plan + cache, log hit của cả lượt search (kể cả hot-set)."""
+        queried = [i for i in pending if plan.per_query[i] is None]  # không được hot-set trả lời
+        for i, response in zip(queried, responses):
+            hits = [format_hit(point) for point in response.points]
+            plan.per_query[i] = hits
+            if plan.cache is not None:
+                plan.cache.set(
+                    plan.queries[i], plan.limit, plan.score_threshold, plan.collection_name, hits,
+                    version=plan.version, params=plan.cache_params
+                )
+        self._record_hits(plan, [plan.per_query[i] for i in pending])
+
+    def search_many(
+        self,
+        collection_name: str,
+        queries: List[str],
+        limit: int = 10,
+        score_threshold: Optional[float] = None,
+        use_cache: bool = True,
+        mode: Optional[str] = None,
+        fuse: bool = True,
+        rescore: Optional[bool] = None,
+        oversampling: Optional[float] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        raise_errors: bool = False
+    ) -> Union[List[dict], List[List[dict]]]:
+        """
+        Fan-out nhiều sub-query trong một round trip:
+        - embed toàn bộ query (chưa có trong cache) bằng một lần embeddings.create
+        - chạy tất cả qua query_batch_points
+        - fuse=True: gộp + dedupe bằng RRF; fuse=False: trả list kết quả theo từng query
+          (cùng vị trí với input, query rỗng → []; input rỗng → [])
+        - raise_errors: ném lỗi embed/Qdrant thay vì trả kết quả rỗng (caller tự trả 5xx)
+        """
+        plan = self._plan(
+            collection_name, queries, limit, score_threshold, use_cache, mode, rescore, oversampling, filters
+        )
+        if plan.pending:
+            try:
+                pending = plan.pending
+                vectors = [None] * len(pending)
+                if plan.mode != "sparse":
+                    vectors = self._embed_queries(plan.pending_queries, plan.dimensions)
+                vectors = self._hot_lookup(plan, vectors)
+                responses = []
+                if plan.pending:
+                    responses = self.vector_client.query_batch_points(
+                        collection_name=collection_name,
+                        requests=self._requests(plan, vectors)
+                    )
+                self._collect(plan, pending, responses)
+            except Exception:
+                if raise_errors:
+                    raise
+                logger.exception("Lỗi tìm kiếm trong Qdrant")
+                plan.fail_pending()
+        return plan.result(fuse)
+
+    def candidate_limit(self, top_k: int) -> int:
+        """Số candidate lấy từ vector search khi có rerank / MMR"""
+        if self.reranker is None and not cfg_settings.MMR_ENABLED:
+            return top_k
+        return max(top_k, cfg_settings.RERANK_CANDIDATES)
+
+    def _prepare(self, queries: Union[str, List[str]], hits: List[dict], deadline: Optional[float]) -> List[dict]:
+        """Bỏ near-duplicate rồi rerank toàn bộ candidates (chưa cắt top_k)"""
+        hits = drop_near_duplicates(
+            hits,
+            threshold=cfg_settings.DEDUP_THRESHOLD,
+            shingle_size=cfg_settings.DEDUP_SHINGLE_SIZE
+        )
+        if self.reranker is not None:
+            hits = self.reranker.rerank(queries, hits, deadline=deadline)
+        return hits
+
+    def _needs_mmr(self, hits: List[dict], top_k: int, deadline: Optional[float]) -> bool:
+        if not cfg_settings.MMR_ENABLED or len(hits) <= top_k:
+            return False
+        return deadline is None or time.monotonic() < deadline
+
+    @staticmethod
+    def _diversify(hits: List[dict], points, top_k: int) -> List[dict]:
+        """MMR trên vector candidates; relevance = thứ hạng sau rerank (chuẩn hoá về [0, 1])"""
+        vectors = {str(point.id): dense_vector(point) for point in points}
+        if any(not vectors.get(hit["id"]) for hit in hits):
+            return hits[:top_k]
+        n = len(hits)
+        selected = mmr_select(
+            [vectors[hit["id"]] for hit in hits],
+            [1 - rank / n for rank in range(n)],
+            k=top_k,
+            lambda_=cfg_settings.MMR_LAMBDA
+        )
+        return [hits[i] for i in selected]
+
+    def refine(
+        self,
+        collection_name: str,
+        queries: Union[str, List[str]],
+        hits: List[dict],
+        top_k: int,
+        deadline: Optional[float] = None
+    ) -> List[dict]:
+        """
+        Post-retrieval: near-duplicate → rerank → MMR, trả về top_k.
+        deadline (time.monotonic()): hết thời gian thì bỏ qua các bước còn lại.
+        """
+        hits = self._prepare(queries, hits, deadline)
+        if not self._needs_mmr(hits, top_k, deadline):
+            return hits[:top_k]
+        try:
+            points = self.vector_client.retrieve(
                 collection_name=collection_name,
-                query_vector=vector,
-                limit=limit,
-                with_payload=True
+                ids=[to_point_id(hit["id"]) for hit in hits],
+                with_payload=False,
+                with_vectors=True
             )
-            return [
-                {
-                    "cid": point.payload.get("cid"),
-                    "chunk_index": point.payload.get("chunk_index", 0),
-                    "text": point.payload.get("text", ""),
-                    "score": point.score
-                }
-                for point in results  # search returns direct list
-            ]
-        except Exception:
-            logger.exception("Lỗi tìm kiếm trong Qdrant")
-            return []
\ No newline at end of file
+        except Exception as e:
+            logger.warning(f"Cannot fetch candidate vectors for MMR: {e}")
+            return hits[:top_k]
+        return self._diversify(hits, points, top_k)
+
+    def _expansion_needed(self, hits: List[dict], window: Optional[int]):
+        """Chunk lân cận cần lấy theo văn bản (neighbor_requests), hoặc None nếu expansion tắt"""
+        window = cfg_settings.EXPANSION_WINDOW if window is None else window
+        if not cfg_settings.EXPANSION_ENABLED or window <= 0 or not hits:
+            return None
+        return neighbor_requests(hits, window)
+
+    @staticmethod
+    def _neighbor_scroll(collection_name: str, needed) -> Dict[str, Any]:
+        """Tham số scroll (sync / async): một filter OR cho mọi văn bản, thường một page"""
+        return {
+            "collection_name": collection_name,
+            "scroll_filter": neighbor_filter(needed),
+            "limit": sum(len(indices) for indices in needed.values()),
+            "with_payload": True,
+            "with_vectors": False
+        }
+
+    def _scroll_neighbors(self, collection_name: str, needed) -> List[dict]:
+        request = self._neighbor_scroll(collection_name, needed)
+        neighbors, offset = [], None
+        while True:
+            points, offset = self.vector_client.scroll(**request, offset=offset)
+            neighbors.extend(format_hit(point) for point in points)
+            if offset is None:
+                return neighbors
+
+    def expand(self, collection_name: str, hits: List[dict], window: Optional[int] = None) -> List[dict]:
+        """
+        Lấy ±window chunk lân cận (cùng cid/document_id) của các hit cuối bằng một scroll,
+        gộp các chunk liền kề thành passage liên tục.
+        """
+        needed = self._expansion_needed(hits, window)
+        if needed is None:
+            return hits
+        try:
+            neighbors = self._scroll_neighbors(collection_name, needed) if needed else []
+        except Exception as e:
+            logger.warning(f"Neighbor expansion failed: {e}")
+            return hits
+        return merge_passages(hits, neighbors)
+
+    # ---------- Async API (FastAPI handlers / brain) ----------
+    @property
+    def async_vector_client(self):
+        return db_manager.qdrant_client_async
+
+    async def _aembed_queries(self, query_texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        vectors = (await self.embedder.aencode(query_texts, return_dense=True, dimensions=dimensions))["dense_vecs"]
+        return [vector.tolist() if hasattr(vector, "tolist") else list(vector) for vector in vectors]
+
+    async def arefine(
+        self,
+        collection_name: str,
+        queries: Union[str, List[str]],
+        hits: List[dict],
+        top_k: int,
+        deadline: Optional[float] = None
+    ) -> List[dict]:
+        """Bản async của refine(): rerank (CPU) chạy trong thread, vector lấy qua AsyncQdrantClient"""
+        hits = await asyncio.to_thread(self._prepare, queries, hits, deadline)
+        if not self._needs_mmr(hits, top_k, deadline):
+            return hits[:top_k]
+        try:
+            points = await self.async_vector_client.retrieve(
+                collection_name=collection_name,
+                ids=[to_point_id(hit["id"]) for hit in hits],
+                with_payload=False,
+                with_vectors=True
+            )
+        except Exception as e:
+            logger.warning(f"Cannot fetch candidate vectors for MMR: {e}")
+            return hits[:top_k]
+        return self._diversify(hits, points, top_k)
+
+    async def _ascroll_neighbors(self, collection_name: str, needed) -> List[dict]:
+        request = self._neighbor_scroll(collection_name, needed)
+        neighbors, offset = [], None
+        while True:
+            points, offset = await self.async_vector_client.scroll(**request, offset=offset)
+            neighbors.extend(format_hit(point) for point in points)
+            if offset is None:
+                return neighbors
+
+    async def aexpand(self, collection_name: str, hits: List[dict], window: Optional[int] = None) -> List[dict]:
+        """Bản async của expand() (AsyncQdrantClient)"""
+        needed = self._expansion_needed(hits, window)
+        if needed is None:
+            return hits
+        try:
+            neighbors = await self._ascroll_neighbors(collection_name, needed) if needed else []
+        except Exception as e:
+            logger.warning(f"Neighbor expansion failed: {e}")
+            return hits
+        return merge_passages(hits, neighbors)
+
+    async def asearch(
+        self,
+        collection_name: str,
+        query_text: str,
+        limit: int = 20,
+        score_threshold: Optional[float] = None,
+        use_cache: bool = True,
+        mode: Optional[str] = None,
+        rescore: Optional[bool] = None,
+        oversampling: Optional[float] = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[dict]:
+        """Bản async của search(): AsyncOpenAI + AsyncQdrantClient, không block event loop."""
+        if not query_text.strip():
+            logger.warning("Truy vấn tìm kiếm rỗng hoặc không hợp lệ")
+            return []
+        return (await self.asearch_many(
+            collection_name,
+            [query_text],
+            limit=limit,
+            score_threshold=score_threshold,
+            use_cache=use_cache,
+            mode=mode,
+            fuse=False,
+            rescore=rescore,
+            oversampling=oversampling,
+            filters=filters
+        ))[0]
+
+    async def asearch_many(
+        self,
+        collection_name: str,
+        queries: List[str],
+        limit: int = 10,
+        score_threshold: Optional[float] = None,
+        use_cache: bool = True,
+        mode: Optional[str] = None,
+        fuse: bool = True,
+        rescore: Optional[bool] = None,
+        oversampling: Optional[float] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        raise_errors: bool = False
+    ) -> Union[List[dict], List[List[dict]]]:
+        """Bản async của search_many()."""
+        # Cache/metadata dùng Redis + Qdrant sync client → chạy trong thread
+        plan = await asyncio.to_thread(
+            self._plan, collection_name, queries, limit, score_threshold, use_cache, mode, rescore, oversampling, filters
+        )
+        if plan.pending:
+            try:
+                pending = plan.pending
+                vectors = [None] * len(pending)
+                if plan.mode != "sparse":
+                    vectors = await self._aembed_queries(plan.pending_queries, plan.dimensions)
+                vectors = self._hot_lookup(plan, vectors)
+                responses = []
+                if plan.pending:
+                    responses = await self.async_vector_client.query_batch_points(
+                        collection_name=collection_name,
+                        requests=self._requests(plan, vectors)
+                    )
+                await asyncio.to_thread(self._collect, plan, pending, responses)
+            except Exception:
+                if raise_errors:
+                    raise
+                logger.exception("Lỗi tìm kiếm trong Qdrant (async)")
+                plan.fail_pending()
+        return plan.result(fuse)
+
+
+@dataclass
+class _SearchPlan:
+    """Trạng thái của một lượt search_many (dùng chung cho đường sync và async)."""
+    collection_name: str
+    queries: List[str]
+    limit: int
+    score_threshold: Optional[float]
+    mode: str
+    rescore: Optional[bool] = None
+    oversampling: Optional[float] = None
+    filters: Optional[Dict[str, Any]] = None
+    query_filter: Optional[Filter] = None
+    cache: Optional[RetrievalCache] = None
+    version: Optional[int] = None
+    dimensions: Optional[int] = None  # số chiều dense của collection (query được cắt Matryoshka cho khớp)
+    per_query: List[Optional[List[dict]]] = field(default_factory=list)
+
+    @property
+    def cache_params(self) -> dict:
+        return {
+            "mode": self.mode,
+            "rescore": self.rescore,
+            "oversampling": self.oversampling,
+            "filters": self.filters
+        }
+
+    @property
+    def pending(self) -> List[int]:
+        return [i for i, hits in enumerate(self.per_query) if hits is None]
+
+    @property
+    def pending_queries(self) -> List[str]:
+        return [self.queries[i] for i in self.pending]
+
+    def fail_pending(self):
+        for i in self.pending:
+            self.per_query[i] = []
+
+    def result(self, fuse: bool) -> Union[List[dict], List[List[dict]]]:
+        if not self.queries:
+            return []
+        if not fuse:
+            return self.per_query
+        return reciprocal_rank_fusion(self.per_query, limit=self.limit)
+
+
+def hit_key(hit: dict) -> str:
+    """Khoá dedupe cho một chunk (point id, fallback cid/document_id + chunk_index)."""
+    if hit.get("id") is not None:
+        return str(hit["id"])
+    return f"{hit.get('cid') or hit.get('document_id')}:{hit.get('chunk_index', 0)}"
+
+
+def reciprocal_rank_fusion(result_lists: List[List[dict]], limit: int = 10, k: int = 60) -> List[dict]:
+    """Gộp nhiều danh sách kết quả bằng RRF, dedupe theo chunk; giữ score gốc cao nhất."""
+    fused: Dict[str, dict] = {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits or []):
+            key = hit_key(hit)
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {**hit, "rrf_score": 0.0}
+            entry["rrf_score"] += 1.0 / (k + rank + 1)
+            if hit.get("score", 0) > entry.get("score", 0):
+                entry["score"] = hit["score"]
+    return sorted(fused.values(), key=lambda hit: hit["rrf_score"], reverse=True)[:limit]
@@ -0,0 +1,255 @@
+"""
+Rerank stage sau vector search
+Backend: lexical (mặc định, không cần model) | cross-encoder (sentence-transformers, CPU) | onnx (onnxruntime)
+Tất cả cặp (query, chunk) được chấm trong một batch; điểm theo cặp được cache trong Redis.
+"""
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Union
+
+from app.config.settings import cfg_settings
+from app.services.embedding_cache import EmbeddingCache
+from app.services.sparse_encoder import SparseEncoder
+
+logger = logging.getLogger(__name__)
+
+
+# ---------- Backends ----------
+class LexicalScorer:
+    """BM25 (phần TF) của chunk trên các term/bigram của query, chuẩn hoá theo độ phủ query"""
+
+    name = "lexical"
+    cacheable = False  # rẻ hơn một round trip Redis
+
+    def __init__(self, encoder: Optional[SparseEncoder] = None):
+        self.encoder = encoder or SparseEncoder()
+
+    def score_pairs(self, pairs: Sequence[tuple]) -> List[float]:
+        query_terms: Dict[str, set] = {}
+        scores = []
+        for query, text in pairs:
+            if query not in query_terms:
+                query_terms[query] = set(self.encoder.encode_query(query)["indices"])
+            terms = query_terms[query]
+            if not terms:
+                scores.append(0.0)
+                continue
+            doc = self.encoder.encode_document(text)
+            matched = [value for idx, value in zip(doc["indices"], doc["values"]) if idx in terms]
+            scores.append(sum(matched) * len(matched) / len(terms))
+        return scores
+
+
+class CrossEncoderScorer:
+    """Cross-encoder trên CPU (sentence-transformers)"""
+
+    name = "cross-encoder"
+    cacheable = True
+
+    def __init__(self, model_name: str, batch_size: int = 32):
+        from sentence_transformers import CrossEncoder  # optional dependency
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score_pairs(self, pairs: Sequence[tuple]) -> List[float]:
+        scores = self.model.predict(list(pairs), batch_size=self.batch_size, show_progress_bar=False)
+        return [float(score) for score in scores]
+
+
+class OnnxScorer:
+    """Cross-encoder export sang ONNX (onnxruntime + tokenizer của transformers)"""
+
+    name = "onnx"
+    cacheable = True
+
+    def __init__(self, model_path: str, tokenizer_name: str, batch_size: int = 32, max_length: int = 512):
+        import onnxruntime  # optional dependency
+        from transformers import AutoTokenizer
+        self.model_name = model_path
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def score_pairs(self, pairs: Sequence[tuple]) -> List[float]:
+        scores: List[float] = []
+        for start in range(0, len(pairs), self.batch_size):
+            batch = pairs[start:start + self.batch_size]
+            encoded = self.tokenizer(
+                [query for query, _ in batch],
+                [text for _, text in batch],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            feeds = {name: value for name, value in encoded.items() if name in self.input_names}
+            logits = self.session.run(None, feeds)[0]
+            scores.extend(float(row[-1]) for row in logits.reshape(len(batch), -1))
+        return scores
+
+
+def build_scorer(backend: str):
+    """Khởi tạo backend theo RERANK_BACKEND; thiếu dependency/model → fallback lexical"""
+    backend = (backend or "lexical").lower()
+    try:
+        if backend == "cross-encoder":
+            return CrossEncoderScorer(cfg_settings.RERANK_MODEL, batch_size=cfg_settings.RERANK_BATCH_SIZE)
+        if backend == "onnx":
+            return OnnxScorer(
+                cfg_settings.RERANK_ONNX_PATH,
+                tokenizer_name=cfg_settings.RERANK_MODEL,
+                batch_size=cfg_settings.RERANK_BATCH_SIZE
+            )
+    except Exception as e:
+        logger.warning(f"Cannot load rerank backend `{backend}` ({e}), falling back to lexical")
+    return LexicalScorer()
+
+
+def build_default_reranker() -> Optional["Reranker"]:
+    if not cfg_settings.RERANK_ENABLED or cfg_settings.RERANK_BACKEND == "none":
+        return None
+    from app.config.database import redis_client_web
+    return Reranker(
+        build_scorer(cfg_settings.RERANK_BACKEND),
+        redis_client=redis_client_web,
+        cache_ttl=cfg_settings.RERANK_CACHE_TTL,
+        prior_weight=cfg_settings.RERANK_PRIOR_WEIGHT
+    )
+
+
+# ---------- Rerank stage ----------
+class Reranker:
+    """Chấm lại candidates; bỏ qua khi ước lượng thời gian vượt deadline"""
+
+    def __init__(
+        self,
+        scorer,
+        redis_client=None,
+        cache_ttl: int = 24 * 3600,
+        prior_weight: float = 0.3,
+        namespace: str = "rerank"
+    ):
+        """
+        scorer: backend có score_pairs(pairs) -> List[float]
+        prior_weight: trọng số thứ hạng gốc (vector search) khi trộn với điểm rerank
+        """
+        self.scorer = scorer
+        self.redis_client = redis_client
+        self.cache_ttl = cache_ttl
+        self.prior_weight = prior_weight
+        self.namespace = namespace
+
+        self._lock = threading.Lock()
+        self._pair_ms: Optional[float] = None  # EWMA thời gian chấm một cặp
+        self._stats = {"reranked": 0, "skipped": 0, "pairs_scored": 0, "pairs_cached": 0}
+
+    # ---------- Pair cache ----------
+    def _pair_key(self, query: str, text: str) -> str:
+        model = getattr(self.scorer, "model_name", self.scorer.name)
+        digest = hashlib.sha256(
+            f"{model}\x00{EmbeddingCache.normalize_text(query)}\x00{text}".encode("utf-8")
+        ).hexdigest()
+        return f"{self.namespace}:{digest}"
+
+    def _cache_get(self, keys: List[str]) -> List[Optional[float]]:
+        if self.redis_client is None or not self.scorer.cacheable:
+            return [None] * len(keys)
+        try:
+            return [float(raw) if raw is not None else None for raw in self.redis_client.mget(keys)]
+        except Exception as e:
+            logger.warning(f"Rerank cache read failed: {e}")
+            return [None] * len(keys)
+
+    def _cache_set(self, items: Dict[str, float]):
+        if self.redis_client is None or not self.scorer.cacheable or not items:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, score in items.items():
+                pipe.setex(key, self.cache_ttl, repr(score))
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Rerank cache write failed: {e}")
+
+    # ---------- Scoring ----------
+    def score(self, queries: List[str], texts: List[str]) -> List[float]:
+        """Điểm của mỗi text = max trên các query; mọi cặp chưa cache chấm trong một batch"""
+        pairs = [(query, text) for text in texts for query in queries]
+        keys = [self._pair_key(query, text) for query, text in pairs]
+        scores = self._cache_get(keys)
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            start = time.perf_counter()
+            fresh = self.scorer.score_pairs([pairs[i] for i in missing])
+            self._observe((time.perf_counter() - start) * 1000 / len(missing))
+            for i, score in zip(missing, fresh):
+                scores[i] = score
+            self._cache_set({keys[i]: scores[i] for i in missing})
+        self._bump("pairs_scored", len(missing))
+        self._bump("pairs_cached", len(pairs) - len(missing))
+
+        width = len(queries)
+        return [max(scores[j * width:(j + 1) * width]) for j in range(len(texts))]
+
+    def _observe(self, pair_ms: float):
+        with self._lock:
+            self._pair_ms = pair_ms if self._pair_ms is None else 0.8 * self._pair_ms + 0.2 * pair_ms
+
+    def _bump(self, counter: str, n: int = 1):
+        with self._lock:
+            self._stats[counter] += n
+
+    def estimate_ms(self, n_pairs: int) -> float:
+        return (self._pair_ms or 0.0) * n_pairs
+
+    def rerank(
+        self,
+        queries: Union[str, List[str]],
+        hits: List[dict],
+        top_n: Optional[int] = None,
+        deadline: Optional[float] = None
+    ) -> List[dict]:
+        """
+        Sắp xếp lại hits (thêm rerank_score), trả về top_n.
+        deadline: time.monotonic() tuyệt đối; không đủ thời gian → giữ thứ tự gốc.
+        """
+        if isinstance(queries, str):
+            queries = [queries]
+        queries = [query for query in queries if query and query.strip()]
+        top_n = top_n or len(hits)
+        if len(hits) <= 1 or not queries:
+            return hits[:top_n]
+
+        if deadline is not None:
+            remaining_ms = (deadline - time.monotonic()) * 1000
+            if remaining_ms <= self.estimate_ms(len(hits) * len(queries)):
+                self._bump("skipped")
+                logger.info(f"Skip rerank: {remaining_ms:.0f} ms left for {len(hits)} candidates")
+                return hits[:top_n]
+
+        try:
+            scores = self.score(queries, [hit.get("text", "") for hit in hits])
+        except Exception as e:
+            logger.warning(f"Rerank failed, keeping vector order: {e}")
+            return hits[:top_n]
+
+        # Trộn điểm rerank (min-max) với thứ hạng gốc để không bỏ hẳn tín hiệu ngữ nghĩa
+        low, high = min(scores), max(scores)
+        span = (high - low) or 1.0
+        n = len(hits)
+        blended = [
+            (1 - self.prior_weight) * (score - low) / span + self.prior_weight * (1 - rank / n)
+            for rank, score in enumerate(scores)
+        ]
+        order = sorted(range(n), key=lambda i: blended[i], reverse=True)
+        self._bump("reranked")
+        return [dict(hits[i], rerank_score=scores[i]) for i in order[:top_n]]
+
+    def stats(self) -> Dict[str, float]:
+        return {"backend": self.scorer.name, "pair_ms": self._pair_ms or 0.0, **self._stats}
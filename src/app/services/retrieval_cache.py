@@ -0,0 +1,125 @@
+"""
+Qdrant search-result cache
+Deterministic keys (normalized query + top_k + threshold + collection) scoped by index version
+"""
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import cfg_settings
+from app.services.embedding_cache import EmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION_KEY = "legal_index_version"
+
+
+def format_hit(point) -> Dict[str, Any]:
+    """Chuẩn hoá ScoredPoint / Record của Qdrant thành dict dùng chung (cache được)"""
+    payload = point.payload or {}
+    return {
+        "id": str(point.id),
+        "cid": payload.get("cid"),
+        "chunk_index": payload.get("chunk_index", 0),
+        "text": payload.get("text", ""),
+        "source": payload.get("source", ""),
+        "document_id": payload.get("document_id", ""),
+        "token_count": payload.get("token_count"),
+        "score": getattr(point, "score", None),
+        # part của chunk quá dài (cùng chunk_index) → expansion sắp theo (chunk_index, part_index)
+        **{key: payload[key] for key in ("part_index", "part_count") if key in payload}
+    }
+
+
+def read_index_version(redis_client) -> int:
+    """legal_index_version hiện tại (0 nếu chưa có / Redis lỗi)"""
+    try:
+        return int(redis_client.get(INDEX_VERSION_KEY) or 0)
+    except Exception as e:
+        logger.warning(f"Cannot read index version: {e}")
+        return 0
+
+
+def build_default_retrieval_cache() -> Optional["RetrievalCache"]:
+    """Cache mặc định trên redis_client_web (cùng DB với legal_index_metadata)"""
+    if not cfg_settings.RETRIEVAL_CACHE_ENABLED:
+        return None
+    from app.config.database import redis_client_web
+    return RetrievalCache(redis_client_web, ttl=cfg_settings.RETRIEVAL_CACHE_TTL)
+
+
+class RetrievalCache:
+    """Cache kết quả search, tự vô hiệu khi update_legal_index tăng version"""
+
+    def __init__(self, redis_client, ttl: int = 3600, namespace: str = "legal_search"):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.namespace = namespace
+
+    def current_version(self) -> int:
+        return read_index_version(self.redis_client)
+
+    def bump_version(self) -> int:
+        """Tăng version index → mọi key cũ không còn được đọc (hết hạn theo TTL)"""
+        return int(self.redis_client.incr(INDEX_VERSION_KEY))
+
+    def make_key(
+        self,
+        query: str,
+        top_k: int,
+        threshold: Optional[float],
+        collection_name: str,
+        version: int,
+        params: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """params: các tham số search khác ảnh hưởng kết quả (mode, ...)"""
+        fingerprint = json.dumps(
+            {
+                "q": EmbeddingCache.normalize_text(query),
+                "k": int(top_k),
+                "t": None if threshold is None else round(float(threshold), 6),
+                "c": collection_name,
+                "p": params or {}
+            },
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        digest = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+        return f"{self.namespace}:v{version}:{collection_name}:{digest}"
+
+    def get(
+        self,
+        query: str,
+        top_k: int,
+        threshold: Optional[float],
+        collection_name: str,
+        version: Optional[int] = None,
+        params: Optional[Dict[str, Any]] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """version: truyền version đã đọc trước đó để get/set cùng một snapshot index"""
+        try:
+            version = self.current_version() if version is None else version
+            key = self.make_key(query, top_k, threshold, collection_name, version, params)
+            cached = self.redis_client.get(key)
+            return json.loads(cached) if cached else None
+        except Exception as e:
+            logger.warning(f"Retrieval cache read failed: {e}")
+            return None
+
+    def set(
+        self,
+        query: str,
+        top_k: int,
+        threshold: Optional[float],
+        collection_name: str,
+        results: List[Dict[str, Any]],
+        version: Optional[int] = None,
+        params: Optional[Dict[str, Any]] = None
+    ):
+        try:
+            version = self.current_version() if version is None else version
+            key = self.make_key(query, top_k, threshold, collection_name, version, params)
+            self.redis_client.setex(key, self.ttl, json.dumps(results, ensure_ascii=False))
+        except Exception as e:
+            logger.warning(f"Retrieval cache write failed: {e}")
@@ -0,0 +1,68 @@
+"""
+BM25-style sparse encoder for Vietnamese legal text
+TF saturation is computed locally, IDF is applied by Qdrant (Modifier.IDF on the sparse vector)
+"""
+import re
+import unicodedata
+import zlib
+from collections import Counter
+from typing import Dict, List, Union
+
+# Giữ nguyên các token như "100/2019", "nđ-cp", "35.2"
+TOKEN_PATTERN = re.compile(r"\w+(?:[/.\-]\w+)*", re.UNICODE)
+
+
+class SparseEncoder:
+    """Hashing BM25 encoder: unigram + bigram ("điều 35") → {indices, values}"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, avg_doc_len: float = 256.0, use_bigrams: bool = True):
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_len = avg_doc_len
+        self.use_bigrams = use_bigrams
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return TOKEN_PATTERN.findall(unicodedata.normalize("NFC", text or "").lower())
+
+    @staticmethod
+    def token_id(token: str) -> int:
+        """Index ổn định giữa các process (crc32, 31 bit)"""
+        return zlib.crc32(token.encode("utf-8")) & 0x7FFFFFFF
+
+    def _features(self, text: str) -> Counter:
+        tokens = self.tokenize(text)
+        features = Counter(tokens)
+        if self.use_bigrams:
+            features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+        return features
+
+    @staticmethod
+    def _to_sparse(weights: Dict[int, float]) -> Dict[str, list]:
+        indices = sorted(weights)
+        return {"indices": indices, "values": [float(weights[i]) for i in indices]}
+
+    def encode_document(self, text: str) -> Dict[str, list]:
+        """Trọng số BM25 (phần TF) cho văn bản được index"""
+        features = self._features(text)
+        doc_len = sum(features.values()) or 1
+        norm = self.k1 * (1 - self.b + self.b * doc_len / self.avg_doc_len)
+        weights: Dict[int, float] = {}
+        for feature, tf in features.items():
+            idx = self.token_id(feature)
+            weights[idx] = weights.get(idx, 0.0) + tf * (self.k1 + 1) / (tf + norm)
+        return self._to_sparse(weights)
+
+    def encode_query(self, text: str) -> Dict[str, list]:
+        """Trọng số query: mỗi term 1.0 (IDF do Qdrant áp dụng)"""
+        weights: Dict[int, float] = {}
+        for feature in self._features(text):
+            idx = self.token_id(feature)
+            weights[idx] = 1.0
+        return self._to_sparse(weights)
+
+    def encode(self, texts: Union[str, List[str]], is_query: bool = False) -> List[Dict[str, list]]:
+        if isinstance(texts, str):
+            texts = [texts]
+        encode_one = self.encode_query if is_query else self.encode_document
+        return [encode_one(text) for text in texts]
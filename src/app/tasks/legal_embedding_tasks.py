@@ -8,13 +8,29 @@ from app.config.settings import cfg_settings
 import redis
 import time
 import json
-from typing import List, Dict, Any
-from app.services.embeddings import EmbeddingHandler
+import uuid
+from typing import List, Dict, Any, Tuple
+from app.services.embeddings import EmbeddingHandler, truncate_embeddings
+from app.services.retrieval_cache import INDEX_VERSION_KEY, build_default_retrieval_cache, format_hit, read_index_version
+from app.services.context_packer import estimate_tokens
+from qdrant_client.models import FieldCondition, Filter, FilterSelector, MatchAny, SparseVector
+from app.services.qdrant_collections import (
+    DENSE_VECTOR_NAME,
+    LAW_METADATA_FIELDS,
+    SPARSE_VECTOR_NAME,
+    collection_dimensions,
+    ensure_collection,
+    has_sparse_vectors,
+)
 import numpy as np
 
 logger = logging.getLogger(__name__)
 # Initialize embedding model
 embedding_model = EmbeddingHandler(provider=cfg_settings.PROVIDER, model_name=cfg_settings.EMBEDDING_MODEL)
+# Shared Qdrant result cache (also used by LegalRAGService / retrieval_document)
+retrieval_cache = build_default_retrieval_cache()
+# Payload của sub-chunk (text gốc vượt giới hạn input của provider)
+SPLIT_FIELDS = ("parent_id", "part_index", "part_count", "char_start", "char_end")
 
 
 def embed_query_sync(query: str):
@@ -63,66 +79,98 @@ def process_web_chunks_for_rag(document_data: Dict[str, Any], query: str, top_k:
         return {"success": False, "error": str(e)}
 
 
+def split_text_spans(text: str, max_tokens: int) -> List[Tuple[int, int]]:
+    """
+    [start, end) theo ký tự, mỗi đoạn <= max_tokens ước lượng (estimate_tokens: ~4 byte UTF-8 / token).
+    Ưu tiên cắt ở xuống dòng / khoảng trắng trong nửa sau của đoạn.
+    """
+    budget = max_tokens * 4
+    spans, start = [], 0
+    while start < len(text):
+        end, size = start, 0
+        while end < len(text) and size + len(text[end].encode("utf-8")) <= budget:
+            size += len(text[end].encode("utf-8"))
+            end += 1
+        end = max(end, start + 1)
+        if end < len(text):
+            middle = start + (end - start) // 2
+            cut = max(text.rfind("\n", middle, end), text.rfind(" ", middle, end))
+            if cut > start:
+                end = cut + 1
+        spans.append((start, end))
+        start = end
+    return spans
+
+
+def split_oversized_chunk(chunk: Dict[str, Any], max_tokens: int) -> List[Dict[str, Any]]:
+    """
+    Chunk vượt giới hạn input của provider → các sub-chunk, mỗi phần một point với text của chính nó
+    + char_start / char_end trong text gốc. Phần 0 giữ point id cũ (ghi đè point trước đây),
+    phần sau dùng uuid5(point id, số thứ tự) → chạy lại cho cùng id.
+    """
+    text = chunk.get('text', '')
+    if estimate_tokens(text) <= max_tokens:
+        return [chunk]
+    spans = split_text_spans(text, max_tokens)
+    parent_id = chunk.get('doc_id') or f"{chunk.get('document_id', uuid.uuid4())}_{chunk.get('chunk_index', 0)}"
+    logger.info(f"Splitting oversized chunk {parent_id} ({len(text)} chars) into {len(spans)} parts")
+    return [
+        {
+            **chunk,
+            'text': text[start:end],
+            'point_id': parent_id if part == 0 else str(uuid.uuid5(uuid.NAMESPACE_URL, f"{parent_id}:part:{part}")),
+            'parent_id': parent_id,
+            'part_index': part,
+            'part_count': len(spans),
+            'char_start': start,
+            'char_end': end
+        }
+        for part, (start, end) in enumerate(spans)
+    ]
+
+
 @celery_app.task(name="app.tasks.legal_embedding_tasks.process_legal_document_embedding", queue="embed_queue")
 def process_legal_document_embedding(document_chunks: List[Dict[str, Any]], batch_size: int = 32):
-    """Process legal document embeddings in batches"""
+    """
+    Process legal document embeddings.
+    Chunk vượt EMBEDDING_MAX_INPUT_TOKENS được tách thành nhiều point (split_oversized_chunk).
+    Một lần encode cho cả danh sách: EmbeddingHandler đóng gói request theo token ước lượng
+    (EMBEDDING_MAX_BATCH_TOKENS) và gửi song song EMBEDDING_CONCURRENCY request.
+    batch_size: giữ cho tương thích chữ ký task, không còn dùng.
+    """
     logger.info(f"Processing {len(document_chunks)} legal document chunks for embedding")
     
     try:
+        # Oversized texts → sub-chunks (mỗi phần là một point riêng); chỉ embed những gì được lưu
         processed_chunks = []
+        for chunk in document_chunks:
+            processed_chunks.extend(split_oversized_chunk(chunk, cfg_settings.EMBEDDING_MAX_INPUT_TOKENS))
+        texts = [chunk.get('text', '') for chunk in processed_chunks]
         
-        for i in range(0, len(document_chunks), batch_size):
-            batch = document_chunks[i:i + batch_size]
-            
-            # Split oversized texts
-            batch_texts = []
-            for chunk in batch:
-                text = chunk.get('text', '')
-                # Split text if too long (approx 8000 tokens = ~6000 chars)
-                if len(text) > 6000:
-                    # Split into smaller chunks
-                    text_parts = [text[j:j+6000] for j in range(0, len(text), 6000)]
-                    batch_texts.extend(text_parts)
-                    # Mark original chunk for splitting
-                    chunk['_split'] = True
-                    chunk['_parts'] = len(text_parts)
-                else:
-                    batch_texts.append(text)
-                    chunk['_split'] = False
-            
-            # Generate embeddings
-            batch_embeddings = embedding_model.encode(
-                batch_texts, 
-                return_dense=True, 
-                return_sparse=False
-            )
-            
-            # Process each chunk in batch
-            embedding_idx = 0
-            for j, chunk in enumerate(batch):
-                if chunk.get('_split'):
-                    # Handle split chunks - use first part embedding
-                    embedding = batch_embeddings['dense_vecs'][embedding_idx]
-                    embedding_idx += chunk['_parts']
-                else:
-                    embedding = batch_embeddings['dense_vecs'][embedding_idx]
-                    embedding_idx += 1
-                
-                # Handle embedding - convert to list properly
-                if hasattr(embedding, 'tolist'):
-                    # NumPy array - convert to list
-                    chunk['embedding'] = embedding.tolist()
-                elif isinstance(embedding, list):
-                    # Already a list - use as is
-                    chunk['embedding'] = embedding
-                else:
-                    # Convert to list for other types
-                    chunk['embedding'] = list(embedding)
-                chunk['embedding_model'] = cfg_settings.EMBEDDING_MODEL
-                chunk['processed_at'] = time.time()
-                processed_chunks.append(chunk)
-            
-            logger.info(f"Processed batch {i//batch_size + 1}/{(len(document_chunks) + batch_size - 1)//batch_size}")
+        # Generate embeddings (vector document không đi qua cache query: tránh đẩy entry query ra khỏi LRU/Redis)
+        started = time.perf_counter()
+        embeddings = embedding_model.encode(texts, return_dense=True, return_sparse=False, use_cache=False)
+        embed_seconds = time.perf_counter() - started
+        tokens = sum(estimate_tokens(text) for text in texts)
+        tokens_per_second = round(tokens / embed_seconds, 1) if embed_seconds else 0.0
+        logger.info(
+            f"Embedded {len(texts)} texts (~{tokens} tokens) in {embed_seconds:.2f}s "
+            f"({tokens_per_second} tok/s)"
+        )
+        
+        for chunk, embedding in zip(processed_chunks, embeddings['dense_vecs']):
+            # Handle embedding - convert to list properly
+            if hasattr(embedding, 'tolist'):
+                # NumPy array - convert to list
+                chunk['embedding'] = embedding.tolist()
+            elif isinstance(embedding, list):
+                # Already a list - use as is
+                chunk['embedding'] = embedding
+            else:
+                # Convert to list for other types
+                chunk['embedding'] = list(embedding)
+            chunk['embedding_model'] = cfg_settings.EMBEDDING_MODEL
+            chunk['processed_at'] = time.time()
         
         # Store embeddings in vector database
         store_legal_embeddings(processed_chunks)
@@ -156,82 +204,127 @@ def process_legal_document_embedding(document_chunks: List[Dict[str, Any]], batc
         return {
             "status": "success", 
             "processed_count": len(processed_chunks),
-            "web_chunks_processed": len(web_chunks_results)
+            "web_chunks_processed": len(web_chunks_results),
+            "embedded_tokens": tokens,
+            "tokens_per_second": tokens_per_second
         }
         
     except Exception as e:
         logger.error(f"Error processing legal document embeddings: {str(e)}")
         return {"status": "error", "error": str(e)}
 
+def delete_stale_parts(vector_client, collection_name: str, processed_chunks: List[Dict[str, Any]]):
+    """
+    Xoá các part cũ (payload parent_id) của những chunk sắp được ghi lại: chunk trước đây bị tách
+    thành nhiều part hơn (hoặc nay không còn bị tách) không để lại part mồ côi trong collection.
+    """
+    parent_ids = sorted({chunk.get('parent_id') or chunk.get('doc_id') for chunk in processed_chunks} - {None, ''})
+    if not parent_ids:
+        return
+    vector_client.delete(
+        collection_name=collection_name,
+        points_selector=FilterSelector(filter=Filter(must=[
+            FieldCondition(key="parent_id", match=MatchAny(any=parent_ids))
+        ]))
+    )
+
+
+def bump_index_version():
+    """
+    Sau mỗi lần ghi / xoá trong LEGAL_COLLECTION: tăng legal_index_version → kết quả search đã cache
+    và câu trả lời theo law version cũ không còn được đọc (kể cả khi retrieval cache của process này tắt).
+    """
+    try:
+        return int(redis_client_web.incr(INDEX_VERSION_KEY))
+    except Exception as e:
+        logger.warning(f"Cannot bump legal index version: {e}")
+        return None
+
+
 def store_legal_embeddings(processed_chunks: List[Dict[str, Any]]):
-    """Store legal document embeddings in Qdrant"""
+    """Store legal document embeddings in Qdrant (bump legal_index_version khi collection đã bị ghi)"""
+    written = False
     try:
         vector_client = db_manager.qdrant_client
-        collection_name = "legal_documents_collection"
-        
-        # Ensure collection exists - use collection_exists method
-        collection_exists = False
-        try:
-            collection_exists = vector_client.collection_exists(collection_name)
-            if collection_exists:
-                logger.info(f"Collection {collection_name} already exists")
-            else:
-                logger.info(f"Collection {collection_name} does not exist, will create")
-        except Exception as e:
-            logger.error(f"Error checking collection existence: {e}")
-            # Try creating collection anyway
-            pass
+        collection_name = cfg_settings.LEGAL_COLLECTION
         
-        if not collection_exists:
-            try:
-                from qdrant_client.models import VectorParams, Distance
-                vector_client.create_collection(
-                    collection_name=collection_name,
-                    vectors_config=VectorParams(size=1536, distance=Distance.COSINE)  # OpenAI embedding size
-                )
-                logger.info(f"Created new collection {collection_name}")
-            except Exception as create_error:
-                if "already exists" in str(create_error):
-                    logger.info(f"Collection {collection_name} already exists (race condition)")
-                else:
-                    logger.error(f"Error creating collection: {create_error}")
-                    raise
+        # Ensure collection exists (dense + named sparse BM25 vector)
+        ensure_collection(vector_client, collection_name)
+        with_sparse = has_sparse_vectors(vector_client, collection_name)
+        # Vector đầy đủ → cắt Matryoshka về số chiều của collection (LEGAL_EMBEDDING_DIMENSIONS khi tạo mới)
+        dense_vecs = truncate_embeddings(
+            [chunk['embedding'] for chunk in processed_chunks],
+            collection_dimensions(vector_client, collection_name)
+        )
+        sparse_vecs = []
+        if with_sparse:
+            sparse_vecs = embedding_model.encode(
+                [chunk.get('text', '') for chunk in processed_chunks],
+                return_dense=False,
+                return_sparse=True
+            )['sparse_vecs']
         
         # Prepare points for upsert
-        import uuid
         points = []
         for i, chunk in enumerate(processed_chunks):
             # Use unique ID from document_id and chunk_index, or generate UUID
-            point_id = chunk.get('doc_id') or f"{chunk.get('document_id', str(uuid.uuid4()))}_{chunk.get('chunk_index', i)}"
+            point_id = chunk.get('point_id') or chunk.get('doc_id') or f"{chunk.get('document_id', str(uuid.uuid4()))}_{chunk.get('chunk_index', i)}"
+            vector = dense_vecs[i]
+            if with_sparse:
+                vector = {DENSE_VECTOR_NAME: dense_vecs[i], SPARSE_VECTOR_NAME: SparseVector(**sparse_vecs[i])}
             points.append({
                 "id": point_id,
-                "vector": chunk['embedding'],
+                "vector": vector,
                 "payload": {
                     "text": chunk.get('text', ''),
                     "source": chunk.get('source', ''),
                     "document_id": chunk.get('document_id', ''),
                     "chunk_index": chunk.get('chunk_index', 0),
+                    "token_count": estimate_tokens(chunk.get('text', '')),
                     "processed_at": chunk.get('processed_at'),
-                    "doc_id": chunk.get('doc_id', '')
+                    "doc_id": chunk.get('doc_id', ''),
+                    # law_type / issued_year / validity_status nếu có (metadata filter khi search)
+                    **{key: chunk[key] for key in LAW_METADATA_FIELDS if chunk.get(key) is not None},
+                    # sub-chunk của text quá dài: vị trí trong text gốc
+                    **{key: chunk[key] for key in SPLIT_FIELDS if key in chunk}
                 }
             })
         
-        # Batch upsert
+        # Part cũ của cùng chunk gốc → xoá trước, rồi batch upsert
+        written = True  # delete đã có thể xoá point kể cả khi upsert lỗi
+        delete_stale_parts(vector_client, collection_name, processed_chunks)
         vector_client.upsert(collection_name=collection_name, points=points)
         logger.info(f"Stored {len(points)} legal document embeddings in Qdrant")
         
     except Exception as e:
         logger.error(f"Error storing legal embeddings: {str(e)}")
         raise
+    finally:
+        if written:
+            bump_index_version()
 
 @celery_app.task(name="app.tasks.legal_embedding_tasks.search_legal_documents", queue="embed_queue")
 def search_legal_documents(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
     """Search similar legal documents based on query embedding"""
     logger.info(f"Searching legal documents for query: {query[:100]}...")
+    collection_name = cfg_settings.LEGAL_COLLECTION
+    threshold = cfg_settings.SIMILARITY_THRESHOLD
+    
+    # Read cache before embedding/searching (key scoped by legal_index_version)
+    version = None
+    if retrieval_cache is not None:
+        version = retrieval_cache.current_version()
+        cached = retrieval_cache.get(query, top_k, threshold, collection_name, version=version)
+        if cached is not None:
+            logger.info(f"Retrieval cache hit: {len(cached)} legal documents")
+            return cached
     
     try:
-        # Generate query embedding
-        query_embedding = embedding_model.encode([query], return_dense=True)['dense_vecs'][0]
+        # Generate query embedding (cắt về số chiều của collection)
+        vector_client = db_manager.qdrant_client
+        query_embedding = embedding_model.encode(
+            [query], return_dense=True, dimensions=collection_dimensions(vector_client, collection_name)
+        )['dense_vecs'][0]
         
         # Convert embedding to list properly
         if hasattr(query_embedding, 'tolist'):
@@ -245,36 +338,21 @@ def search_legal_documents(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
             query_vector = list(query_embedding)
         
         # Search in vector database
-        vector_client = db_manager.qdrant_client
-        collection_name = "legal_documents_collection"
-        
         search_results = vector_client.search(
             collection_name=collection_name,
             query_vector=query_vector,
             limit=top_k,
-            score_threshold=cfg_settings.SIMILARITY_THRESHOLD
+            score_threshold=threshold
         )
         
         # Format results
-        formatted_results = []
-        for result in search_results:
-            formatted_results.append({
-                "text": result.payload.get("text", ""),
-                "source": result.payload.get("source", ""),
-                "score": result.score,
-                "document_id": result.payload.get("document_id", ""),
-                "chunk_index": result.payload.get("chunk_index", 0)
-            })
+        formatted_results = [format_hit(result) for result in search_results]
         
         logger.info(f"Found {len(formatted_results)} relevant legal documents")
         
         # Cache results in Redis
-        cache_key = f"legal_search:{hash(query)}"
-        redis_client_web.setex(
-            cache_key, 
-            3600,  # 1 hour cache
-            json.dumps(formatted_results)
-        )
+        if retrieval_cache is not None:
+            retrieval_cache.set(query, top_k, threshold, collection_name, formatted_results, version=version)
         
         return formatted_results
         
@@ -292,8 +370,18 @@ def update_legal_index(new_documents: List[Dict[str, Any]]):
         result = process_legal_document_embedding(new_documents)
         
         if result["status"] == "success":
+            # store_legal_embeddings đã bump index version (cache search cũ không còn được đọc);
+            # dọn câu trả lời dựa trên law version cũ
+            index_version = read_index_version(redis_client_web)
+            if index_version:
+                from app.services.answer_cache import build_default_answer_cache
+                answer_cache = build_default_answer_cache()
+                if answer_cache is not None:
+                    answer_cache.purge_stale(index_version)
+            
             # Update index metadata
             update_metadata = {
+                "version": index_version,
                 "last_updated": time.time(),
                 "document_count": result["processed_count"],
                 "model_version": cfg_settings.EMBEDDING_MODEL
@@ -333,7 +421,9 @@ def legal_embedding_health_check():
             "embedding_model": cfg_settings.EMBEDDING_MODEL,
             "vector_collections": len(collections.collections),
             "redis_cache": "connected",
-            "test_embedding_shape": len(test_embedding['dense_vecs'][0])
+            "test_embedding_shape": len(test_embedding['dense_vecs'][0]),
+            "embedding_cache": embedding_model.cache_stats(),
+            "embedding_requests": embedding_model.remote_stats()
         }
         
     except Exception as e:
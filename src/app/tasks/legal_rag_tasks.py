@@ -6,9 +6,11 @@ from app.celery_config import celery_app
 from app.config.database import messages_col, redis_client_web, redis_client_retrieval, redis_client_streaming
 from app.config.settings import cfg_settings
 from app.utils.utils_essential import current_time
+from app.services.answer_cache import build_default_answer_cache
+from app.services.context_packer import ContextPacker
 import requests
 # import google.generativeai as genai  # Commented out for lightweight deployment
-from typing import List, Dict
+from typing import List, Dict, Optional
 from uuid import uuid5, NAMESPACE_DNS
 import os
 import json
@@ -25,6 +27,12 @@ import traceback
 # Initialize OpenAI client
 openai_client = OpenAI(api_key=cfg_settings.OPENAI_API_KEY)
 
+# Token-budgeted prompt context
+context_packer = ContextPacker(budget=cfg_settings.CONTEXT_TOKEN_BUDGET)
+
+# Semantic answer-reuse cache (chat_questions)
+answer_cache = build_default_answer_cache()
+
 # Initialize Gemini model
 # gemini_model = genai.GenerativeModel("gemini-1.5-flash")  # Commented out for lightweight deployment
 
@@ -38,9 +46,15 @@ def generate_legal_response(
     user_id: str, 
     user_message: str, 
     using_web_search: bool = False, 
-    using_retrieval: bool = False
+    using_retrieval: bool = False,
+    legal_documents: Optional[List[Dict]] = None,
+    reuse_question: Optional[str] = None
 ):
-    """Generate response for legal queries with environment-based configuration"""
+    """
+    Generate response for legal queries with environment-based configuration
+    legal_documents: chunks đã lấy inline qua /api/rag/search/inline (bỏ qua polling Redis)
+    reuse_question: câu hỏi gốc của lượt mở đầu hội thoại; chỉ khi có mới index câu trả lời vào answer cache
+    """
     logger.info(f"[LEGAL_RAG] Processing query from user={user_id} in conversation={conversation_id}")
     
     try:
@@ -54,14 +68,16 @@ def generate_legal_response(
             ]))
 
         # Step 1: Legal document retrieval
-        legal_documents = []
-        if using_retrieval:
+        if legal_documents is not None:
+            logger.info(f"Using {len(legal_documents)} legal documents from inline search")
+        elif using_retrieval:
             retrieval_start_time = time.time()
             logger.info("🔍 Legal retrieval enabled, fetching documents from Redis...")
             legal_documents = wait_for_legal_chunks(redis_client_retrieval, key="retrieval_chunks", timeout=30)
             logger.info(f"Retrieved {len(legal_documents)} legal documents in {time.time() - retrieval_start_time:.2f}s")
-            if legal_documents:
-                logger.info(f"Sample legal document: {legal_documents[0]['text'][:300]}")
+        legal_documents = legal_documents or []
+        if legal_documents:
+            logger.info(f"Sample legal document: {legal_documents[0]['text'][:300]}")
 
         # Step 2: Web search results
         web_results = []
@@ -84,7 +100,7 @@ def generate_legal_response(
         )
 
         # Step 4: Save response to database
-        save_legal_response(conversation_id, user_id, user_message, final_response)
+        save_legal_response(conversation_id, user_id, user_message, final_response, reuse_question=reuse_question)
         redis_client_web.delete("web_search_chunks")
         redis_client_retrieval.delete("retrieval_chunks")
 
@@ -158,9 +174,12 @@ def generate_comprehensive_legal_response_stream(
 ) -> str:
     """Generate legal response with streaming to Redis and return final text"""
 
-    legal_context = build_legal_context(legal_documents)
-    web_context = build_web_context(web_results)
-    history_context = build_history_context(conversation_history)
+    # Chọn nội dung theo budget token thay vì theo số lượng
+    packed = context_packer.pack(user_message, legal_documents, web_results, conversation_history)
+    logger.info(f"Packed prompt context: {ContextPacker.stats(packed)}")
+    legal_context = build_legal_context(packed.legal)
+    web_context = build_web_context(packed.web)
+    history_context = build_history_context(packed.history)
     
     legal_prompt = create_legal_prompt(
         user_message, 
@@ -180,7 +199,7 @@ def generate_comprehensive_legal_response_stream(
                 {"role": "user", "content": legal_prompt}
             ],
             temperature=0.3,
-            max_tokens=5000,
+            max_tokens=cfg_settings.LLM_MAX_TOKENS,
             stream=True
         )
 
@@ -202,34 +221,34 @@ def generate_comprehensive_legal_response_stream(
         
 
 def build_legal_context(legal_documents: List[Dict]) -> str:
-    """Build context from legal documents"""
+    """Build context from legal documents (đã được ContextPacker chọn theo budget)"""
     if not legal_documents:
         return ""
     
     context_parts = []
-    for i, doc in enumerate(legal_documents[:5]):  # Limit to top 5
+    for i, doc in enumerate(legal_documents):
         context_parts.append(f"[Tài liệu {i+1}]: {doc.get('text', '')}")
     
     return "\n\n".join(context_parts)
 
 def build_web_context(web_results: List[Dict]) -> str:
-    """Build context from web search results"""
+    """Build context from web search results (đã được ContextPacker chọn theo budget)"""
     if not web_results:
         return ""
     
     context_parts = []
-    for i, result in enumerate(web_results[:3]):  # Limit to top 3
+    for i, result in enumerate(web_results):
         context_parts.append(f"[Web {i+1}]: {result.get('text', '')}")
     
     return "\n\n".join(context_parts)
 
 def build_history_context(conversation_history: List[Dict]) -> str:
-    """Build context from conversation history"""
+    """Build context from conversation history (đã được ContextPacker chọn theo budget)"""
     if not conversation_history:
         return ""
     
     history_parts = []
-    for msg in conversation_history[-4:]:  # Last 4 messages
+    for msg in conversation_history:
         role = "Người dùng" if msg['role'] == 'user' else "Trợ lý"
         history_parts.append(f"{role}: {msg['text']}")
     
@@ -281,10 +300,19 @@ def create_legal_prompt(
     
     return "\n".join(prompt_parts)
 
-def save_legal_response(conversation_id: str, user_id: str, question: str, response: str):
-    """Save legal response to database"""
+def save_legal_response(
+    conversation_id: str,
+    user_id: str,
+    question: str,
+    response: str,
+    reuse_question: Optional[str] = None
+):
+    """
+    Save legal response to database.
+    reuse_question: câu hỏi gốc (lượt mở đầu) → index câu trả lời vào answer-reuse cache dưới đúng key lookup
+    """
     try:
-        messages_col.insert_one({
+        result = messages_col.insert_one({
             "conversation_id": conversation_id,
             "user_id": user_id,
             "role": "assistant",
@@ -297,6 +325,15 @@ def save_legal_response(conversation_id: str, user_id: str, question: str, respo
         logger.info(f"Saved legal response for conversation {conversation_id}")
     except Exception as e:
         logger.error(f"Error saving legal response: {str(e)}")
+        return
+
+    if reuse_question and answer_cache is not None:
+        answer_cache.index(
+            reuse_question,
+            response,
+            message_id=str(result.inserted_id),
+            conversation_id=conversation_id
+        )
 
 def publish_legal_response(conversation_id: str, response: str):
     """Publish legal response to Redis for real-time streaming"""
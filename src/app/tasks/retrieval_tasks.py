@@ -4,17 +4,29 @@ import json
 import redis
 from app.celery_config import celery_app
 from app.services.rag_service import LegalRAGService
-from typing import List
+from app.config.settings import cfg_settings
+from typing import Any, Dict, List, Optional
 
 rag_service = LegalRAGService()
 from app.config.database import redis_client_retrieval
 logger = logging.getLogger(__name__)
 
 @celery_app.task(name="app.tasks.retrieval_tasks.retrieval_document", queue="retrieval_queue")
-def retrieval_document(query: str):
+def retrieval_document(query: str, queries: Optional[List[str]] = None, filters: Optional[Dict[str, Any]] = None):
     logger.info(f"Retrieving chunks for query: {query}")
     start_time = time.time()
-    chunks = rag_service.search("legal_documents_collection", query)
+    sub_queries = list(dict.fromkeys([query] + (queries or [])))
+    top_k = cfg_settings.RETRIEVAL_TOP_K
+    limit = rag_service.candidate_limit(top_k)
+    if len(sub_queries) > 1:
+        # Multi-part question: one embedding call + one Qdrant batch query, fused with RRF
+        logger.info(f"Fan-out retrieval over {len(sub_queries)} sub-queries")
+        chunks = rag_service.search_many(cfg_settings.LEGAL_COLLECTION, sub_queries, limit=limit, filters=filters)
+    else:
+        chunks = rag_service.search(cfg_settings.LEGAL_COLLECTION, query, limit=limit, filters=filters)
+    deadline = time.monotonic() + cfg_settings.RERANK_BUDGET_MS / 1000
+    chunks = rag_service.refine(cfg_settings.LEGAL_COLLECTION, sub_queries, chunks, top_k, deadline=deadline)
+    chunks = rag_service.expand(cfg_settings.LEGAL_COLLECTION, chunks)
     duration = time.time() - start_time
     logger.info(f"Retrieval completed in {duration:.2f} seconds")
     saved_count = save_chunks_to_redis(chunks)
@@ -0,0 +1,19 @@
+"""
+Dùng module thuần của src/app (app.services.*, app.config.settings) ngoài process app: indexer, benchmark.
+`import app` chạy app/__init__ → main (FastAPI, Celery, retrieval_tasks, logger JSON ra stdout),
+nên `app` được đăng ký như namespace package trỏ vào src/app và chỉ các module được import mới chạy.
+"""
+import os
+import sys
+import types
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def register_app_package():
+    """Idempotent; không làm gì nếu package app thật đã được import (trong process app)"""
+    if "app" in sys.modules:
+        return
+    package = types.ModuleType("app")
+    package.__path__ = [os.path.join(SRC_DIR, "app")]
+    sys.modules["app"] = package
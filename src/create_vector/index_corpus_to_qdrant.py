@@ -1,84 +1,200 @@
-import pandas as pd
-import re
-import os
-from tqdm import tqdm
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams, Distance, PointStruct
-from FlagEmbedding import BGEM3FlagModel
-
-def get_qdrant_url():
-    """Get Qdrant URL with environment support"""
-    if os.getenv("KUBERNETES_SERVICE_HOST"):
-        namespace = os.getenv('NAMESPACE', 'default')
-        return f"http://qdrant.{namespace}.svc.cluster.local:6333"
-    
-    # For Docker Compose, try to resolve qdrant hostname
-    try:
-        import socket
-        socket.gethostbyname('qdrant')
-        return "http://qdrant:6333"
-    except:
-        return "http://localhost:6333"
-
-def create_fixed_chunks(text, max_word_count=400):
-    sentences = re.split(r'(?<=[.!?]) +', text)
-    chunks, current_chunk, word_count = [], "", 0
-    for sentence in sentences:
-        wc = len(sentence.split())
-        if word_count + wc > max_word_count:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk, word_count = sentence, wc
-        else:
-            current_chunk += " " + sentence if current_chunk else sentence
-            word_count += wc
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    return chunks
+"""
+Index corpus luật (cid, text) vào Qdrant bằng BGE-M3
 
+    python index_corpus_to_qdrant.py --corpus D:\\Data\\Legal-Retrieval\\data\\corpus.csv --collection law_corpus_bge
+    python index_corpus_to_qdrant.py --corpus corpus.csv --batch-size 64 --max-batch-tokens 32768 --upload-workers 8
+    python index_corpus_to_qdrant.py --corpus corpus.parquet --resume --batch-rows 500 --max-memory 4096
+    python index_corpus_to_qdrant.py --corpus corpus.csv --processes auto   # node CPU: N process chunk + encode
+    python index_corpus_to_qdrant.py --corpus corpus.csv --store embeddings/bge-m3            # lưu vector ra đĩa
+    python index_corpus_to_qdrant.py --corpus corpus.csv --store embeddings/bge-m3 --from-store --collection law_corpus_bge_v4
 
+Mặc định blue/green: index vào version mới <collection>__v<N>, kiểm tra self-recall rồi trỏ alias <collection>
+sang version đó (collection đang phục vụ không bị đụng tới; version trước giữ lại để rollback).
+Lần đầu trên collection vật lý cũ cùng tên (legacy) cần --replace-legacy: collection đó bị xoá lúc swap.
+--resume giữ collection đang phục vụ và chỉ index phần thay đổi so với manifest
+(văn bản mới / đã sửa; văn bản bị gỡ khỏi corpus thì xoá point). Point id tất định nên chạy lại an toàn.
+--recreate xoá và tạo lại collection tại chỗ (mất dữ liệu đang phục vụ).
+Corpus (CSV / Parquet / JSONL) được đọc theo batch; run bị ngắt thì --resume tiếp tục từ checkpoint.
+--store lưu vector đã encode (shard .npy memory-map, key = hash chunk); --from-store chỉ chunk corpus rồi
+upload vector từ store vào collection (không load model), dùng khi đổi cấu hình collection / payload.
+"""
+import argparse
 
-def index_corpus_to_qdrant(corpus_path: str, collection_name: str):
-    # Load data
-    df = pd.read_csv(corpus_path)
-    print(f"Loaded {len(df)} corpus entries")
+from app_modules import register_app_package
+from manifest import IndexManifest
+from pipeline import VECTOR_SIZE, PipelineConfig, connect, ensure_collection, get_qdrant_url, print_report, run_pipeline
+from sources import detect_format, iter_record_batches, source_key
+from workers import WorkerSettings, resolve_processes, run_pipeline_processes, worker_threads
 
-    # Init model
-    model = BGEM3FlagModel("BAAI/bge-m3", use_fp16=True)
+register_app_package()
+from app.services.embedding_store import DTYPES, EmbeddingStore  # noqa: E402
+# Quy ước version / alias dùng chung với python -m app.qdrant_admin (versions / rollback / rebuild)
+from app.services.collection_versions import (  # noqa: E402
+    alias_target,
+    is_legacy_collection,
+    live_collection,
+    next_version,
+    prune_versions,
+    smoke_check,
+    swap_alias,
+)
 
-    # Init Qdrant with proper URL resolution
-    qdrant_url = get_qdrant_url()
-    print(f"🔗 Connecting to Qdrant at: {qdrant_url}")
-    qdrant = QdrantClient(url=qdrant_url)
+DEFAULT_CORPUS = r"D:\Data\Legal-Retrieval\data\corpus.csv"
 
-    # Create collection
-    vector_size = 1024  # BGEM3 output dim
-    qdrant.recreate_collection(
-        collection_name=collection_name,
-        vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
-    )
 
-    # Build points
-    points = []
-    point_id = 0
-    for row in tqdm(df.itertuples(), total=len(df)):
-        chunks = create_fixed_chunks(row.text)
-        for i, chunk in enumerate(chunks):
-            vec = model.encode(chunk)["dense_vecs"]
-            payload = {
-                "cid": int(row.cid),
-                "chunk_index": i,
-                "text": chunk
-            }
-            points.append(PointStruct(id=point_id, vector=vec, payload=payload))
-            point_id += 1
-
-    # Upsert to Qdrant
-    print(f"Uploading {len(points)} vectors to Qdrant...")
-    qdrant.upsert(collection_name=collection_name, points=points)
+def build_parser(collection_name="law_corpus_bge", resume=False):
+    parser = argparse.ArgumentParser(description="Index legal corpus into Qdrant (chunk → encode → upload pipeline)")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Corpus .csv/.parquet/.jsonl (cid, text, metadata)")
+    parser.add_argument("--batch-rows", type=int, default=1000, help="Corpus records read per batch")
+    parser.add_argument("--max-memory", type=int, help="Pause ingestion above this RSS (MB)")
+    parser.add_argument("--collection", default=collection_name)
+    parser.add_argument("--qdrant-url", help="Default: resolved from environment (K8s / Docker / localhost)")
+    parser.add_argument("--grpc", action="store_true", help="Use gRPC for uploads")
+    parser.add_argument("--model", default="BAAI/bge-m3")
+    parser.add_argument("--no-fp16", dest="fp16", action="store_false")
+    parser.add_argument("--max-words", type=int, default=400, help="Words per chunk")
+    parser.add_argument("--batch-size", type=int, default=32, help="Max chunks per encode call")
+    parser.add_argument("--max-batch-tokens", type=int, default=16384, help="Max padded tokens per encode call")
+    parser.add_argument("--max-length", type=int, default=1024, help="Tokenizer truncation length")
+    parser.add_argument("--sort-window", type=int, default=1024, help="Chunks buffered for length sorting")
+    parser.add_argument("--upload-batch", type=int, default=256, help="Points per upload_points call")
+    parser.add_argument("--upload-workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=8, help="Max batches buffered between stages")
+    parser.add_argument("--processes", default="0",
+                        help="Chunk + encode in N CPU worker processes (`auto` = one per core; 0 = single model)")
+    parser.add_argument("--manifest", default="index_manifest.sqlite", help="SQLite manifest of indexed chunks")
+    parser.add_argument("--no-prune", dest="prune", action="store_false",
+                        help="Keep points of documents no longer in the corpus")
+    parser.add_argument("--store", help="Embedding store dir (memory-mapped .npy shards keyed by chunk hash)")
+    parser.add_argument("--store-dtype", choices=DTYPES, default="float32", help="dtype of a new embedding store")
+    parser.add_argument("--from-store", action="store_true",
+                        help="Upload vectors from --store only, without loading the model")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--resume", dest="mode", action="store_const", const="resume",
+                      help="Keep the serving collection, index only changes")
+    mode.add_argument("--blue-green", dest="mode", action="store_const", const="blue-green",
+                      help="Index into a new version, then swap the alias (default without --resume)")
+    mode.add_argument("--recreate", dest="mode", action="store_const", const="recreate",
+                      help="Drop and recreate the collection in place")
+    parser.add_argument("--keep-versions", type=int, default=2, help="Versions kept after a blue/green swap")
+    parser.add_argument("--min-recall", type=float, default=0.9, help="Self-recall@10 required to swap the alias")
+    parser.add_argument("--replace-legacy", action="store_true",
+                        help="Blue/green over a legacy physical collection: delete it at swap time (no rollback copy)")
+    parser.set_defaults(mode="resume" if resume else "blue-green")
+    return parser
+
+
+def index_corpus_to_qdrant(args):
+    fmt = detect_format(args.corpus)
+    if args.from_store and not args.store:
+        raise SystemExit("--from-store requires --store")
+    processes = 0 if args.from_store else resolve_processes(args.processes)
+    store = None
+    if args.store:
+        store = EmbeddingStore(args.store, model=args.model, dim=VECTOR_SIZE, dtype=args.store_dtype,
+                               read_only=args.from_store)
+        print(f"💾 Embedding store {args.store}: {len(store)} vectors ({store.dtype})")
+
+    qdrant = connect(args.qdrant_url, prefer_grpc=args.grpc)
+    alias = args.collection
+    if args.mode == "blue-green" and is_legacy_collection(qdrant, alias) and not args.replace_legacy:
+        # kiểm tra trước khi index: swap sẽ phải xoá collection đang phục vụ
+        raise SystemExit(
+            f"❌ `{alias}` is a physical collection, not an alias. Blue/green would delete it at swap time "
+            f"(short outage, no rollback copy): rerun with --replace-legacy, or use --resume"
+        )
+
+    # Init model (chế độ --processes: mỗi worker tự load model; --from-store: không cần model)
+    model = None
+    if not processes and not args.from_store:
+        from FlagEmbedding import BGEM3FlagModel
+        model = BGEM3FlagModel(args.model, use_fp16=args.fp16)
+
+    if args.mode == "blue-green":
+        collection = next_version(qdrant, alias)
+        print(f"🔵 Building {collection}; `{alias}` keeps serving {live_collection(qdrant, alias)}")
+    else:
+        collection = alias_target(qdrant, alias) or alias  # manifest theo collection vật lý
+    manifest = IndexManifest(args.manifest, collection)
+    if ensure_collection(qdrant, collection, recreate=args.mode == "recreate"):
+        manifest.reset()  # collection rỗng → manifest cũ không còn đúng
+
+    source = source_key(args.corpus)
+    start_row = manifest.checkpoint(source) if args.mode == "resume" else 0
+    print(f"📖 Streaming {fmt} corpus {args.corpus} from row {start_row} ({args.batch_rows} rows / batch)")
+
+    config = PipelineConfig(
+        collection_name=collection,
+        manifest=manifest,
+        max_words=args.max_words,
+        batch_size=args.batch_size,
+        max_batch_tokens=args.max_batch_tokens,
+        max_length=args.max_length,
+        sort_window=args.sort_window,
+        upload_batch=args.upload_batch,
+        upload_workers=args.upload_workers,
+        queue_size=args.queue_size,
+        prune=args.prune,
+        max_memory_mb=args.max_memory,
+        source_key=source,
+        start_row=start_row,
+        store=store
+    )
+    batches = iter_record_batches(args.corpus, args.batch_rows, skip_rows=start_row, fmt=fmt)
+    try:
+        if processes:
+            settings = WorkerSettings(
+                model_name=args.model,
+                manifest_path=args.manifest,
+                collection_name=collection,
+                qdrant_url=args.qdrant_url or get_qdrant_url(),
+                prefer_grpc=args.grpc,
+                max_words=args.max_words,
+                batch_size=args.batch_size,
+                max_batch_tokens=args.max_batch_tokens,
+                max_length=args.max_length,
+                threads=worker_threads(processes),
+                store_path=args.store
+            )
+            print(f"🧵 {processes} worker processes × {settings.threads} threads")
+            report = run_pipeline_processes(batches, qdrant, config, settings, processes)
+        else:
+            report = run_pipeline(batches, model, qdrant, config)
+        if args.mode == "blue-green":
+            promote(qdrant, alias, collection, args)
+    finally:
+        if store is not None:
+            store.close()
+        manifest.close()
+    print_report(report)
+    if report["incremental"]["vectors_missing"]:
+        print(f"⚠️ {report['incremental']['vectors_missing']} chunks not in the embedding store were skipped; "
+              f"rerun without --from-store to encode them")
     print("✅ Done indexing corpus into Qdrant.")
+    return report
+
+
+def promote(qdrant, alias, collection, args):
+    """Self-recall của version mới đạt ngưỡng → swap alias, dọn version cũ (kèm manifest của chúng)"""
+    check = smoke_check(qdrant, collection, min_recall=args.min_recall)
+    print(f"🔬 {collection}: {check['count']} points, self-recall@{check['k']} = {check['self_recall']:.3f}")
+    if not check["passed"]:
+        raise SystemExit(
+            f"❌ Smoke check failed (self-recall < {args.min_recall} or empty); "
+            f"`{alias}` unchanged, {collection} kept for inspection"
+        )
+    previous = swap_alias(qdrant, alias, collection, replace_legacy=args.replace_legacy)
+    print(f"🔀 {alias}: {previous} → {collection}")
+    for name in prune_versions(qdrant, alias, keep=args.keep_versions):
+        old = IndexManifest(args.manifest, name)
+        old.reset()
+        old.close()
+        print(f"🗑️ Deleted old version {name}")
+
+
+def main(argv=None, **defaults):
+    return index_corpus_to_qdrant(build_parser(**defaults).parse_args(argv))
 
-corpus_csv = r"D:\Data\Legal-Retrieval\data\corpus.csv"
-collection_name = "law_corpus_bge"
 
-index_corpus_to_qdrant(corpus_csv, collection_name)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Manifest SQLite của các chunk đã index (theo collection)
+
+- point id tất định: uuid5(cid, chunk_index, content_hash) → chạy lại / resume không trùng id
+- documents: hash text + hash metadata của từng cid → văn bản không đổi bị bỏ qua, không gọi Qdrant
+- chunks: content_hash + point_id của từng chunk → biết point nào cần xoá khi văn bản đổi / bị gỡ
+- checkpoints: số dòng corpus đã index xong (theo file nguồn) → chạy lại bỏ qua phần đầu mà không cần đọc lại
+Manifest chỉ được ghi sau khi upload thành công, nên run bị ngắt giữa chừng chỉ làm lại phần chưa xong.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import NAMESPACE_URL, uuid5
+
+POINT_NAMESPACE = uuid5(NAMESPACE_URL, "legal-retrieval/law-corpus")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def document_hash(text: str, max_words: int) -> str:
+    """Cách chia chunk là một phần của hash: đổi --max-words → index lại"""
+    return content_hash(f"{max_words}\x00{text}")
+
+
+def metadata_hash(metadata: dict) -> str:
+    return content_hash(json.dumps(metadata, sort_keys=True, ensure_ascii=False))
+
+
+def point_uuid(cid: int, chunk_index: int, chunk_hash: str) -> str:
+    return str(uuid5(POINT_NAMESPACE, f"{cid}:{chunk_index}:{chunk_hash}"))
+
+
+class IndexManifest:
+    """Thread-safe (một connection, khoá chung) — producer đọc, uploader ghi"""
+
+    def __init__(self, path: str, collection_name: str):
+        self.collection_name = collection_name
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                collection TEXT, cid INTEGER, doc_hash TEXT, meta_hash TEXT,
+                PRIMARY KEY (collection, cid)
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                collection TEXT, cid INTEGER, chunk_index INTEGER, content_hash TEXT, point_id TEXT,
+                PRIMARY KEY (collection, cid, chunk_index)
+            );
+            CREATE INDEX IF NOT EXISTS chunks_by_hash ON chunks (collection, content_hash);
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                collection TEXT, source TEXT, rows INTEGER,
+                PRIMARY KEY (collection, source)
+            );
+        """)
+
+    def reset(self):
+        """Collection bị tạo lại → quên toàn bộ trạng thái của nó"""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM documents WHERE collection = ?", (self.collection_name,))
+            self._db.execute("DELETE FROM chunks WHERE collection = ?", (self.collection_name,))
+            self._db.execute("DELETE FROM checkpoints WHERE collection = ?", (self.collection_name,))
+
+    def documents(self, cids: Iterable[int]) -> Dict[int, Tuple[str, str]]:
+        """cid → (doc_hash, meta_hash) của các văn bản đã index xong (tra theo batch bản ghi)"""
+        cids = list(set(cids))
+        found: Dict[int, Tuple[str, str]] = {}
+        with self._lock:
+            for start in range(0, len(cids), 500):  # giới hạn số biến của SQLite
+                batch = cids[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT cid, doc_hash, meta_hash FROM documents WHERE collection = ? "
+                    f"AND cid IN ({','.join('?' * len(batch))})",
+                    [self.collection_name, *batch]
+                ).fetchall()
+                found.update((cid, (doc_hash, meta_hash)) for cid, doc_hash, meta_hash in rows)
+        return found
+
+    def chunks(self, cid: int) -> Dict[int, Tuple[str, str]]:
+        """chunk_index → (content_hash, point_id) đã index của một văn bản"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT chunk_index, content_hash, point_id FROM chunks WHERE collection = ? AND cid = ?",
+                (self.collection_name, cid)
+            ).fetchall()
+        return {index: (chunk_hash, point_id) for index, chunk_hash, point_id in rows}
+
+    def points_for_hashes(self, hashes: Iterable[str]) -> Dict[str, str]:
+        """content_hash → một point đang có cùng nội dung (để lấy lại vector thay vì encode)"""
+        hashes = list(set(hashes))
+        found: Dict[str, str] = {}
+        with self._lock:
+            for start in range(0, len(hashes), 500):  # giới hạn số biến của SQLite
+                batch = hashes[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT content_hash, point_id FROM chunks WHERE collection = ? "
+                    f"AND content_hash IN ({','.join('?' * len(batch))})",
+                    [self.collection_name, *batch]
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def commit_documents(self, documents: List["DocumentUpdate"]):
+        """Ghi các văn bản đã upload xong (một transaction)"""
+        if not documents:
+            return
+        with self._lock, self._db:
+            for doc in documents:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO documents (collection, cid, doc_hash, meta_hash) VALUES (?, ?, ?, ?)",
+                    (self.collection_name, doc.cid, doc.doc_hash, doc.meta_hash)
+                )
+                self._db.execute(
+                    "DELETE FROM chunks WHERE collection = ? AND cid = ? AND chunk_index >= ?",
+                    (self.collection_name, doc.cid, doc.n_chunks)
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO chunks (collection, cid, chunk_index, content_hash, point_id) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(self.collection_name, doc.cid, index, chunk_hash, point_id)
+                     for index, (chunk_hash, point_id) in doc.chunks.items()]
+                )
+
+    def removed_documents(self, seen_cids: set) -> List[int]:
+        """cid có trong manifest nhưng không còn trong corpus"""
+        with self._lock:
+            cursor = self._db.execute("SELECT cid FROM documents WHERE collection = ?", (self.collection_name,))
+            return [cid for (cid,) in cursor if cid not in seen_cids]
+
+    def forget(self, cids: Iterable[int]):
+        with self._lock, self._db:
+            for cid in cids:
+                self._db.execute("DELETE FROM documents WHERE collection = ? AND cid = ?", (self.collection_name, cid))
+                self._db.execute("DELETE FROM chunks WHERE collection = ? AND cid = ?", (self.collection_name, cid))
+
+    # ---------- Checkpoints ----------
+    def checkpoint(self, source: str) -> int:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT rows FROM checkpoints WHERE collection = ? AND source = ?", (self.collection_name, source)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def save_checkpoint(self, source: str, rows: int):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO checkpoints (collection, source, rows) VALUES (?, ?, ?)",
+                (self.collection_name, source, rows)
+            )
+
+    def clear_checkpoint(self, source: str):
+        """Corpus đã index trọn vẹn → lần sau đọc lại từ đầu (để phát hiện thay đổi / văn bản bị gỡ)"""
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM checkpoints WHERE collection = ? AND source = ?", (self.collection_name, source)
+            )
+
+    def close(self):
+        self._db.close()
+
+
+class DocumentUpdate:
+    """Một văn bản đang index: chờ đủ `pending` chunk upload xong rồi mới ghi manifest + xoá point cũ"""
+
+    __slots__ = ("cid", "doc_hash", "meta_hash", "n_chunks", "chunks", "stale", "pending", "batch_no")
+
+    def __init__(self, cid: int, doc_hash: str, meta_hash: str, chunks: Dict[int, Tuple[str, str]],
+                 stale: List[str], pending: int, batch_no: int = 0):
+        self.cid = cid
+        self.doc_hash = doc_hash
+        self.meta_hash = meta_hash
+        self.n_chunks = len(chunks)
+        self.chunks = chunks
+        self.stale = stale
+        self.pending = pending
+        self.batch_no = batch_no
+
+
+class DocumentTracker:
+    """
+    Đếm chunk còn chờ upload của từng văn bản và văn bản chưa ghi manifest của từng batch bản ghi.
+    Checkpoint chỉ tiến tới cuối dải batch liên tục đã đóng (đọc hết) và đã ghi manifest xong.
+    """
+
+    def __init__(self, first_batch: int = 0):
+        self._docs: Dict[int, DocumentUpdate] = {}
+        self._outstanding: Dict[int, int] = {}  # batch_no → số văn bản chưa ghi manifest
+        self._closed: Dict[int, int] = {}       # batch_no → số dòng nguồn đã đọc tới cuối batch
+        self._next_batch = first_batch
+        self._lock = threading.Lock()
+
+    def begin(self, doc: DocumentUpdate) -> Optional[DocumentUpdate]:
+        """Trả về doc nếu không còn chunk nào phải upload (hoàn tất ngay)"""
+        with self._lock:
+            self._outstanding[doc.batch_no] = self._outstanding.get(doc.batch_no, 0) + 1
+            if doc.pending == 0:
+                return doc
+            self._docs[doc.cid] = doc
+        return None
+
+    def uploaded(self, cids: Iterable[int]) -> List[DocumentUpdate]:
+        """Ghi nhận một batch đã upload; trả về các văn bản vừa hoàn tất"""
+        finished = []
+        with self._lock:
+            for cid in cids:
+                doc = self._docs.get(cid)
+                if doc is None:
+                    continue
+                doc.pending -= 1
+                if doc.pending == 0:
+                    finished.append(self._docs.pop(cid))
+        return finished
+
+    def committed(self, documents: Iterable[DocumentUpdate]):
+        """Gọi sau khi manifest đã ghi các văn bản"""
+        with self._lock:
+            for doc in documents:
+                self._outstanding[doc.batch_no] -= 1
+
+    def close_batch(self, batch_no: int, rows_end: int):
+        with self._lock:
+            self._closed[batch_no] = rows_end
+
+    def advance(self) -> Optional[int]:
+        """Số dòng nguồn đã index xong liên tục từ đầu (None nếu checkpoint không đổi)"""
+        rows = None
+        with self._lock:
+            while self._next_batch in self._closed and not self._outstanding.get(self._next_batch):
+                rows = self._closed.pop(self._next_batch)
+                self._outstanding.pop(self._next_batch, None)
+                self._next_batch += 1
+        return rows
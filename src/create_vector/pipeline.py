@@ -0,0 +1,595 @@
+"""
+Pipeline index corpus luật vào Qdrant (dùng chung cho create_vector/ và retrival/create_vector/)
+
+    producer (chunking) ──queue──▶ encoder (batch theo độ dài token) ──queue──▶ uploader × N (upload_points)
+
+Corpus đọc theo batch bản ghi (sources.py); queue có giới hạn → stage nhanh chờ stage chậm,
+RAM tỉ lệ với kích thước batch chứ không với corpus; throughput báo theo từng stage.
+Incremental: manifest (manifest.py) bỏ qua văn bản không đổi, chunk trùng nội dung chỉ encode một lần,
+point của văn bản đã sửa / bị gỡ khỏi corpus được xoá.
+Embedding store (app/services/embedding_store.py): vector đã encode được lưu ra đĩa; model=None → chỉ upload từ store.
+"""
+import gc
+import os
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Distance, PointIdsList, PointStruct, VectorParams
+from tqdm import tqdm
+
+from app_modules import register_app_package
+from manifest import (
+    DocumentTracker,
+    DocumentUpdate,
+    IndexManifest,
+    content_hash,
+    document_hash,
+    metadata_hash,
+    point_uuid,
+)
+
+register_app_package()
+# Payload index / metadata / ước lượng token dùng chung với app (neighbor expansion, metadata filter, context packing)
+from app.services.context_packer import estimate_tokens  # noqa: E402
+from app.services.embedding_store import EmbeddingStore  # noqa: E402
+from app.services.qdrant_collections import LAW_METADATA_FIELDS, LEGAL_PAYLOAD_INDEXES, ensure_payload_indexes  # noqa: E402
+
+
+def get_qdrant_url():
+    """Get Qdrant URL with environment support"""
+    if os.getenv("KUBERNETES_SERVICE_HOST"):
+        namespace = os.getenv('NAMESPACE', 'default')
+        return f"http://qdrant.{namespace}.svc.cluster.local:6333"
+
+    # For Docker Compose, try to resolve qdrant hostname
+    try:
+        import socket
+        socket.gethostbyname('qdrant')
+        return "http://qdrant:6333"
+    except Exception:
+        return "http://localhost:6333"
+
+
+VECTOR_SIZE = 1024  # BGE-M3 dense output dim
+
+
+def ensure_collection(qdrant, collection_name, recreate=False, vector_size=VECTOR_SIZE):
+    """recreate=True: xoá và tạo lại; ngược lại giữ collection cũ (incremental). Trả về True nếu vừa tạo."""
+    exists = qdrant.collection_exists(collection_name)
+    if exists and recreate:
+        qdrant.delete_collection(collection_name)
+        exists = False
+    if not exists:
+        qdrant.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE)
+        )
+        print(f"✅ Created collection: {collection_name}")
+    else:
+        print(f"📂 Using existing collection: {collection_name}")
+    # schema tường minh: bỏ qua cache theo process (collection có thể vừa được tạo lại)
+    created = ensure_payload_indexes(qdrant, collection_name, LEGAL_PAYLOAD_INDEXES)
+    if created:
+        print(f"🔎 Created {created} payload indexes")
+    return not exists
+
+
+def row_metadata(row):
+    """Metadata văn bản (nếu corpus có cột tương ứng)"""
+    metadata = {}
+    for column in LAW_METADATA_FIELDS:
+        value = getattr(row, column, None)
+        if value is None or pd.isna(value):
+            continue
+        metadata[column] = int(value) if column == "issued_year" else str(value)
+    return metadata
+
+
+def create_fixed_chunks(text, max_word_count=400):
+    sentences = re.split(r'(?<=[.!?]) +', text)
+    chunks, current_chunk, word_count = [], "", 0
+    for sentence in sentences:
+        wc = len(sentence.split())
+        if word_count + wc > max_word_count:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+            current_chunk, word_count = sentence, wc
+        else:
+            current_chunk += " " + sentence if current_chunk else sentence
+            word_count += wc
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+def is_valid_vector(vec, dim=VECTOR_SIZE):
+    if vec is None or len(vec) != dim:
+        return False
+    return bool(np.all(np.isfinite(np.asarray(vec, dtype=np.float32))))
+
+
+# ---------- Stage stats ----------
+class StageStats:
+    """Số item + thời gian làm việc / chờ của một stage (thread-safe)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.waiting = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items, busy=0.0, waiting=0.0):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+            self.waiting += waiting
+
+    def summary(self, wall):
+        return {
+            "items": self.items,
+            "items_per_s": round(self.items / wall, 1) if wall else 0.0,
+            "busy_s": round(self.busy, 1),
+            "waiting_s": round(self.waiting, 1)
+        }
+
+
+@dataclass
+class PipelineConfig:
+    collection_name: str
+    manifest: IndexManifest
+    max_words: int = 400
+    batch_size: int = 32             # số chunk tối đa / lần encode
+    max_batch_tokens: int = 16384    # padded tokens / batch = số chunk × chunk dài nhất
+    max_length: int = 1024           # truncation của tokenizer
+    sort_window: int = 1024          # số chunk gom lại để sắp theo độ dài trước khi chia batch
+    upload_batch: int = 256
+    upload_workers: int = 4
+    queue_size: int = 8              # số batch tối đa nằm trong mỗi queue
+    prune: bool = True               # xoá văn bản đã index nhưng không còn trong corpus
+    max_memory_mb: Optional[int] = None  # RSS tối đa; vượt thì tạm dừng đọc corpus
+    source_key: Optional[str] = None     # định danh file nguồn cho checkpoint (None = không checkpoint)
+    start_row: int = 0                   # dòng bắt đầu (checkpoint của lần chạy trước)
+    store: Optional[EmbeddingStore] = None   # vector đã encode (đọc trước khi encode, ghi sau khi encode)
+    tracker: DocumentTracker = field(default_factory=DocumentTracker)
+    stats: Dict[str, StageStats] = field(default_factory=lambda: {
+        name: StageStats(name) for name in ("chunk", "encode", "upload")
+    })
+    counts: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(
+        ("rows", "documents_skipped", "chunks_skipped", "vectors_from_store", "vectors_reused", "vectors_missing",
+         "duplicates", "points_deleted", "documents_removed"), 0
+    ))
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counts[name] += n
+
+
+_DONE = object()
+
+
+# ---------- Stages ----------
+def finalize_documents(qdrant, config: PipelineConfig, documents: List[DocumentUpdate]):
+    """Chunk mới đã lên Qdrant → xoá point cũ của văn bản rồi ghi manifest"""
+    stale = [point_id for doc in documents for point_id in doc.stale]
+    if stale:
+        qdrant.delete(collection_name=config.collection_name, points_selector=PointIdsList(points=stale))
+        config.count("points_deleted", len(stale))
+    config.manifest.commit_documents(documents)
+    config.tracker.committed(documents)
+
+
+def plan_document(row, config: PipelineConfig, known: Dict[int, tuple], batch_no: int = 0) -> Optional[tuple]:
+    """
+    So văn bản với manifest: None nếu không đổi,
+    ngược lại (DocumentUpdate, chunk cần upload) — chunk giữ nguyên nội dung + vị trí thì bỏ qua.
+    """
+    cid = int(row.cid)
+    text = str(row.text)
+    metadata = row_metadata(row)
+    hashes = (document_hash(text, config.max_words), metadata_hash(metadata))
+    if known.get(cid) == hashes:
+        return None
+
+    previous = config.manifest.chunks(cid) if cid in known else {}
+    metadata_changed = cid in known and known[cid][1] != hashes[1]
+    chunks, send = {}, []
+    for i, chunk in enumerate(create_fixed_chunks(text, config.max_words)):
+        chunk_hash = content_hash(chunk)
+        point_id = point_uuid(cid, i, chunk_hash)
+        chunks[i] = (chunk_hash, point_id)
+        if not metadata_changed and previous.get(i, (None,))[0] == chunk_hash:
+            continue
+        send.append({
+            "point_id": point_id,
+            "cid": cid,
+            "chunk_index": i,
+            "text": chunk,
+            "token_count": estimate_tokens(chunk),
+            "content_hash": chunk_hash,
+            **metadata
+        })
+    stale = [point_id for i, (_, point_id) in previous.items() if chunks.get(i, (None, None))[1] != point_id]
+    config.count("chunks_skipped", len(chunks) - len(send))
+    return DocumentUpdate(cid, *hashes, chunks=chunks, stale=stale, pending=len(send), batch_no=batch_no), send
+
+
+def produce_chunks(batches, qdrant, config: PipelineConfig, queues: List[queue.Queue], stop: threading.Event,
+                   seen: set, errors: List[Exception]):
+    """
+    Đọc corpus theo batch bản ghi, chunk các văn bản mới / đã đổi (văn bản không đổi bị bỏ qua theo manifest).
+    Mỗi batch đọc xong được đóng trong tracker để checkpoint tiến lên khi các văn bản của nó đã ghi manifest.
+    """
+    stats = config.stats["chunk"]
+    out_q = queues[0]
+    rows_done = config.start_row
+    pending: List[dict] = []
+    try:
+        for batch_no, rows in enumerate(batches):
+            wait_for_memory(config, queues, stop)
+            if stop.is_set():
+                return
+            start = time.perf_counter()
+            known = config.manifest.documents(int(row.cid) for row in rows)
+            for row in rows:
+                cid = int(row.cid)
+                if cid in seen:
+                    print(f"⚠️ Duplicate cid {cid} in corpus, keeping the first row")
+                    continue
+                seen.add(cid)
+                planned = plan_document(row, config, known, batch_no)
+                if planned is None:
+                    config.count("documents_skipped")
+                    continue
+                doc, send = planned
+                if config.tracker.begin(doc) is not None:
+                    finalize_documents(qdrant, config, [doc])  # chỉ còn việc xoá chunk thừa
+                pending.extend(send)
+                if len(pending) >= config.batch_size:
+                    _put(out_q, pending, stats, stop)
+                    pending = []
+            rows_done += len(rows)
+            config.count("rows", len(rows))
+            config.tracker.close_batch(batch_no, rows_done)
+            save_checkpoint(config)
+            stats.add(0, busy=time.perf_counter() - start)
+        if pending:
+            _put(out_q, pending, stats, stop)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        out_q.put(_DONE)
+
+
+def save_checkpoint(config: PipelineConfig):
+    rows = config.tracker.advance()
+    if rows is not None and config.source_key:
+        config.manifest.save_checkpoint(config.source_key, rows)
+
+
+def current_rss_mb() -> Optional[float]:
+    """RSS hiện tại của process (Linux /proc, fallback psutil; None nếu không đo được)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil  # optional dependency
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except Exception:
+        return None
+
+
+def wait_for_memory(config: PipelineConfig, queues: List[queue.Queue], stop: threading.Event):
+    """
+    --max-memory: RSS vượt ngưỡng → tạm dừng đọc corpus cho tới khi các stage sau xả bớt queue;
+    queue đã rỗng mà vẫn vượt → dừng hẳn (batch quá lớn so với ngưỡng).
+    """
+    if not config.max_memory_mb:
+        return
+    warned = False
+    while not stop.is_set():
+        rss = current_rss_mb()
+        if rss is None or rss <= config.max_memory_mb:
+            return
+        if all(q.empty() for q in queues):
+            gc.collect()
+            rss = current_rss_mb() or 0
+            if rss > config.max_memory_mb:
+                raise MemoryError(
+                    f"RSS {rss:.0f} MB > --max-memory {config.max_memory_mb} MB with empty queues; "
+                    f"lower --batch-rows / --sort-window / --upload-batch"
+                )
+            return
+        if not warned:
+            print(f"⏸️ RSS {rss:.0f} MB > {config.max_memory_mb} MB, pausing ingestion")
+            warned = True
+        time.sleep(0.2)
+
+
+def _put(q: queue.Queue, items, stats: StageStats, stop: threading.Event):
+    """put có backpressure; thời gian bị chặn tính vào waiting của stage gửi"""
+    start = time.perf_counter()
+    while not stop.is_set():
+        try:
+            q.put(items, timeout=0.5)
+            break
+        except queue.Full:
+            continue
+    stats.add(len(items), waiting=time.perf_counter() - start)
+
+
+def token_batches(chunks: List[dict], batch_size: int, max_batch_tokens: int, max_length: int) -> List[List[dict]]:
+    """Sắp theo độ dài rồi cắt batch sao cho số chunk × chunk dài nhất (padding) ≤ max_batch_tokens"""
+    batches, current, longest = [], [], 0
+    for chunk in sorted(chunks, key=lambda c: c["token_count"]):
+        length = min(chunk["token_count"], max_length)
+        padded = (len(current) + 1) * max(longest, length)
+        if current and (len(current) >= batch_size or padded > max_batch_tokens):
+            batches.append(current)
+            current, longest = [], 0
+        current.append(chunk)
+        longest = max(longest, length)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def reuse_vectors(qdrant, config: PipelineConfig, hashes: List[str]) -> Dict[str, list]:
+    """Vector của chunk cùng nội dung đã có trong collection (chỉ đọc lại, không encode)"""
+    if qdrant is None:
+        return {}
+    existing = config.manifest.points_for_hashes(hashes)
+    if not existing:
+        return {}
+    by_point = {point_id: chunk_hash for chunk_hash, point_id in existing.items()}
+    try:
+        points = qdrant.retrieve(
+            collection_name=config.collection_name,
+            ids=list(by_point),
+            with_payload=False,
+            with_vectors=True
+        )
+    except Exception as e:
+        print(f"⚠️ Cannot fetch existing vectors, re-encoding: {e}")
+        return {}
+    return {by_point[str(point.id)]: point.vector for point in points if point.vector is not None}
+
+
+def embed_chunks(model, qdrant, config: PipelineConfig, chunks: List[dict]) -> List[tuple]:
+    """
+    Bỏ text trùng → lấy vector từ store / collection → batch theo độ dài token → model.encode.
+    Trả về (point_id, vector, payload) cho các chunk có vector hợp lệ; model=None thì chunk thiếu vector bị bỏ.
+    """
+    stats = config.stats["encode"]
+    unique: Dict[str, dict] = {}
+    for chunk in chunks:
+        unique.setdefault(chunk["content_hash"], chunk)
+    config.count("duplicates", len(chunks) - len(unique))
+
+    vectors = config.store.get(unique) if config.store is not None else {}
+    config.count("vectors_from_store", len(vectors))
+    fresh = reuse_vectors(qdrant, config, [chunk_hash for chunk_hash in unique if chunk_hash not in vectors])
+    config.count("vectors_reused", len(fresh))
+    to_encode = [chunk for chunk_hash, chunk in unique.items() if chunk_hash not in vectors and chunk_hash not in fresh]
+    if model is None:
+        config.count("vectors_missing", len(to_encode))
+        to_encode = []
+    for batch in token_batches(to_encode, config.batch_size, config.max_batch_tokens, config.max_length):
+        start = time.perf_counter()
+        encoded = model.encode(
+            [chunk["text"] for chunk in batch],
+            batch_size=len(batch),
+            max_length=config.max_length
+        )["dense_vecs"]
+        for chunk, vec in zip(batch, encoded):
+            fresh[chunk["content_hash"]] = vec
+        stats.add(0, busy=time.perf_counter() - start)
+    store_vectors(config, fresh.keys(), fresh.values())
+    vectors.update(fresh)
+
+    embedded = []
+    for chunk in chunks:
+        payload = dict(chunk)
+        point_id = payload.pop("point_id")
+        vec = vectors.get(chunk["content_hash"])
+        if vec is None and model is None:
+            continue  # không có trong store: văn bản không hoàn tất, chạy lại có model để encode
+        if not is_valid_vector(vec):
+            # văn bản không hoàn tất → không ghi manifest, lần chạy sau làm lại
+            print(f"⚠️ Invalid vector: cid={chunk['cid']}, chunk={chunk['chunk_index']}")
+            continue
+        embedded.append((point_id, vec, payload))
+    return embedded
+
+
+def store_vectors(config: PipelineConfig, hashes, vectors):
+    """Lưu vector mới encode / lấy từ collection vào store (chỉ process ghi; worker mở store read-only)"""
+    if config.store is None or config.store.read_only:
+        return
+    valid = [(chunk_hash, vec) for chunk_hash, vec in zip(hashes, vectors) if is_valid_vector(vec)]
+    if valid:
+        config.store.add(*zip(*valid))
+
+
+def put_points(out_q: queue.Queue, embedded: List[tuple], config: PipelineConfig, stats: StageStats,
+               stop: threading.Event):
+    """(point_id, vector, payload) → PointStruct, chia theo upload_batch cho uploader"""
+    points = [
+        PointStruct(id=point_id, vector=np.asarray(vec, dtype=np.float32).tolist(), payload=payload)
+        for point_id, vec, payload in embedded
+    ]
+    for start in range(0, len(points), config.upload_batch):
+        _put(out_q, points[start:start + config.upload_batch], stats, stop)
+
+
+def encode_chunks(model, qdrant, config: PipelineConfig, in_q: queue.Queue, out_q: queue.Queue,
+                  stop: threading.Event):
+    """Gom sort_window chunk → embed_chunks → PointStruct cho uploader"""
+    stats = config.stats["encode"]
+    window: List[dict] = []
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            item = in_q.get()
+            stats.add(0, waiting=time.perf_counter() - start)
+            if item is _DONE:
+                break
+            window.extend(item)
+            if len(window) >= config.sort_window:
+                put_points(out_q, embed_chunks(model, qdrant, config, window), config, stats, stop)
+                window = []
+        if window and not stop.is_set():
+            put_points(out_q, embed_chunks(model, qdrant, config, window), config, stats, stop)
+    finally:
+        for _ in range(config.upload_workers):
+            out_q.put(_DONE)
+
+
+def upload_worker(qdrant, config: PipelineConfig, in_q: queue.Queue, progress,
+                  errors: List[Exception], stop: threading.Event):
+    """upload_points (retry sẵn trong client) cho từng batch; lỗi dừng cả pipeline và được báo ở cuối"""
+    stats = config.stats["upload"]
+    while True:
+        start = time.perf_counter()
+        points = in_q.get()
+        stats.add(0, waiting=time.perf_counter() - start)
+        if points is _DONE:
+            return
+        if errors:
+            continue  # đã có lỗi: chỉ xả queue để các stage khác không bị chặn
+        start = time.perf_counter()
+        try:
+            qdrant.upload_points(
+                collection_name=config.collection_name,
+                points=points,
+                batch_size=len(points),
+                max_retries=3,
+                wait=True  # manifest chỉ ghi khi point đã được lưu
+            )
+            finished = config.tracker.uploaded(point.payload["cid"] for point in points)
+            finalize_documents(qdrant, config, finished)
+            save_checkpoint(config)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+            continue
+        stats.add(len(points), busy=time.perf_counter() - start)
+        progress.update(len(points))
+
+
+def prune_removed(qdrant, config: PipelineConfig, seen: set):
+    """Văn bản có trong manifest nhưng không còn trong corpus → xoá point + quên trong manifest"""
+    removed = config.manifest.removed_documents(seen)
+    for start in range(0, len(removed), 500):
+        cids = removed[start:start + 500]
+        point_ids = [point_id for cid in cids for _, point_id in config.manifest.chunks(cid).values()]
+        if point_ids:
+            qdrant.delete(collection_name=config.collection_name, points_selector=PointIdsList(points=point_ids))
+        config.manifest.forget(cids)
+        config.count("points_deleted", len(point_ids))
+    config.count("documents_removed", len(removed))
+
+
+def run_pipeline(batches, model, qdrant, config: PipelineConfig) -> Dict[str, dict]:
+    """
+    Chạy 3 stage song song trên các batch bản ghi (sources.iter_record_batches);
+    trả về throughput theo stage + thống kê incremental.
+    """
+    chunk_q: queue.Queue = queue.Queue(maxsize=config.queue_size)
+    point_q: queue.Queue = queue.Queue(maxsize=config.queue_size)
+    stop = threading.Event()
+    errors: List[Exception] = []
+    seen: set = set()
+    progress = tqdm(desc="Uploaded chunks", unit="chunk")
+
+    producer = threading.Thread(
+        target=produce_chunks,
+        args=(batches, qdrant, config, [chunk_q, point_q], stop, seen, errors),
+        daemon=True
+    )
+    started = time.perf_counter()
+    producer.start()
+    uploaders = start_uploaders(qdrant, config, point_q, progress, errors, stop)
+    try:
+        # Encoder chạy ở main thread (model GPU/CPU không chia sẻ giữa các thread)
+        encode_chunks(model, qdrant, config, chunk_q, point_q, stop)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        if stop.is_set():
+            _drain(chunk_q)
+        producer.join()
+        for worker in uploaders:
+            worker.join()
+        progress.close()
+
+    return finish_run(qdrant, config, seen, started, errors, stop)
+
+
+def start_uploaders(qdrant, config: PipelineConfig, point_q: queue.Queue, progress,
+                    errors: List[Exception], stop: threading.Event) -> List[threading.Thread]:
+    uploaders = [
+        threading.Thread(target=upload_worker, args=(qdrant, config, point_q, progress, errors, stop), daemon=True)
+        for _ in range(config.upload_workers)
+    ]
+    for worker in uploaders:
+        worker.start()
+    return uploaders
+
+
+def finish_run(qdrant, config: PipelineConfig, seen: set, started: float,
+               errors: List[Exception], stop: threading.Event) -> Dict[str, dict]:
+    """Báo lỗi / prune văn bản bị gỡ / xoá checkpoint, trả về report"""
+    if errors:
+        raise RuntimeError(f"Indexing failed (resume from checkpoint with --resume): {errors[0]}")
+    if stop.is_set():
+        raise RuntimeError("Pipeline stopped before the corpus was fully indexed")
+    # Bắt đầu giữa chừng (checkpoint) → không thấy hết cid, không được prune
+    if config.prune and config.start_row == 0:
+        prune_removed(qdrant, config, seen)
+    if config.source_key:
+        config.manifest.clear_checkpoint(config.source_key)
+    wall = time.perf_counter() - started
+    report = {name: stats.summary(wall) for name, stats in config.stats.items()}
+    report["wall_s"] = round(wall, 1)
+    report["incremental"] = dict(config.counts)
+    return report
+
+
+def _drain(q: queue.Queue):
+    """Gỡ chặn producer khi encoder dừng giữa chừng"""
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
+
+
+def print_report(report: Dict[str, dict]):
+    print(f"⏱️ Wall time: {report['wall_s']}s")
+    for name in ("chunk", "encode", "upload"):
+        stage = report[name]
+        print(
+            f"   {name:<7} {stage['items']:>8} items  {stage['items_per_s']:>8}/s  "
+            f"busy {stage['busy_s']}s  waiting {stage['waiting_s']}s"
+        )
+    if "incremental" in report:
+        print("   " + ", ".join(f"{name}={value}" for name, value in report["incremental"].items()))
+
+
+def connect(url: Optional[str] = None, prefer_grpc: bool = False, timeout: int = 120) -> QdrantClient:
+    url = url or get_qdrant_url()
+    print(f"🔗 Connecting to Qdrant at: {url}")
+    return QdrantClient(url=url, prefer_grpc=prefer_grpc, timeout=timeout)
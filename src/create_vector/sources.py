@@ -0,0 +1,61 @@
+"""
+Đọc corpus theo từng batch bản ghi (CSV / Parquet / JSONL) → RAM tỉ lệ với batch, không với corpus
+"""
+import os
+from typing import Iterator, List
+
+import pandas as pd
+
+FORMATS = {
+    ".csv": "csv",
+    ".tsv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+}
+
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"Unsupported corpus format `{ext}` (csv, parquet, jsonl)")
+    return FORMATS[ext]
+
+
+def source_key(path: str) -> str:
+    """Định danh file cho checkpoint: file đổi (size/mtime) → checkpoint cũ không còn hiệu lực"""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def _frames(path: str, fmt: str, batch_rows: int, skip_rows: int) -> Iterator[pd.DataFrame]:
+    if fmt == "csv":
+        sep = "\t" if path.lower().endswith(".tsv") else ","
+        # skiprows giữ dòng header (dòng 0)
+        skip = range(1, skip_rows + 1) if skip_rows else None
+        yield from pd.read_csv(path, sep=sep, chunksize=batch_rows, skiprows=skip)
+    elif fmt == "jsonl":
+        yield from pd.read_json(path, lines=True, chunksize=batch_rows)
+    else:
+        import pyarrow.parquet as pq  # optional dependency (pip install pyarrow)
+        for record_batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+            yield record_batch.to_pandas()
+
+
+def iter_record_batches(path: str, batch_rows: int = 1000, skip_rows: int = 0, fmt: str = None) -> Iterator[List]:
+    """
+    Các batch (list namedtuple như df.itertuples()) từ dòng skip_rows trở đi.
+    CSV bỏ qua phần đầu ngay lúc parse; JSONL / Parquet đọc rồi bỏ.
+    """
+    fmt = fmt or detect_format(path)
+    offset = skip_rows if fmt == "csv" else 0
+    for frame in _frames(path, fmt, batch_rows, skip_rows):
+        if offset + len(frame) <= skip_rows:
+            offset += len(frame)
+            continue
+        if offset < skip_rows:
+            frame = frame.iloc[skip_rows - offset:]
+            offset = skip_rows
+        offset += len(frame)
+        yield list(frame.itertuples(index=False))
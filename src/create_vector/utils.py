@@ -1,41 +1,10 @@
 import pandas as pd
-import re
-import os
 from tqdm import tqdm
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import VectorParams, Distance, PointStruct
 from FlagEmbedding import BGEM3FlagModel
 
-def get_qdrant_url():
-    """Get Qdrant URL with environment support"""
-    if os.getenv("KUBERNETES_SERVICE_HOST"):
-        namespace = os.getenv('NAMESPACE', 'default')
-        return f"http://qdrant.{namespace}.svc.cluster.local:6333"
-    
-    # For Docker Compose, try to resolve qdrant hostname
-    try:
-        import socket
-        socket.gethostbyname('qdrant')
-        return "http://qdrant:6333"
-    except:
-        return "http://localhost:6333"
-
-def create_fixed_chunks(text, max_word_count=400):
-    sentences = re.split(r'(?<=[.!?]) +', text)
-    chunks, current_chunk, word_count = [], "", 0
-    for sentence in sentences:
-        wc = len(sentence.split())
-        if word_count + wc > max_word_count:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk, word_count = sentence, wc
-        else:
-            current_chunk += " " + sentence if current_chunk else sentence
-            word_count += wc
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    return chunks
-
+from pipeline import create_fixed_chunks, ensure_payload_indexes, estimate_tokens, get_qdrant_url, row_metadata
 
 
 def index_corpus_to_qdrant(corpus_path: str, collection_name: str):
@@ -57,6 +26,7 @@ def index_corpus_to_qdrant(corpus_path: str, collection_name: str):
         collection_name=collection_name,
         vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
     )
+    ensure_payload_indexes(qdrant, collection_name)
 
     # Build points
     points = []
@@ -68,7 +38,9 @@ def index_corpus_to_qdrant(corpus_path: str, collection_name: str):
             payload = {
                 "cid": int(row.cid),
                 "chunk_index": i,
-                "text": chunk
+                "text": chunk,
+                "token_count": estimate_tokens(chunk),
+                **row_metadata(row)
             }
             points.append(PointStruct(id=point_id, vector=vec, payload=payload))
             point_id += 1
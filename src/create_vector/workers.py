@@ -0,0 +1,212 @@
+"""
+Chế độ multi-process cho indexer (node chỉ có CPU)
+
+    main: đọc corpus theo batch ──▶ N worker process (chunk + hash + encode, mỗi process một model)
+          ──▶ main (writer duy nhất): upload_points + manifest + checkpoint
+
+Mỗi worker dùng cores // N thread cho torch để các process không tranh core với nhau.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import numpy as np
+from tqdm import tqdm
+
+from app_modules import register_app_package
+from manifest import IndexManifest
+from pipeline import (
+    _DONE,
+    PipelineConfig,
+    connect,
+    embed_chunks,
+    finalize_documents,
+    finish_run,
+    plan_document,
+    put_points,
+    save_checkpoint,
+    start_uploaders,
+    store_vectors,
+    wait_for_memory,
+)
+
+register_app_package()
+from app.services.embedding_store import EmbeddingStore  # noqa: E402
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))  # tôn trọng CPU limit / taskset
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def resolve_processes(value) -> int:
+    """--processes: số nguyên hoặc "auto" (= số core khả dụng)"""
+    if value in (None, "", "0", 0):
+        return 0
+    if str(value).lower() == "auto":
+        return available_cores()
+    return max(1, int(value))
+
+
+@dataclass
+class WorkerSettings:
+    """Tham số picklable để mỗi process tự dựng model / manifest / Qdrant client"""
+    model_name: str
+    manifest_path: str
+    collection_name: str
+    qdrant_url: Optional[str]
+    prefer_grpc: bool
+    max_words: int
+    batch_size: int
+    max_batch_tokens: int
+    max_length: int
+    threads: int
+    store_path: Optional[str] = None
+
+
+_state: Dict[str, object] = {}
+
+
+def worker_threads(processes: int) -> int:
+    return max(1, available_cores() // max(1, processes))
+
+
+def init_worker(settings: WorkerSettings):
+    """Initializer của ProcessPoolExecutor: mỗi process một model CPU"""
+    os.environ["OMP_NUM_THREADS"] = os.environ["MKL_NUM_THREADS"] = str(settings.threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    import torch
+    torch.set_num_threads(settings.threads)
+    from FlagEmbedding import BGEM3FlagModel
+    _state["model"] = BGEM3FlagModel(settings.model_name, use_fp16=False, devices="cpu")  # fp16 không lợi trên CPU
+    _state["qdrant"] = connect(settings.qdrant_url, prefer_grpc=settings.prefer_grpc) if settings.qdrant_url else None
+    _state["settings"] = settings
+
+
+def _worker_config() -> PipelineConfig:
+    """Config riêng cho từng batch (counts/stats được trả về main để cộng dồn)"""
+    settings: WorkerSettings = _state["settings"]
+    if "manifest" not in _state:
+        _state["manifest"] = IndexManifest(settings.manifest_path, settings.collection_name)  # chỉ đọc
+        _state["store"] = EmbeddingStore(settings.store_path, read_only=True) if settings.store_path else None
+    return PipelineConfig(
+        collection_name=settings.collection_name,
+        manifest=_state["manifest"],
+        store=_state["store"],
+        max_words=settings.max_words,
+        batch_size=settings.batch_size,
+        max_batch_tokens=settings.max_batch_tokens,
+        max_length=settings.max_length
+    )
+
+
+def process_batch(batch_no: int, rows: List[dict]) -> dict:
+    """Chạy trong worker: so manifest + chunk + encode một batch bản ghi"""
+    config = _worker_config()
+    start = time.perf_counter()
+    rows = [SimpleNamespace(**row) for row in rows]
+    known = config.manifest.documents(int(row.cid) for row in rows)
+    documents, chunks = [], []
+    for row in rows:
+        planned = plan_document(row, config, known, batch_no)
+        if planned is None:
+            config.count("documents_skipped")
+            continue
+        doc, send = planned
+        documents.append(doc)
+        chunks.extend(send)
+    chunk_s = time.perf_counter() - start
+
+    embedded = embed_chunks(_state["model"], _state["qdrant"], config, chunks)
+    return {
+        "documents": documents,
+        "ids": [point_id for point_id, _, _ in embedded],
+        "vectors": np.asarray([vec for _, vec, _ in embedded], dtype=np.float32),  # một buffer thay vì list float
+        "payloads": [payload for _, _, payload in embedded],
+        "chunks": len(chunks),
+        "chunk_s": chunk_s,
+        "encode_s": config.stats["encode"].busy,
+        "counts": config.counts
+    }
+
+
+def _collect(result: dict, rows_end: int, batch_no: int, qdrant, config: PipelineConfig,
+             point_q: queue.Queue, stop: threading.Event):
+    """Main process: đăng ký văn bản với tracker, đẩy point cho uploader, đóng batch"""
+    config.stats["chunk"].add(result["chunks"], busy=result["chunk_s"])
+    config.stats["encode"].add(0, busy=result["encode_s"])
+    for name, value in result["counts"].items():
+        config.count(name, value)
+    immediate = [doc for doc in result["documents"] if config.tracker.begin(doc) is not None]
+    if immediate:
+        finalize_documents(qdrant, config, immediate)  # chỉ còn việc xoá chunk thừa
+    embedded = list(zip(result["ids"], result["vectors"], result["payloads"]))
+    store_vectors(config, (payload["content_hash"] for payload in result["payloads"]), result["vectors"])
+    put_points(point_q, embedded, config, config.stats["encode"], stop)
+    config.tracker.close_batch(batch_no, rows_end)
+    save_checkpoint(config)
+
+
+def run_pipeline_processes(batches, qdrant, config: PipelineConfig, settings: WorkerSettings,
+                           processes: int) -> Dict[str, dict]:
+    """
+    Worker process chunk + encode các batch (tối đa 2 batch / worker đang chạy),
+    main process thu kết quả theo đúng thứ tự batch rồi upload. --max-memory chỉ đo RSS của main.
+    """
+    point_q: queue.Queue = queue.Queue(maxsize=config.queue_size)
+    stop = threading.Event()
+    errors: List[Exception] = []
+    seen: set = set()
+    progress = tqdm(desc="Uploaded chunks", unit="chunk")
+    started = time.perf_counter()
+    uploaders = start_uploaders(qdrant, config, point_q, progress, errors, stop)
+    rows_done = config.start_row
+    in_flight = deque()
+    pool = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=get_context("spawn"),  # torch không an toàn với fork
+        initializer=init_worker,
+        initargs=(settings,)
+    )
+    try:
+        for batch_no, rows in enumerate(batches):
+            wait_for_memory(config, [point_q], stop)
+            if stop.is_set():
+                break
+            records = []
+            for row in rows:
+                cid = int(row.cid)
+                if cid in seen:
+                    print(f"⚠️ Duplicate cid {cid} in corpus, keeping the first row")
+                    continue
+                seen.add(cid)
+                records.append(row._asdict())
+            rows_done += len(rows)
+            config.count("rows", len(rows))
+            in_flight.append((batch_no, rows_done, pool.submit(process_batch, batch_no, records)))
+            while len(in_flight) >= processes * 2 and not stop.is_set():
+                done_no, rows_end, future = in_flight.popleft()
+                _collect(future.result(), rows_end, done_no, qdrant, config, point_q, stop)
+        while in_flight and not stop.is_set():
+            done_no, rows_end, future = in_flight.popleft()
+            _collect(future.result(), rows_end, done_no, qdrant, config, point_q, stop)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        for _ in range(config.upload_workers):
+            point_q.put(_DONE)
+        for worker in uploaders:
+            worker.join()
+        progress.close()
+    return finish_run(qdrant, config, seen, started, errors, stop)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit test cho EmbeddingBatcher (không cần Redis / Qdrant / OpenAI)
+Module được nạp theo đường dẫn file để không kéo theo app/__init__ (FastAPI, Celery).
+"""
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_spec = importlib.util.spec_from_file_location(
+    "embedding_batcher", os.path.join(ROOT, "src", "app", "services", "embedding_batcher.py")
+)
+embedding_batcher = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(embedding_batcher)
+EmbeddingBatcher = embedding_batcher.EmbeddingBatcher
+
+
+def slow_embed(texts):
+    time.sleep(0.2)  # round trip giả lập
+    return [[float(len(text))] for text in texts]
+
+
+def test_concurrent_requests_share_one_call():
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(embed, window_ms=50, max_inputs=64)
+    futures = [batcher.submit([f"query {i}", "shared"]) for i in range(10)]
+    results = [future.result(timeout=5) for future in futures]
+    assert results == [[[float(len(f"query {i}"))], [6.0]] for i in range(10)]
+    assert len(calls) == 1 and calls[0].count("shared") == 1
+
+
+def test_cancelled_awaiter_does_not_block_batch():
+    """Awaiter async bị huỷ (wait_for hết hạn) không được làm treo caller sync cùng batch"""
+    batcher = EmbeddingBatcher(slow_embed, window_ms=50, max_inputs=64)
+    sync_result = {}
+
+    def sync_caller():
+        time.sleep(0.01)  # vào cùng window với awaiter async
+        future = batcher.submit(["sync query"])
+        sync_result["vectors"] = future.result(timeout=5)
+
+    async def async_caller():
+        with_timeout = asyncio.wait_for(asyncio.wrap_future(batcher.submit(["async query"])), timeout=0.02)
+        try:
+            await with_timeout
+        except asyncio.TimeoutError:
+            return "timed out"
+        return "completed"
+
+    thread = threading.Thread(target=sync_caller)
+    thread.start()
+    assert asyncio.run(async_caller()) == "timed out"
+    thread.join(timeout=5)
+    assert sync_result["vectors"] == [[10.0]]
+
+
+def test_cancelled_before_dispatch_is_skipped():
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return [[1.0] for _ in texts]
+
+    batcher = EmbeddingBatcher(embed, window_ms=100, max_inputs=64)
+    cancelled = batcher.submit(["gone"])
+    kept = batcher.submit(["kept"])
+    assert cancelled.cancel()
+    assert kept.result(timeout=5) == [[1.0]]
+    assert calls == [["kept"]]
+
+
+def test_provider_error_reaches_every_caller():
+    def embed(texts):
+        raise RuntimeError("429")
+
+    batcher = EmbeddingBatcher(embed, window_ms=20, max_inputs=64)
+    futures = [batcher.submit([f"q{i}"]) for i in range(3)]
+    for future in futures:
+        try:
+            future.result(timeout=5)
+        except RuntimeError as e:
+            assert str(e) == "429"
+        else:
+            raise AssertionError("expected the provider error")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Unit test cho neighbor expansion với chunk bị tách thành nhiều part
+Các module thuần (không I/O) được nạp theo đường dẫn file để không kéo theo app/__init__ (FastAPI, Celery).
+"""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _load(name):
+    spec = importlib.util.spec_from_file_location(
+        f"app.services.{name}", os.path.join(ROOT, "src", "app", "services", f"{name}.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+for _name in ("sparse_encoder", "diversify", "context_packer"):
+    _load(_name)
+expansion = _load("expansion")
+
+
+def chunk(index, text, part=None, count=None, cid=7):
+    hit = {"id": f"{index}-{part}", "cid": cid, "chunk_index": index, "text": text}
+    if part is not None:
+        hit.update(part_index=part, part_count=count)
+    return hit
+
+
+def test_split_hit_requests_its_siblings():
+    needed = expansion.neighbor_requests([chunk(3, "b", part=1, count=3)], window=1)
+    assert needed == {("cid", 7): [2, 3, 4]}
+    assert expansion.neighbor_requests([chunk(3, "b")], window=1) == {("cid", 7): [2, 4]}
+
+
+def test_parts_do_not_overwrite_each_other():
+    hits = [chunk(3, "BBBB", part=1, count=3)]
+    neighbors = [
+        chunk(3, "AAAA", part=0, count=3),
+        chunk(3, "CCCC", part=2, count=3),
+        chunk(4, "next chunk"),
+    ]
+    passages = expansion.merge_passages(hits, neighbors)
+    assert len(passages) == 1
+    assert passages[0]["text"] == "AAAABBBBCCCC\nnext chunk"
+    assert passages[0]["chunk_range"] == [3, 4]
+
+
+def test_missing_part_breaks_the_run():
+    hits = [chunk(3, "AAAA", part=0, count=3), chunk(3, "CCCC", part=2, count=3)]
+    passages = expansion.merge_passages(hits, [])
+    assert [passage["text"] for passage in passages] == ["AAAA", "CCCC"]